@@ -5,21 +5,14 @@ import re
 import time
 from glob import iglob
 from os.path import join, expanduser, isdir, sep
+from os import environ
 from autoanalysis.db.dbquery import DBI
-# maintain this order of matplotlib
-# TkAgg causes Runtime errors in Thread
-import matplotlib
-
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-
-plt.style.use('seaborn-paper')
+# TkAgg causes Runtime errors in Thread - set backend for matplotlib without loading it (also used by workers)
+environ.setdefault('MPLBACKEND', 'Agg')
 import wx
-import wx.html2
 from os.path import abspath, dirname
 import glob
-from configobj import ConfigObj
-from autoanalysis.controller import EVT_RESULT, Controller
+from autoanalysis.controller import EVT_RESULT, Controller, FileIndex
 from autoanalysis.gui.appgui import ConfigPanel, FilesPanel, WelcomePanel, ProcessPanel,dlgLogViewer
 
 __version__ = '0.0.0'
@@ -88,7 +81,7 @@ class HomePanel(WelcomePanel):
         # self.m_richText1.BeginLeftIndent(20)
         self.m_richText1.Newline()
         self.m_richText1.WriteText(
-            r"Each process is described with the required input files (which need to be available in the input directory structure) and the output files which it produces. These are multi-threaded processes which will run in sequence as listed and once running their progress can be monitored. A log file is produced in the user's home directory. Interactive plots can also be produced during processing.")
+            r"Each process is described with the required input files (which need to be available in the input directory structure) and the output files which it produces. Selected processes run together as a pipeline in multiple processes - each file is passed to the next process as soon as it is ready - and once running their progress can be monitored. A log file is produced in the user's home directory. Interactive plots can also be produced during processing.")
         # self.m_richText1.EndLeftIndent()
         self.m_richText1.Newline()
         self.m_richText1.BeginBold()
@@ -388,6 +381,11 @@ class ProcessRunPanel(ProcessPanel):
         # EVT_CANCEL(self, self.stopfunc)
         # Set timer handler
         self.start = {}
+        # runs started here by id - thread, rows of processes and rows finished
+        self.runs = {}
+        self.nextrun = 1
+        # row in progress table of (run, process row)
+        self.rows = {}
 
     def loadController(self):
         self.controller = self.Parent.controller
@@ -423,28 +421,61 @@ class ProcessRunPanel(ProcessPanel):
         :return:
         """
         (count, row, i, total, process) = msg.data
+        run = msg.run
         print("\nProgress updated: ", time.ctime())
         print('count = ', count)
         status = "%d of %d files " % (i, total)
         if count == 0:
-            self.m_dataViewListCtrlRunning.AppendItem([process, count, "Pending"])
-            self.start[process] = time.time()
+            self.getRow(run, row, process)
+            if run in self.runs:
+                self.runs[run]['rows'].add(row)
+            self.start[(run, process)] = time.time()
         elif count < 0:
-            self.m_dataViewListCtrlRunning.SetValue("ERROR in process - see log file", row=row, col=2)
-            self.m_btnRunProcess.Enable()
+            listrow = self.getRow(run, row, process)
+            self.m_dataViewListCtrlRunning.SetValue("ERROR in process - see log file", row=listrow, col=2)
+            self.endRow(run, row)
         elif count < 100:
-            self.m_dataViewListCtrlRunning.SetValue(count, row=row, col=1)
-            self.m_dataViewListCtrlRunning.SetValue("Running " + status, row=row, col=2)
+            listrow = self.getRow(run, row, process)
+            self.m_dataViewListCtrlRunning.SetValue(count, row=listrow, col=1)
+            self.m_dataViewListCtrlRunning.SetValue("Running " + status, row=listrow, col=2)
             self.m_stOutputlog.SetLabelText("Running: %s ...please wait" % process)
         else:
-            if process in self.start:
-                endtime = time.time() - self.start[process]
+            if (run, process) in self.start:
+                endtime = time.time() - self.start[(run, process)]
                 status = "%s (%d secs)" % (status, endtime)
             print(status)
-            self.m_dataViewListCtrlRunning.SetValue(count, row=row, col=1)
-            self.m_dataViewListCtrlRunning.SetValue("Done " + status, row=row, col=2)
-            self.m_btnRunProcess.Enable()
+            listrow = self.getRow(run, row, process)
+            self.m_dataViewListCtrlRunning.SetValue(count, row=listrow, col=1)
+            self.m_dataViewListCtrlRunning.SetValue("Done " + status, row=listrow, col=2)
             self.m_stOutputlog.SetLabelText("Completed process %s" % process)
+            self.endRow(run, row)
+
+    def getRow(self, run, row, process):
+        """
+        Row in progress table for a process of run - rows of each run are added below earlier runs
+        :param run: id of run
+        :param row: row of process in run
+        :param process: caption
+        :return: row in table
+        """
+        if (run, row) not in self.rows:
+            self.m_dataViewListCtrlRunning.AppendItem([process, 0, "Pending"])
+            self.rows[(run, row)] = self.m_dataViewListCtrlRunning.GetItemCount() - 1
+        return self.rows[(run, row)]
+
+    def endRow(self, run, row):
+        """
+        Process of run finished or failed - Run button is enabled when all processes of the run have finished
+        :param run: id of run
+        :param row: row of process in run
+        """
+        if run not in self.runs:
+            return
+        self.runs[run]['finished'].add(row)
+        if self.runs[run]['rows'] <= self.runs[run]['finished']:
+            del self.runs[run]
+            if len(self.runs) <= 0:
+                self.m_btnRunProcess.Enable()
 
     def getFilePanel(self):
         """
@@ -461,22 +492,28 @@ class ProcessRunPanel(ProcessPanel):
 
     def OnCancelScripts(self, event):
         """
-        Find a way to stop processes
+        Cancel run of selected row in progress table or the latest run - it stops at the next file or chunk
+        and completed files are kept
         :param event:
         :return:
         """
-        self.controller.shutdown()
-        print("Cancel multiprocessor")
+        selected = self.m_dataViewListCtrlRunning.GetSelectedRow()
+        runs = [run for (run, row) in self.rows.keys() if self.rows[(run, row)] == selected and run in self.runs]
+        if len(runs) <= 0 and len(self.runs) > 0:
+            runs = [max(self.runs.keys())]
+        if len(runs) > 0 and self.runs[runs[0]]['thread'] is not None:
+            self.controller.cancel(self.runs[runs[0]]['thread'].runid)
+            self.m_stOutputlog.SetLabelText("Cancelling run ...please wait")
+        else:
+            self.m_stOutputlog.SetLabelText("No run to cancel")
         event.Skip()
 
     def OnRunScripts(self, event):
         """
-        Run selected scripts sequentially - updating progress bars
+        Run selected scripts as a pipeline - updating progress bars
         :param e:
         :return:
         """
-        # Clear processing window
-        self.m_dataViewListCtrlRunning.DeleteAllItems()
         # Disable Run button
         # self.m_btnRunProcess.Disable()
         btn = event.GetEventObject()
@@ -511,15 +548,27 @@ class ProcessRunPanel(ProcessPanel):
                 if len(filenames) <= 0:
                     raise ValueError("No files selected in Files Panel")
 
-                row = 0
-                # For each process
+                # Input directories are scanned once for all processes
+                fileindex = FileIndex()
+                # Selected processes run as a pipeline ordered by their input and output files
+                processes = []
                 for pcaption in selections:
                     for p in self.controller.processes.keys():
                         if self.controller.processes[p]['caption']==pcaption:
+                            processes.append(p)
                             break
-                    print("processname =", p)
-                    self.controller.RunProcess(self, p, outputdir,filenames, row, showplots)
-                    row = row + 1
+                print("processes =", processes)
+                # rows of run are added to processing window below earlier runs
+                run = self.nextrun
+                self.nextrun += 1
+                self.runs[run] = {'thread': None, 'rows': set(), 'finished': set()}
+                try:
+                    t = self.controller.RunPipeline(self, processes, outputdir, filenames, showplots,
+                                                    fileindex=fileindex, run=run)
+                except ValueError:
+                    del self.runs[run]
+                    raise
+                self.runs[run]['thread'] = t
 
             else:
                 if len(selections) <= 0:
@@ -548,6 +597,8 @@ class ProcessRunPanel(ProcessPanel):
 
     def OnClearWindow(self, event):
         self.m_dataViewListCtrlRunning.DeleteAllItems()
+        # rows of runs still going are added again with their next progress
+        self.rows = {}
 
 ########################################################################
 class AppMain(wx.Listbook):
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Cancel token for runs - cooperative cancellation
+    1. Each run has a token (multiprocessing Event) which is set when the run is cancelled
+    2. Worker processes get the token of their run from the pool initializer, the run thread sets it for itself
+    3. Modules call checkCancelled between files and chunks - RunCancelled is raised so the module can
+       remove partial outputs and the run stops at the next check
+
+Created on 18 Oct 2026
+
+@author: QBI Software
+"""
+
+import threading
+
+
+class RunCancelled(Exception):
+    """Run was cancelled"""
+    pass
+
+
+# token for worker process - set by pool initializer
+_token = None
+# token for run threads in this process
+_local = threading.local()
+
+
+def setToken(token):
+    """
+    Set token for this worker process - use as Pool initializer
+    :param token: multiprocessing Event or None
+    """
+    global _token
+    _token = token
+
+
+def setThreadToken(token):
+    """
+    Set token for the current thread - for modules run in the run thread
+    :param token: Event or None
+    """
+    _local.token = token
+
+
+def getToken():
+    """
+    :return: token of current thread or worker process - to pass on to reader threads
+    """
+    token = getattr(_local, 'token', None)
+    if token is None:
+        token = _token
+    return token
+
+
+def isCancelled():
+    """
+    :return: True if run of this thread or worker process has been cancelled
+    """
+    token = getToken()
+    return token is not None and token.is_set()
+
+
+def checkCancelled():
+    """
+    Stop if run has been cancelled
+    :raises RunCancelled: if cancelled
+    """
+    if isCancelled():
+        raise RunCancelled("Run cancelled")
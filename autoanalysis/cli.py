@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Command line runner - no GUI required
+    1. Loads config from autoconfig.db and processes from processes.yaml (as in App)
+    2. Finds input files in input directory and assigns groups from directory names (GROUPn in config)
+    3. Runs selected processes as a pipeline and prints progress
+    4. Unfinished runs (crashed, failed or cancelled) can be resumed from the run journal - only files
+       not done are processed
+
+Run from the top level directory: python -m autoanalysis.cli --inputdir D:\\data --outputdir D:\\output
+Resume the last unfinished run: python -m autoanalysis.cli --resume
+
+Created on 18 Oct 2026
+
+@author: QBI Software
+"""
+
+import argparse
+import re
+import sys
+from os import makedirs
+from os.path import join, dirname, abspath
+
+from autoanalysis.engine import Engine, FindFilenames
+
+RESOURCESDIR = join(abspath(dirname(__file__)), 'resources')
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='autoanalysis',
+                                     description='''\
+                Runs processes on data files in input directory without the GUI
+
+                 ''')
+    parser.add_argument('--configdb', action='store', help='Config database',
+                        default=join(RESOURCESDIR, 'autoconfig.db'))
+    parser.add_argument('--config', action='store', help='Config id in database', default='general')
+    parser.add_argument('--processfile', action='store', help='Processes definition file',
+                        default=join(RESOURCESDIR, 'processes.yaml'))
+    parser.add_argument('--processes', action='store',
+                        help='Comma separated process ids or captions to run (default all)', default='')
+    parser.add_argument('--inputdir', action='store', help='Top level directory of input files')
+    parser.add_argument('--search', action='store', help='Search text for input files (regex)', default='')
+    parser.add_argument('--outputdir', action='store', help='Output directory for batch processes')
+    parser.add_argument('--workers', action='store', type=int, help='Number of worker processes', default=None)
+    parser.add_argument('--force', action='store_true', help='Process all files even if outputs are up to date')
+    parser.add_argument('--showplots', action='store_true', help='Display popup plots', default=False)
+    parser.add_argument('--resume', action='store', type=int, nargs='?', const=0, default=None,
+                        help='Resume unfinished run from journal - runid or latest if not given')
+    return parser
+
+
+def selectProcesses(processes, text):
+    """
+    Get process ids from comma separated ids or captions
+    :param processes: processes from Engine
+    :param text: comma separated list
+    :return: list of process ids in order given
+    """
+    if len(text.strip()) <= 0:
+        return list(processes.keys())
+    captions = dict([(processes[p]['caption'].lower(), p) for p in processes])
+    selected = []
+    for name in [n.strip() for n in text.split(",") if len(n.strip()) > 0]:
+        if name in processes:
+            selected.append(name)
+        elif name.lower() in captions:
+            selected.append(captions[name.lower()])
+        else:
+            raise ValueError("Unknown process: %s" % name)
+    return selected
+
+
+def getGroups(config):
+    """
+    Group names from config in order of number eg GROUP2 before GROUP10
+    :param config: dict of config name=value
+    :return: list of group names
+    """
+    names = [c for c in config.keys() if re.match(r'GROUP\d+$', c)]
+    return [config[c] for c in sorted(names, key=lambda c: int(c[5:]))]
+
+
+class ProgressPrinter():
+    def __init__(self):
+        """
+        Prints progress of a run and keeps failed processes
+        """
+        self.failed = set()
+
+    def __call__(self, data):
+        (count, row, i, total, process) = data
+        if count < 0:
+            self.failed.add(process)
+            print("%s: ERROR" % process)
+        elif count >= 100:
+            print("%s: done (%d of %d)" % (process, i, total))
+        elif i > 0:
+            print("%s: %d%% (%d of %d)" % (process, count, i, total))
+        sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    if args.resume is None and (args.inputdir is None or args.outputdir is None):
+        parser.error("--inputdir and --outputdir are required unless resuming a run")
+    engine = Engine(args.configdb, args.config, args.processfile)
+    progress = ProgressPrinter()
+    try:
+        if args.resume is not None:
+            t = engine.ResumeRun(args.resume if args.resume > 0 else None, args.workers, callback=progress)
+            print("Resuming run %d: %d files done" % (t.journalid, len(t.resumed)))
+        else:
+            selected = selectProcesses(engine.processes, args.processes)
+            config = engine.db.getConfig(engine.currentconfig)
+            if config is None:
+                raise ValueError("Config not found in %s: %s" % (args.configdb, engine.currentconfig))
+            filenames = FindFilenames(args.inputdir, args.search, getGroups(config))
+            print("Input files: %d" % len(filenames['all']))
+            makedirs(args.outputdir, exist_ok=True)
+            t = engine.RunPipeline(selected, args.outputdir, filenames, args.showplots, args.workers,
+                                   force=args.force, callback=progress)
+            print("Run %d" % t.journalid)
+        t.wait()
+    except ValueError as e:
+        print("Error:", e)
+        return 1
+    except KeyboardInterrupt:
+        print("Cancelling - processed files are kept")
+        engine.shutdown(wait=True)
+        return 1
+    finally:
+        engine.shutdown()
+    if len(progress.failed) > 0:
+        print("Failed: %s" % ", ".join(sorted(progress.failed)))
+        return 1
+    return 0
+
+
+############### MAIN ############################
+if __name__ == "__main__":
+    sys.exit(main())
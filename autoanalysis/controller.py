@@ -1,20 +1,11 @@
 import logging
-import threading
-from glob import iglob
-from logging.handlers import RotatingFileHandler
-from multiprocessing import freeze_support, Pool
-from os import access, R_OK, mkdir
-from os.path import join, dirname, exists, split, splitext, expanduser
-from autoanalysis.db.dbquery import DBI
-import matplotlib.pyplot as plt
+from functools import partial
 import wx
-import yaml
-import importlib
-from configobj import ConfigObj
+# Processing is in the engine - names kept here for existing imports
+from autoanalysis.engine import Engine, FileIndex, CheckFilenames, FindFilenames, Manifest, Pipeline, \
+    ProcessThread, PipelineThread, RunThread, TestThread, processFile, processGroup
 
 
-# Required for dist
-freeze_support()
 # Define notification event for thread completion
 EVT_RESULT_ID = wx.NewId()
 EVT_DATA_ID = wx.NewId()
@@ -34,11 +25,13 @@ def EVT_DATA(win, func):
 class ResultEvent(wx.PyEvent):
     """Simple event to carry arbitrary result data."""
 
-    def __init__(self, data):
+    def __init__(self, data, run=None):
         """Init Result Event."""
         wx.PyEvent.__init__(self)
         self.SetEventType(EVT_RESULT_ID)
         self.data = data
+        # run in gui which the progress is for
+        self.run = run
 
 
 class DataEvent(wx.PyEvent):
@@ -51,390 +44,41 @@ class DataEvent(wx.PyEvent):
         self.data = data
 
 
-def CheckFilenames(filenames, configfiles):
-    """
-    Check that filenames are appropriate for the script required
-    :param filenames: list of full path filenames
-    :param configfiles: matching filename for script as in config
-    :return: filtered list
-    """
-    newfiles = {k: [] for k in filenames.keys() }
-    for conf in configfiles:
-        if conf.startswith('*'):
-            conf = conf[1:]
-        for group in filenames.keys():
-            for f in filenames[group]:
-                parts = split(f)
-                if conf in parts[1]:
-                    newfiles[group].append(f)
-                else:
-                    # extract directory and seek files
-                    newfiles[group] = newfiles[group] + [y for y in iglob(join(parts[0], '**', conf), recursive=True)]
-                    if len(newfiles[group]) <=0:
-                        newfiles[group] = newfiles[group] + [y for y in
-                                                             iglob(join(parts[0], '**', '*'+conf), recursive=True)]
-
-    # if self.filesIn is not None:
-    #     checkedfilenames = CheckFilenames(self.filenames, self.filesIn)
-    #     files = [f for f in checkedfilenames if self.controller.datafile in f]
-    # else:
-    #     files = self.filenames
-    return newfiles
+def PostResult(wxObject, data, run=None):
+    """Send progress from engine to gui as ResultEvent."""
+    wx.PostEvent(wxObject, ResultEvent(data, run))
 
 
 ########################################################################
 
-lock = threading.Lock()
-event = threading.Event()
-hevent = threading.Event()
-####################################################################################################
-class TestThread(threading.Thread):
-    def __init__(self, controller, filenames, outputdir, output, processname, module,classname, config):
-        """Init Worker Thread Class."""
-        threading.Thread.__init__(self)
-        self.controller = controller
-        self.filenames = filenames
-        self.output = output
-        self.processname = processname
-        self.module_name = module
-        self.class_name = classname
-        self.outputdir = outputdir
-        self.config = config
-
-    def run(self):
-        i = 0
-        try:
-            event.set()
-            lock.acquire(True)
-            # Do work
-            q = dict()
-            files = self.filenames
-            total_files = len(files)
-
-            # Loop through each
-            for i in range(total_files):
-                count = ((i + 1) * 100) / total_files
-                msg ="%s run: count=%d of %d (%d\%)" % (self.processname,i,total_files,count)
-                print(msg)
-                self.processData(files[i], q)
-
-        except Exception as e:
-            print(e)
-        finally:
-            print('Finished TestThread')
-            # self.terminate()
-            lock.release()
-            event.clear()
-
-    def processData(self, filename, q):
-        """
-        Activate filter process - multithreaded
-        :param datafile:
-        :param q:
-        :return:
-        """
-        print("Process Data for file: ", filename)
-
-        # create local subdir for output
-        if self.output == 'local':
-            outputdir = join(dirname(filename), 'processed')
-            if not exists(outputdir):
-                mkdir(outputdir)
-        else:
-            outputdir = self.outputdir
-        # Instantiate module
-        module = importlib.import_module(self.module_name)
-        class_ = getattr(module, self.class_name)
-        mod = class_(filename, outputdir, sheet=self.config['SHEET'],
-                     skiprows=self.config['SKIPROWS'],
-                     headers=self.config['HEADERS'])
-        cfg = mod.getConfigurables()
-        for c in cfg.keys():
-            cfg[c] = self.controller.db.getConfigByName(self.controller.currentconfig, c)
-            print("config set: ", cfg[c])
-        mod.setConfigurables(cfg)
-        if mod.data is not None:
-            q[filename] = mod.run()
-        else:
-            q[filename] = None
-
-####################################################################################################
-
-class ProcessThread(threading.Thread):
-    """Multi Worker Thread Class."""
-    # ----------------------------------------------------------------------
-    def __init__(self, controller, wxObject, modules, outputdir, filenames, row, processname, showplots):
-        """Init Worker Thread Class."""
-        threading.Thread.__init__(self)
-        self.controller = controller
-        self.config = self.controller.db.getConfig(self.controller.currentconfig)
-        self.db = DBI(self.controller.configfile)
-        self.wxObject = wxObject
-        self.filenames = filenames
-        self.output = outputdir
-        self.row = row
-        self.showplots = showplots
-        self.processname = processname
-        (self.module_name,self.class_name) = modules
-        logger = logging.getLogger(processname)
-        # self.start()  # start the thread
-
-    # ----------------------------------------------------------------------
-    def run(self):
-        i = 0
-        total_files =0
-        try:
-            event.set()
-            lock.acquire(True)
-            q = dict()
-            # connect to db
-            self.db.getconn()
-            if isinstance(self.filenames,dict):
-                batch = True
-                total_files = len(self.filenames)-1
-                i = 0
-                for group in self.filenames.keys():
-                    if group == 'all' or len(self.filenames[group])<=0:
-                        continue
-                    count = (i/ total_files )* 100
-                    msg = "%s run: count=%d of %d (%d percent)" % (self.processname, i, total_files, count)
-                    print(msg)
-                    logger.info(msg)
-                    #TODO fix this
-                    # wx.PostEvent(self.wxObject, ResultEvent((count, self.row, i + 1, total_files, self.processname)))
-                    self.processBatch(self.filenames[group], q, group)
-                    i += 1
-
-            else:
-                batch = False
-                files = self.filenames
-                total_files = len(files)
-                for i in range(total_files):
-                    count = (i/ total_files )* 100
-                    msg = "%s run: count=%d of %d (%d percent)" % (self.processname, i, total_files, count)
-                    print(msg)
-                    logger.info(msg)
-                    #wx.PostEvent(self.wxObject, ResultEvent((count, self.row, i + 1, total_files, self.processname)))
-                    self.processData(files[i], q)
-
-            wx.PostEvent(self.wxObject, ResultEvent((100, self.row, total_files, total_files, self.processname)))
-        except Exception as e:
-            wx.PostEvent(self.wxObject, ResultEvent((-1, self.row, i + 1, total_files, self.processname)))
-            logging.error(e)
-        finally:
-            logger.info('Finished ProcessThread')
-            # self.terminate()
-            lock.release()
-            event.clear()
-            # connect to db
-            self.db.closeconn()
-
-    # ----------------------------------------------------------------------
-    def processData(self, filename, q):
-        """
-        Run module here - can modify according to class if needed
-        :param filename: data file to process
-        :param q: queue for results
-        :return:
-        """
-        logger.info("Process Data with file: %s", filename)
-        # create local subdir for output
-        if self.output == 'local':
-            outputdir = join(dirname(filename), 'processed')
-            if not exists(outputdir):
-                mkdir(outputdir)
-        else:
-            outputdir = self.output
-        # Instantiate module
-        module = importlib.import_module(self.module_name)
-        class_ = getattr(module, self.class_name)
-        for fconf in ['SHEET','SKIPROWS','HEADERS']:
-            if fconf not in self.config.keys():
-                self.config[fconf]=0
-        mod = class_(filename, outputdir, sheet=self.config['SHEET'],
-                     skiprows=self.config['SKIPROWS'],
-                     headers=self.config['HEADERS'],showplots=self.showplots)
-        # Load all params required for module - get list from module
-        cfg = mod.getConfigurables()
-        for c in cfg.keys():
-            cfg[c] = self.db.getConfigByName(self.controller.currentconfig, c)
-            msg ="Process Data: config set: %s=%s" % (c,str(cfg[c]))
-            print(msg)
-            logger.debug(msg)
-        mod.setConfigurables(cfg)
-        if mod.data is not None:
-            q[filename] = mod.run()
-        else:
-            q[filename] = None
-
-
-    def processBatch(self, filelist, q, group=None):
-        """
-        Run module here - can modify according to class if needed
-        :param filename: data file to process
-        :param q: queue for results
-        :return:
-        """
-        logger.info("Process Batch with filelist: %d", len(filelist))
-        outputdir = self.output
-
-        # Instantiate module
-        module = importlib.import_module(self.module_name)
-        class_ = getattr(module, self.class_name)
-        mod = class_(filelist, outputdir, showplots=self.showplots)
-        # Load all params required for module - get list from module
-        cfg = mod.getConfigurables()
-        for c in cfg.keys():
-            cfg[c] = self.db.getConfigByName(self.controller.currentconfig, c)
-            msg ="Process Batch: config set: %s=%s" % (c,str(cfg[c]))
-            logger.debug(msg)
-        mod.setConfigurables(cfg)
-        if group is not None:
-            mod.prefix = group
-            q[group] = mod.run()
-        else:
-            q[mod.base] = mod.run()
-
-
-
-    # ----------------------------------------------------------------------
-    def terminate(self):
-        logger.info("Terminating Filter Thread")
-        self.terminate()
-
-
-
-########################################################################
-
-class Controller():
-    def __init__(self, configfile, configID,processfile):
-        self.logger = self.loadLogger()
-        self.processfile = processfile
-        self.cmodules = self.loadProcesses()
-        self.configfile = configfile
-        self.currentconfig = configID #multiple configs possible
-        # connect to db
-        self.db = DBI(configfile)
-        self.db.getconn()
-
-    def loadProcesses(self):
-        pf = None
-        try:
-            pf = open(self.processfile, 'rb')
-            self.processes = yaml.load(pf)
-            cmodules={}
-            for p in self.processes:
-                msg = "Controller:LoadProcessors: loading %s=%s" % (p, self.processes[p]['caption'])
-                logging.debug(msg)
-                module_name = self.processes[p]['modulename']
-                class_name = self.processes[p]['classname']
-                cmodules[p] =(module_name,class_name)
-            return cmodules
-        except Exception as e:
-            raise e
-        finally:
-            if pf is not None:
-                pf.close()
-
-    def loadLogger(self,outputdir=None, expt=''):
-        #### LoggingConfig
-        logger.setLevel(logging.INFO)
-        homedir = expanduser("~")
-        if outputdir is not None and access(outputdir, R_OK):
-            homedir = outputdir
-        if len(expt) >0:
-            expt = expt + "_"
-        if not access(join(homedir, "logs"), R_OK):
-            mkdir(join(homedir, "logs"))
-        self.logfile = join(homedir, "logs", expt+'analysis.log')
-        handler = RotatingFileHandler(filename=self.logfile, maxBytes=10000000, backupCount=10)
-        formatter = logging.Formatter('[ %(asctime)s %(levelname)-4s ] (%(threadName)-9s) %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-        return logger
-
-    # ----------------------------------------------------------------------
-    # def loadConfig(self, config=None):
-    #     """
-    #     Load from config file or config object
-    #     :param config:
-    #     :return:
-    #     """
-    #     try:
-    #         if config is not None and isinstance(config, ConfigObj):
-    #             logger.info("Loading config obj:%s", config.filename)
-    #         elif isinstance(config, str) and access(config, R_OK):
-    #             logger.info("Loading config from file:%s", config)
-    #             config = ConfigObj(config)
-    #         else:
-    #             logger.warning('No config file found')
-    #             config = ConfigObj()
-    #
-    #     except IOError as e:
-    #         logging.error(e)
-    #     except ValueError as e:
-    #         logging.error(e)
-    #
-    #     return config
-
-    # ----------------------------------------------------------------------
-    def RunCompare(self, wxGui, indirs, outputdir, prefixes, searchtext):
-        """
-        Comparison of groups
-        :param wxGui:
-        :param indirs:
-        :param outputdir:
-        :param prefixes:
-        :param searchtext:
-        :return:
-        """
-        pass
-
+class Controller(Engine):
+    """
+    Engine for the wx GUI - progress for runs is posted to the gui panel as ResultEvent
+    """
 
     # ----------------------------------------------------------------------
-    def RunProcess(self, wxGui, process,outputdir,filenames, row, showplots=False):
+    def RunProcess(self, wxGui, process,outputdir,filenames, row, showplots=False, workers=None, fileindex=None,
+                   force=False, run=None):
         """
         Instantiate Thread with type for Process
-        :param wxGui:
+        :param wxGui: gui panel for progress events
         :param filenames:
         :param type:
         :param row:
-        :return:
+        :param run: id of run in gui - set on progress events
+        :return: ProcessThread
         """
-
-        type = self.processes[process]['href']
-        processname = self.processes[process]['caption']
-        filesIn = []
-        for f in self.processes[process]['filesin'].split(", "):
-            fin = self.db.getConfigByName(self.currentconfig, f)
-            if fin is not None:
-                filesIn.append(fin)
-            else:
-                filesIn.append(f)
-        filenames = CheckFilenames(filenames,filesIn)
-        # filesout = self.processes[process]['filesout'] #TODO link up with module config?
-        # suffix = self.db.getConfigByName(self.currentconfig,filesout)
-        if self.processes[process]['output'] == 'local':
-            outputdir = self.processes[process]['output']
-            filenames = filenames['all']
-
-        if len(filenames) > 0:
-            logger.info("Load Process Threads: %s [row: %d]", type, row)
-            wx.PostEvent(wxGui, ResultEvent((0, row, 0, len(filenames), processname)))
-            t = ProcessThread(self, wxGui, self.cmodules[process],outputdir, filenames, row, processname, showplots )
-            t.start()
-            logger.info("Running Thread: %s", type)
-        else:
-            logger.error("No files to process")
-            raise ValueError("No matched files to process")
+        return super(Controller, self).RunProcess(process, outputdir, filenames, row, showplots, workers, fileindex,
+                                                  force, callback=partial(PostResult, wxGui, run=run))
 
     # ----------------------------------------------------------------------
-
-
-    def shutdown(self):
-        logger.info('Close extra thread')
-        t = threading.current_thread()
-        #print("Thread counter:", threading.main_thread())
-        if t != threading.main_thread() and t.is_alive():
-            logger.info('Shutdown: closing %s', t.getName())
-            t.terminate()
+    def RunPipeline(self, wxGui, selected, outputdir, filenames, showplots=False, workers=None, fileindex=None,
+                    force=False, run=None):
+        """
+        Run selected processes as a pipeline
+        :param wxGui: gui panel for progress events
+        :param run: id of run in gui - set on progress events
+        :return: PipelineThread
+        """
+        return super(Controller, self).RunPipeline(selected, outputdir, filenames, showplots, workers, fileindex,
+                                                   force, callback=partial(PostResult, wxGui, run=run))
@@ -1,8 +1,76 @@
 import sqlite3
-import pandas
+from collections import OrderedDict
+from collections.abc import Mapping
 from os.path import join
 from os import access, R_OK, W_OK
 
+
+class ConfigSnapshot(Mapping):
+    """
+    Read-only copy of a config taken once per run - values do not change during the run and
+    it can be sent to worker processes without a db connection
+    """
+
+    def __init__(self, configid, config=None):
+        """
+        :param configid: config id in db
+        :param config: dict of name=value pairs as from DBI.getConfig
+        """
+        self.configid = configid
+        if config is None:
+            config = {}
+        self._config = dict(config)
+
+    def __getitem__(self, name):
+        return self._config[name]
+
+    def __iter__(self):
+        return iter(self._config)
+
+    def __len__(self):
+        return len(self._config)
+
+    def __repr__(self):
+        return "ConfigSnapshot(%s, %s)" % (self.configid, self._config)
+
+    def getInt(self, name, default=None):
+        """
+        Get value as int
+        :return: int or default if not set
+        """
+        val = self._config.get(name)
+        if val is None or len(str(val)) <= 0:
+            return default
+        return int(float(val))
+
+    def getFloat(self, name, default=None):
+        """
+        Get value as float
+        :return: float or default if not set
+        """
+        val = self._config.get(name)
+        if val is None or len(str(val)) <= 0:
+            return default
+        return float(val)
+
+    def getBool(self, name, default=None):
+        """
+        Get value as bool - db stores as text eg '0' or '1'
+        :return: bool or default if not set
+        """
+        val = self._config.get(name)
+        if val is None or len(str(val)) <= 0:
+            return default
+        return str(val).lower() in ['1', 'true', 'yes']
+
+    def forModule(self, cfg):
+        """
+        Fill module configurables with config values - None if not in config (as getConfigByName)
+        :param cfg: OrderedDict from module getConfigurables
+        :return: OrderedDict of name=value
+        """
+        return OrderedDict([(c, self._config.get(c)) for c in cfg.keys()])
+
 class DBI():
     def __init__(self, dbfile):
         """
@@ -34,6 +102,13 @@ class DBI():
             config = None
         return config
 
+    def getSnapshot(self, configid):
+        """
+        Get read-only copy of config for a run
+        :return: ConfigSnapshot (empty if configid not found)
+        """
+        return ConfigSnapshot(configid, self.getConfig(configid))
+
     def deleteConfig(self,configid=None):
         """
         Delete all IDs in table
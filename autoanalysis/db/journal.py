@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Run journal - SQLite database of runs and files processed, kept next to the config database
+    1. Each run is recorded with its processes, input files, output directory and options so it can be resumed
+    2. Each file (or group for batch processes) is recorded as it finishes with status, output and timing
+    3. Records are committed as they are written so a crash loses at most the files being processed
+    4. Files done in an unfinished run (crashed, failed or cancelled) are loaded when it is resumed so only
+       the unfinished files are processed again
+
+Created on 18 Oct 2026
+
+@author: QBI Software
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from os.path import exists
+
+RUNNING = 'running'
+DONE = 'done'
+
+SCHEMA = ["CREATE TABLE IF NOT EXISTS runs (runid INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, "
+          "configid TEXT, processes TEXT, outputdir TEXT, filenames TEXT, options TEXT, status TEXT, "
+          "started REAL, ended REAL)",
+          "CREATE TABLE IF NOT EXISTS files (runid INTEGER, process TEXT, filename TEXT, status TEXT, "
+          "output TEXT, started REAL, ended REAL, error TEXT, PRIMARY KEY (runid, process, filename))"]
+
+
+class RunJournal():
+    def __init__(self, dbfile):
+        """
+        Open journal database - created if not found
+        :param dbfile: full path of database file
+        """
+        self.dbfile = dbfile
+        # files are recorded from run threads and pool result threads
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(dbfile, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for sql in SCHEMA:
+            self.conn.execute(sql)
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def startRun(self, kind, configid, processes, outputdir, filenames, options):
+        """
+        Record new run
+        :param kind: 'pipeline' or 'process'
+        :param configid: config id in config database
+        :param processes: list of process ids
+        :param outputdir: output directory
+        :param filenames: input files as given to run (list or dict of groups)
+        :param options: dict of other run arguments eg showplots, workers, row
+        :return: runid in journal
+        """
+        with self.lock:
+            c = self.conn.execute("INSERT INTO runs (kind, configid, processes, outputdir, filenames, options, "
+                                  "status, started) VALUES (?,?,?,?,?,?,?,?)",
+                                  (kind, configid, json.dumps(processes), outputdir, json.dumps(filenames),
+                                   json.dumps(options), RUNNING, time.time()))
+            self.conn.commit()
+            return c.lastrowid
+
+    def restartRun(self, runid):
+        """
+        Mark run as running again for resume
+        """
+        with self.lock:
+            self.conn.execute("UPDATE runs SET status=?, ended=NULL WHERE runid=?", (RUNNING, runid))
+            self.conn.commit()
+
+    def endRun(self, runid, status):
+        """
+        :param status: done, failed or cancelled (from scheduler)
+        """
+        with self.lock:
+            self.conn.execute("UPDATE runs SET status=?, ended=? WHERE runid=?", (status, time.time(), runid))
+            self.conn.commit()
+
+    def recordFile(self, runid, process, filename, status, output=None, started=None, ended=None, error=None):
+        """
+        Record file (or group for batch processes) - replaces earlier record in the same run
+        :param process: process id
+        :param filename: input file or group
+        :param status: done, failed or cancelled
+        :param output: output filename or list of filenames (stored as json)
+        :param started: start time (secs) or None
+        :param ended: end time (secs) or None for now
+        :param error: error message
+        """
+        if ended is None:
+            ended = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?)",
+                              (runid, process, filename, status, json.dumps(output), started, ended,
+                               None if error is None else str(error)))
+            self.conn.commit()
+
+    def getRun(self, runid):
+        """
+        :return: dict of run or None if not found
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT runid, kind, configid, processes, outputdir, filenames, options, status, "
+                                    "started, ended FROM runs WHERE runid=?", (runid,)).fetchone()
+        if row is None:
+            return None
+        run = dict(zip(['runid', 'kind', 'configid', 'processes', 'outputdir', 'filenames', 'options', 'status',
+                        'started', 'ended'], row))
+        for k in ['processes', 'filenames', 'options']:
+            run[k] = json.loads(run[k])
+        return run
+
+    def getUnfinished(self):
+        """
+        Runs which have not completed - crashed, failed or cancelled
+        :return: list of runids, latest first
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT runid FROM runs WHERE status<>? ORDER BY runid DESC", (DONE,)).fetchall()
+        return [r[0] for r in rows]
+
+    def getFiles(self, runid, status=None):
+        """
+        :param status: only files with status or None for all
+        :return: list of (process, filename, status, output, started, ended, error)
+        """
+        sql = "SELECT process, filename, status, output, started, ended, error FROM files WHERE runid=?"
+        args = (runid,)
+        if status is not None:
+            sql += " AND status=?"
+            args = (runid, status)
+        with self.lock:
+            rows = self.conn.execute(sql, args).fetchall()
+        return [(r[0], r[1], r[2], json.loads(r[3]) if r[3] is not None else None) + tuple(r[4:]) for r in rows]
+
+    def getCompleted(self, runid):
+        """
+        Files done in run with outputs still present
+        :return: dict of (process, filename): output
+        """
+        completed = {}
+        for (process, filename, status, output, started, ended, error) in self.getFiles(runid, DONE):
+            outputs = output if isinstance(output, list) else [output]
+            if len([o for o in outputs if o is not None and not exists(o)]) <= 0:
+                completed[(process, filename)] = output
+        return completed
@@ -0,0 +1,1605 @@
+# -*- coding: utf-8 -*-
+"""
+Processing engine - runs processes from processes.yaml with config from autoconfig.db over input files.
+No GUI dependencies: progress is sent to callbacks as (count, row, i, total, processname) where count is
+percent done (0 pending, 100 done, -1 error). The wx GUI (controller.py) is one subscriber.
+
+Created on 18 Oct 2026
+
+@author: QBI Software
+"""
+import logging
+import threading
+import re
+import time
+from collections import OrderedDict
+from copy import copy
+from bisect import bisect_left
+from fnmatch import fnmatch
+from functools import partial
+from logging.handlers import RotatingFileHandler
+from multiprocessing import freeze_support, Pool, cpu_count, Event
+from os import access, R_OK, W_OK, mkdir, makedirs, scandir, stat, replace
+from os.path import join, dirname, exists, split, splitext, expanduser, normpath, sep, abspath, isdir
+from autoanalysis.db.dbquery import DBI, ConfigSnapshot
+from autoanalysis.db.journal import RunJournal
+from autoanalysis.processmodules.DataCache import DataCache
+from autoanalysis.cancel import RunCancelled, checkCancelled, setToken, setThreadToken
+from autoanalysis.readahead import prefetch, AsyncWriter
+from autoanalysis.instrument import recording, stage, saveTrace, saveSummary, startMemory, stopMemory
+from autoanalysis.scheduler import RunScheduler, DONE, FAILED, CANCELLED, FINISHED
+import yaml
+import importlib
+import json
+import hashlib
+
+
+# Required for dist
+freeze_support()
+#global logger
+logger = logging.getLogger()
+# run journal database - next to config database
+JOURNAL_FILENAME = 'runjournal.db'
+
+
+def FindFilenames(inputdir, searchtext='', groups=None):
+    """
+    Find all matching files in top level directory and assign groups from directory names (as in Files panel)
+    :param inputdir: top level directory
+    :param searchtext: regex to match filenames (all files if empty)
+    :param groups: list of group names - file is in group if a directory in its path matches
+    :return: dict of group: files with 'all' for all files
+    """
+    if groups is None:
+        groups = []
+    filenames = {'all': []}
+    for g in groups:
+        filenames[g] = []
+    fileindex = FileIndex()
+    fileindex.scan(inputdir)
+    for f in fileindex.paths:
+        if len(searchtext) > 0 and not re.search(searchtext, f, flags=re.IGNORECASE):
+            continue
+        filenames['all'].append(f)
+        for g in groups:
+            if g.upper() in f.upper().split(sep):
+                filenames[g].append(f)
+                break
+    return filenames
+
+
+class FileIndex():
+    """
+    Index of files under input directories (path, basename, size, mtime) - each directory tree is scanned once
+    and all filename matching is done against the index. Can be shared by all processes in a run.
+    """
+
+    def __init__(self):
+        self.entries = {}   # path: (path, basename, size, mtime)
+        self.roots = []     # directories scanned
+        self.paths = []     # sorted paths for directory lookup
+        self.matches = {}   # (directory, pattern): matched paths
+
+    def scan(self, directory):
+        """
+        Add all files under directory to index (skips hidden files and directories as for glob)
+        :param directory: top level directory
+        """
+        directory = normpath(directory)
+        for root in self.roots:
+            if directory == root or directory.startswith(root + sep):
+                return
+        logger.info("FileIndex: scanning %s", directory)
+        self.roots.append(directory)
+        dirs = [directory]
+        while len(dirs) > 0:
+            d = dirs.pop()
+            try:
+                with scandir(d) as it:
+                    for entry in it:
+                        if entry.name.startswith('.'):
+                            continue
+                        if entry.is_dir():
+                            dirs.append(entry.path)
+                        else:
+                            st = entry.stat()
+                            self.entries[entry.path] = (entry.path, entry.name, st.st_size, st.st_mtime)
+            except OSError as e:
+                logger.warning("FileIndex: cannot scan %s - %s", d, e)
+        self.paths = sorted(self.entries.keys())
+        self.matches = {}
+
+    def find(self, directory, pattern):
+        """
+        Find files under directory with basename matching pattern - as iglob(join(directory, '**', pattern))
+        :param directory: top level directory (scanned if not in index)
+        :param pattern: filename pattern (wildcards allowed)
+        :return: list of full path filenames
+        """
+        directory = normpath(directory)
+        key = (directory, pattern)
+        if key not in self.matches:
+            self.scan(directory)
+            prefix = join(directory, '')
+            start = bisect_left(self.paths, prefix)
+            found = []
+            for path in self.paths[start:]:
+                if not path.startswith(prefix):
+                    break
+                if fnmatch(self.entries[path][1], pattern):
+                    found.append(path)
+            self.matches[key] = found
+        return self.matches[key]
+
+    def stat(self, path):
+        """
+        Size and mtime of indexed file
+        :param path: full path filename
+        :return: (size, mtime) or None if not in index
+        """
+        if path in self.entries:
+            return self.entries[path][2:]
+        return None
+
+
+def CheckFilenames(filenames, configfiles, fileindex=None):
+    """
+    Check that filenames are appropriate for the script required
+    :param filenames: list of full path filenames
+    :param configfiles: matching filename for script as in config
+    :param fileindex: FileIndex of input directories - created if None
+    :return: filtered list
+    """
+    if fileindex is None:
+        fileindex = FileIndex()
+    newfiles = {k: [] for k in filenames.keys() }
+    # files already in each group - for order-preserving dedupe - and directories searched
+    seen = {k: set() for k in filenames.keys()}
+    searched = {k: set() for k in filenames.keys()}
+    for conf in configfiles:
+        if conf.startswith('*'):
+            conf = conf[1:]
+        for group in filenames.keys():
+            for f in filenames[group]:
+                parts = split(f)
+                if conf in parts[1]:
+                    found = [f]
+                elif (parts[0], conf) in searched[group]:
+                    # files in the same directory find the same matches
+                    continue
+                else:
+                    # extract directory and seek files
+                    searched[group].add((parts[0], conf))
+                    found = fileindex.find(parts[0], conf)
+                    if len(found) <= 0:
+                        # no exact match in this directory - match as end of filename
+                        found = fileindex.find(parts[0], '*'+conf)
+                for y in found:
+                    if y not in seen[group]:
+                        seen[group].add(y)
+                        newfiles[group].append(y)
+
+    return newfiles
+
+
+def getOutputdir(filename, output):
+    """
+    Output directory for module run on filename
+    :param filename: data file
+    :param output: 'local' for subdir 'processed' next to data file or output directory
+    :return: output directory
+    """
+    if output == 'local':
+        return join(dirname(filename), 'processed')
+    return output
+
+
+class ModuleFactory():
+    """
+    Process module class from processes.yaml - resolved and checked once when processes are loaded.
+    configure() gives a factory with config for a run which creates a configured module for each file.
+    Factories only hold names, config values and the class so can be sent to worker processes.
+    """
+    REQUIRED = ['getConfigurables', 'setConfigurables', 'run']
+    FILECONFIG = ['SHEET', 'SKIPROWS', 'HEADERS']
+
+    def __init__(self, module_name, class_name):
+        """
+        :param module_name: full module name eg autoanalysis.processmodules.Filter
+        :param class_name: class in module
+        :raises ValueError: if class cannot be loaded or is not a process module
+        """
+        self.module_name = module_name
+        self.class_name = class_name
+        try:
+            module = importlib.import_module(module_name)
+            self.class_ = getattr(module, class_name)
+        except (ImportError, AttributeError) as e:
+            raise ValueError("Cannot load process module %s.%s: %s" % (module_name, class_name, e))
+        missing = [m for m in self.REQUIRED if not callable(getattr(self.class_, m, None))]
+        if len(missing) > 0:
+            raise ValueError("Process module %s.%s missing: %s" % (module_name, class_name, ", ".join(missing)))
+        self.configurables = self.class_.getConfigurables()
+        self.cfg = None
+        self.fileconfig = {}
+        self.cache = None
+        # inputs are outputs of other processes (set when processes are loaded) - not cached
+        self.intermediate = False
+
+    def configure(self, config):
+        """
+        Factory with config values for a run
+        :param config: ConfigSnapshot
+        :return: ModuleFactory
+        """
+        factory = copy(self)
+        factory.cfg = config.forModule(self.configurables)
+        for c in factory.cfg.keys():
+            logger.debug("%s: config set: %s=%s", self.class_name, c, str(factory.cfg[c]))
+        factory.fileconfig = dict([(c, config.get(c)) for c in self.FILECONFIG])
+        factory.sheet = config.getInt('SHEET', 0)
+        factory.skiprows = config.getInt('SKIPROWS', 0)
+        factory.headers = config.getInt('HEADERS', 0)
+        # Parsed file cache of raw data files - only if CACHE_SIZE (MB) is set
+        if not self.intermediate and config.getFloat('CACHE_SIZE', 0) > 0:
+            factory.cache = DataCache(config.get('CACHE_DIR'), config.get('CACHE_SIZE'))
+        else:
+            factory.cache = None
+        return factory
+
+    def getConfig(self):
+        """
+        Config values used by a per-file module including file load options - for fingerprints
+        :return: dict of name=value
+        """
+        cfg = OrderedDict(self.cfg)
+        cfg.update(self.fileconfig)
+        return cfg
+
+    def create(self, filename, outputdir, showplots=False):
+        """
+        Configured module for a data file
+        """
+        mod = self.class_(filename, outputdir, sheet=self.sheet, skiprows=self.skiprows, headers=self.headers,
+                          showplots=showplots)
+        mod.cache = self.cache
+        mod.setConfigurables(self.cfg)
+        return mod
+
+    def createBatch(self, filelist, outputdir, showplots=False):
+        """
+        Configured module for a list of files
+        """
+        mod = self.class_(filelist, outputdir, showplots=showplots)
+        mod.setConfigurables(self.cfg)
+        return mod
+
+
+class Manifest():
+    """
+    Record of outputs from per-file processes with a fingerprint of the input file (path, size, mtime) and
+    config values used. Saved as .manifest.json in each output directory - an output is up to date if
+    it exists and the fingerprint is unchanged.
+    Entries are keyed by process (id and module class), config and input file so processes using the same
+    module with different config do not share entries.
+    """
+    FILENAME = '.manifest.json'
+
+    def __init__(self):
+        self.manifests = {}
+        self.changed = set()
+
+    @staticmethod
+    def processKey(process, factory):
+        """
+        Name of process for entries
+        :param process: process id
+        :param factory: ModuleFactory of process
+        :return: string
+        """
+        return "%s:%s.%s" % (process, factory.module_name, factory.class_name)
+
+    def getKey(self, process, filename, cfg):
+        """
+        Entry key
+        :param process: from processKey
+        :param filename: input data file
+        :param cfg: dict of config values used by process
+        :return: string of process, config digest and full path of input file
+        """
+        text = json.dumps({k: str(v) for k, v in cfg.items()}, sort_keys=True)
+        return "|".join([process, hashlib.sha1(text.encode('utf-8')).hexdigest(), abspath(filename)])
+
+    def fingerprint(self, filename, process, cfg):
+        """
+        Fingerprint of input file and config
+        :param filename: input data file
+        :param process: from processKey
+        :param cfg: dict of config values used by process
+        :return: hex string or None if file not accessible
+        """
+        try:
+            st = stat(filename)
+        except OSError:
+            return None
+        text = json.dumps({'file': abspath(filename), 'size': st.st_size, 'mtime': st.st_mtime_ns,
+                           'process': process, 'config': {k: str(v) for k, v in cfg.items()}}, sort_keys=True)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def load(self, outputdir):
+        if outputdir not in self.manifests:
+            manifest = {}
+            mfile = join(outputdir, self.FILENAME)
+            if exists(mfile):
+                try:
+                    with open(mfile, 'r') as f:
+                        manifest = json.load(f)
+                except (IOError, ValueError) as e:
+                    logger.warning("Manifest: cannot read %s - %s", mfile, e)
+            self.manifests[outputdir] = manifest
+        return self.manifests[outputdir]
+
+    def getOutput(self, outputdir, key, fingerprint):
+        """
+        Recorded output if it is up to date
+        :param key: from getKey
+        :return: output filename or None if not up to date
+        """
+        if fingerprint is None:
+            return None
+        entry = self.load(outputdir).get(key)
+        if entry is not None and entry['fingerprint'] == fingerprint and exists(entry['output']):
+            return entry['output']
+        return None
+
+    def record(self, outputdir, key, fingerprint, output):
+        """
+        Record output for input file with fingerprint taken before processing - entries for the same process and
+        file with other config are removed as the output has been replaced
+        :param key: from getKey
+        """
+        if key is None or fingerprint is None or output is None:
+            return
+        manifest = self.load(outputdir)
+        (process, digest, filename) = key.split('|', 2)
+        for k in [k for k in manifest.keys() if k != key and k.startswith(process + '|') and
+                  k.endswith('|' + filename)]:
+            del manifest[k]
+        manifest[key] = {'fingerprint': fingerprint, 'output': output}
+        self.changed.add(outputdir)
+
+    def save(self):
+        """
+        Write changed manifests - via temp file so a crash never leaves a partial manifest
+        """
+        for outputdir in self.changed:
+            if not exists(outputdir):
+                continue
+            mfile = join(outputdir, self.FILENAME)
+            tmpfile = mfile + '.tmp'
+            try:
+                with open(tmpfile, 'w') as f:
+                    json.dump(self.manifests[outputdir], f, indent=1)
+                replace(tmpfile, mfile)
+            except IOError as e:
+                logger.warning("Manifest: cannot save %s - %s", mfile, e)
+        self.changed = set()
+
+
+def processFile(args):
+    """
+    Run module over a single data file - module level so it can be sent to worker processes
+    :param args: tuple of (filename, outputdir, factory, showplots) where factory is configured ModuleFactory
+    :return: (filename, result, stats) where result is output of module run and stats has start and end times
+        and events of stages (instrument)
+    """
+    (filename, output, factory, showplots) = args
+    checkCancelled()
+    stats = {'start': time.time()}
+    logger.info("Process Data with file: %s", filename)
+    with recording(filename) as recorder:
+        mod = createModule(args)
+        # modules load their own data when run (may be streamed)
+        with stage('run'):
+            result = mod.run()
+    stats['end'] = time.time()
+    stats['events'] = recorder.events
+    return (filename, result, stats)
+
+
+def createModule(args):
+    """
+    Module for a single data file with output directory created
+    :param args: tuple of (filename, outputdir, factory, showplots) as for processFile
+    :return: module
+    """
+    (filename, output, factory, showplots) = args
+    # create local subdir for output
+    outputdir = getOutputdir(filename, output)
+    if output == 'local':
+        makedirs(outputdir, exist_ok=True)
+    return factory.create(filename, outputdir, showplots)
+
+
+def prefetchFile(args):
+    """
+    Module for a single data file with data loaded - called in reader threads
+    :param args: tuple of (filename, outputdir, factory, showplots) as for processFile
+    :return: (module, Recorder with load stage)
+    """
+    checkCancelled()
+    with recording(args[0]) as recorder:
+        mod = createModule(args)
+        if hasattr(mod, 'prefetch'):
+            mod.prefetch()
+    return (mod, recorder)
+
+
+def processGroup(args):
+    """
+    Run batch module over a list of files - module level so it can be sent to worker processes
+    :param args: tuple of (filelist, outputdir, factory, showplots, group) where factory is configured ModuleFactory
+    :return: (group, result, stats) where result is output of module run and stats has start and end times
+        and events of stages (instrument)
+    """
+    (filelist, outputdir, factory, showplots, group) = args
+    checkCancelled()
+    stats = {'start': time.time()}
+    logger.info("Process Batch with filelist: %d", len(filelist))
+    mod = factory.createBatch(filelist, outputdir, showplots)
+    if group is not None:
+        mod.prefix = group
+    else:
+        group = mod.base
+    with recording(group) as recorder:
+        with stage('run', "%d files" % len(filelist)):
+            result = mod.run()
+    stats['end'] = time.time()
+    stats['events'] = recorder.events
+    return (group, result, stats)
+
+
+def initWorker(token, tracememory=False):
+    """
+    Worker process initializer
+    :param token: cancel token of the run
+    :param tracememory: trace memory for peak memory of stages (config TRACE_MEMORY)
+    """
+    setToken(token)
+    if tracememory:
+        startMemory()
+
+
+class Pipeline():
+    """
+    Dependency graph of selected processes - a process depends on another if one of its filesin
+    is one of the other's filesout (from processes.yaml)
+    """
+
+    def __init__(self, processes, selected):
+        """
+        :param processes: process definitions from processes.yaml
+        :param selected: list of process ids to run
+        """
+        self.processes = processes
+        self.upstream = {}
+        for p in selected:
+            filesin = processes[p]['filesin'].split(", ")
+            self.upstream[p] = [u for u in selected if u != p and
+                                len(set(filesin) & set(processes[u]['filesout'].split(", "))) > 0]
+        # order each process after the processes it depends on - otherwise keep selected order
+        self.stages = []
+        while len(self.stages) < len(selected):
+            ready = [p for p in selected if p not in self.stages and
+                     len([u for u in self.upstream[p] if u not in self.stages]) <= 0]
+            if len(ready) <= 0:
+                raise ValueError("Processes have circular dependencies: %s" %
+                                 ", ".join([p for p in selected if p not in self.stages]))
+            self.stages.append(ready[0])
+        self.downstream = {p: [d for d in self.stages if p in self.upstream[d]] for p in self.stages}
+
+    def isBatch(self, process):
+        return self.processes[process]['output'] == 'batch'
+
+    def roots(self):
+        """
+        Processes with no selected upstream process - their input files must already exist
+        """
+        return [p for p in self.stages if len(self.upstream[p]) <= 0]
+
+
+def runPaths(filenames, outputdir='local'):
+    """
+    Directories used by a run - for the scheduler to find runs which depend on each other
+    :param filenames: list of files or dict of groups with 'all' for all files
+    :param outputdir: output directory or 'local' for outputs next to data files
+    :return: set of directories
+    """
+    if isinstance(filenames, dict):
+        filenames = filenames.get('all', [f for group in filenames.values() for f in group])
+    paths = set([dirname(f) for f in filenames])
+    if outputdir != 'local':
+        paths.add(outputdir)
+    return paths
+
+
+########################################################################
+
+class RunThread(threading.Thread):
+    """
+    Run started by the engine scheduler - workers are set by the scheduler when the run is admitted
+    and the scheduler is told when the run has finished.
+    Runs are cancelled with a token checked between files and chunks - by this thread and its worker processes.
+    """
+
+    def __init__(self, engine):
+        threading.Thread.__init__(self)
+        self.engine = engine
+        self.runid = None
+        self.status = DONE
+        self.token = Event()
+        # run in journal and files done in earlier attempts of the run as (process, filename): output
+        self.journalid = None
+        self.resumed = {}
+        # stages of files run (instrument) - saved as trace and summary when the run ends if config TRACE_RUNS
+        self.events = []
+
+    def admit(self, runid, workers):
+        """
+        Called by scheduler to start the run
+        :param runid: id in scheduler
+        :param workers: number of worker processes granted
+        """
+        self.runid = runid
+        self.workers = max(1, int(workers))
+        self.start()
+
+    def run(self):
+        setThreadToken(self.token)
+        tracing = self.traceMemory()
+        if tracing:
+            startMemory()
+        try:
+            self.process()
+        except RunCancelled:
+            self.status = CANCELLED
+        except Exception as e:
+            self.status = FAILED
+            logging.error(e)
+        finally:
+            if tracing:
+                stopMemory()
+            self.saveEvents()
+            if self.journalid is not None:
+                self.engine.journal.endRun(self.journalid, self.status)
+            if self.runid is not None:
+                with self.engine.scheduler.condition:
+                    self.engine.runs.pop(self.runid, None)
+                self.engine.scheduler.finish(self.runid, self.status)
+
+    def process(self):
+        pass
+
+    def getPool(self, workers):
+        """
+        Pool of worker processes which check the cancel token of this run
+        """
+        return Pool(processes=workers, initializer=initWorker, initargs=(self.token, self.traceMemory()))
+
+    def traceMemory(self):
+        """
+        Peak memory of stages with tracemalloc - slows runs so only if config TRACE_MEMORY
+        """
+        return self.config.getBool('TRACE_MEMORY', False)
+
+    def saveEvents(self):
+        """
+        Save stages of files run as Chrome trace (json) and summary (csv) in logs directory if config TRACE_RUNS
+        is set - not in output directory which is only for results
+        :return: (tracefile, summaryfile) or None
+        """
+        if len(self.events) <= 0 or not self.config.getBool('TRACE_RUNS', False):
+            return None
+        outputdir = dirname(self.engine.logfile)
+        base = join(outputdir, "run%s_" % (self.journalid if self.journalid is not None else self.runid))
+        try:
+            files = (saveTrace(self.events, base + 'trace.json'), saveSummary(self.events, base + 'summary.csv'))
+        except (IOError, OSError) as e:
+            logger.warning("Trace: cannot save in %s - %s", outputdir, e)
+            return None
+        logger.info("Trace of run saved: %s", files[0])
+        return files
+
+    def cancel(self):
+        """
+        Stop run at the next file or chunk - outputs of completed files are kept
+        """
+        logger.info("Cancelling run %s", self.runid)
+        self.token.set()
+
+    def isCancelled(self):
+        return self.token.is_set()
+
+    def recordFile(self, process, filename, status, output=None, stats=None, error=None):
+        """
+        Record file or group in run journal
+        :param stats: dict with start and end times and events from processFile or None
+        """
+        if stats is None:
+            stats = {}
+        if self.config.getBool('TRACE_RUNS', False):
+            for event in stats.get('events', []):
+                event['process'] = process
+                self.events.append(event)
+        if self.journalid is None:
+            return
+        self.engine.journal.recordFile(self.journalid, process, filename, status, output, stats.get('start'),
+                                       stats.get('end'), error)
+
+    def notifyCancelled(self):
+        """
+        Progress for processes not completed when the run is cancelled
+        """
+        pass
+
+    def wait(self, timeout=None):
+        """
+        Wait until run has finished (including while queued)
+        :return: True if finished
+        """
+        if self.runid is None:
+            self.join(timeout)
+            return not self.is_alive()
+        return self.engine.scheduler.wait(self.runid, timeout)
+
+
+####################################################################################################
+class TestThread(threading.Thread):
+    def __init__(self, engine, filenames, outputdir, output, processname, module,classname, config):
+        """Init Worker Thread Class."""
+        threading.Thread.__init__(self)
+        self.engine = engine
+        self.filenames = filenames
+        self.output = output
+        self.processname = processname
+        self.module_name = module
+        self.class_name = classname
+        self.outputdir = outputdir
+        if isinstance(config, ConfigSnapshot):
+            self.config = config
+        else:
+            self.config = ConfigSnapshot(self.engine.currentconfig, config)
+        self.factory = ModuleFactory(module, classname).configure(self.config)
+
+    def run(self):
+        i = 0
+        try:
+            # Do work
+            q = dict()
+            files = self.filenames
+            total_files = len(files)
+
+            # Loop through each
+            for i in range(total_files):
+                count = ((i + 1) * 100) / total_files
+                msg ="%s run: count=%d of %d (%d percent)" % (self.processname,i,total_files,count)
+                print(msg)
+                self.processData(files[i], q)
+
+        except Exception as e:
+            print(e)
+        finally:
+            print('Finished TestThread')
+
+    def processData(self, filename, q):
+        """
+        Activate filter process - multithreaded
+        :param datafile:
+        :param q:
+        :return:
+        """
+        print("Process Data for file: ", filename)
+
+        # create local subdir for output
+        if self.output == 'local':
+            outputdir = join(dirname(filename), 'processed')
+            if not exists(outputdir):
+                mkdir(outputdir)
+        else:
+            outputdir = self.outputdir
+        mod = self.factory.create(filename, outputdir)
+        if mod.data is not None:
+            q[filename] = mod.run()
+        else:
+            q[filename] = None
+
+####################################################################################################
+
+class ProcessThread(RunThread):
+    """Multi Worker Thread Class."""
+    # ----------------------------------------------------------------------
+    def __init__(self, engine, callback, factory, outputdir, filenames, row, processname, showplots, workers=None,
+                 force=False, process=None):
+        """
+        Init Worker Thread Class.
+        :param engine: Engine
+        :param callback: function for progress as (count, row, i, total, processname)
+        :param factory: ModuleFactory for process
+        :param process: process id for run journal
+        """
+        RunThread.__init__(self, engine)
+        # Config read once for the whole run
+        self.config = self.engine.db.getSnapshot(self.engine.currentconfig)
+        self.callback = callback
+        self.filenames = filenames
+        self.output = outputdir
+        self.row = row
+        self.showplots = showplots
+        self.processname = processname
+        self.processid = process
+        self.factory = factory.configure(self.config)
+        self.module_name = factory.module_name
+        # Number of worker processes for per-file runs - config WORKERS or all cores
+        if workers is None:
+            workers = self.config.getInt('WORKERS', cpu_count())
+        self.workers = max(1, int(workers))
+        # Files with up to date outputs are skipped unless forced
+        self.force = force
+        self.manifest = Manifest()
+        # manifest (key, fingerprint) of input files taken before processing
+        self.fingerprints = {}
+        logger = logging.getLogger(processname)
+        # self.start()  # start the thread
+
+    # ----------------------------------------------------------------------
+    def process(self):
+        i = 0
+        total_files =0
+        try:
+            q = dict()
+            if isinstance(self.filenames,dict):
+                batch = True
+                total_files = len(self.filenames)-1
+                i = 0
+                for group in self.filenames.keys():
+                    if group == 'all' or len(self.filenames[group])<=0:
+                        continue
+                    count = (i/ total_files )* 100
+                    msg = "%s run: count=%d of %d (%d percent)" % (self.processname, i, total_files, count)
+                    print(msg)
+                    logger.info(msg)
+                    #TODO fix this
+                    # self.callback(((count, self.row, i + 1, total_files, self.processname)))
+                    self.processBatch(self.filenames[group], q, group)
+                    i += 1
+
+            else:
+                batch = False
+                total_files = len(self.filenames)
+                files = self.checkUpToDate(self.filenames, q)
+                if self.workers > 1 and len(files) > 1:
+                    self.processParallel(files, q)
+                else:
+                    self.processSerial(files, q)
+                msg = "%s: %d files processed, %d skipped (up to date)" % (self.processname, len(files),
+                                                                          total_files - len(files))
+                print(msg)
+                logger.info(msg)
+
+            self.callback(((100, self.row, total_files, total_files, self.processname)))
+        except RunCancelled:
+            self.status = CANCELLED
+            logger.info("%s: cancelled", self.processname)
+            self.notifyCancelled()
+        except Exception as e:
+            self.status = FAILED
+            self.callback(((-1, self.row, i + 1, total_files, self.processname)))
+            logging.error(e)
+        finally:
+            self.manifest.save()
+            logger.info('Finished ProcessThread')
+
+    # ----------------------------------------------------------------------
+    def getTask(self, filename):
+        """
+        Arguments for processFile - everything a worker process needs to run the module on one file
+        :param filename: data file to process
+        :return: tuple of args
+        """
+        return (filename, self.output, self.factory, self.showplots)
+
+    def checkUpToDate(self, files, q):
+        """
+        Find files which need processing - results for files with up to date outputs are put in q
+        :param files: list of data files
+        :param q: queue for results
+        :return: list of files to process
+        """
+        cfg = self.factory.getConfig()
+        process = Manifest.processKey(self.processid, self.factory)
+        todo = []
+        for f in files:
+            if (self.processid, f) in self.resumed:
+                # done in earlier attempt of this run
+                q[f] = self.resumed[(self.processid, f)]
+                continue
+            self.fingerprints[f] = (self.manifest.getKey(process, f, cfg), self.manifest.fingerprint(f, process, cfg))
+            output = None
+            if not self.force:
+                output = self.manifest.getOutput(getOutputdir(f, self.output), *self.fingerprints[f])
+            if output is not None:
+                q[f] = output
+                self.recordFile(self.processid, f, DONE, output)
+            else:
+                todo.append(f)
+        return todo
+
+    def recordOutput(self, filename, result, stats=None):
+        (key, fingerprint) = self.fingerprints.get(filename, (None, None))
+        self.manifest.record(getOutputdir(filename, self.output), key, fingerprint, result)
+        self.recordFile(self.processid, filename, DONE, result, stats)
+
+    def processParallel(self, files, q):
+        """
+        Run module over files in a pool of worker processes - results collected as each file finishes.
+        If cancelled, workers stop at their next file or chunk and files finished before they stop are recorded.
+        :param files: list of data files
+        :param q: queue for results
+        :return:
+        """
+        total_files = len(files)
+        workers = min(self.workers, total_files)
+        logger.info("%s: running %d files with %d workers", self.processname, total_files, workers)
+        pool = self.getPool(workers)
+        try:
+            tasks = [self.getTask(f) for f in files]
+            results = pool.imap_unordered(processFile, tasks)
+            for i in range(total_files):
+                try:
+                    (filename, result, stats) = results.next()
+                except RunCancelled:
+                    continue
+                q[filename] = result
+                self.recordOutput(filename, result, stats)
+                if self.isCancelled():
+                    continue
+                count = ((i + 1) / total_files) * 100
+                msg = "%s run: count=%d of %d (%d percent)" % (self.processname, i + 1, total_files, count)
+                logger.info(msg)
+                if count < 100:
+                    self.callback(((count, self.row, i + 1, total_files, self.processname)))
+            pool.close()
+            checkCancelled()
+        except RunCancelled as e:
+            raise e
+        except Exception as e:
+            pool.terminate()
+            raise e
+        finally:
+            pool.join()
+
+    def processSerial(self, files, q):
+        """
+        Run module over files in this thread - the next files are loaded in reader threads (config PREFETCH_DEPTH)
+        while the current file is processed and outputs are written in a writer thread (config WRITE_QUEUE_DEPTH).
+        Files are recorded when their outputs have been written.
+        :param files: list of data files
+        :param q: queue for results
+        :return:
+        """
+        depth = max(0, self.config.getInt('PREFETCH_DEPTH', 2))
+        writer = AsyncWriter(self.config.getInt('WRITE_QUEUE_DEPTH', 4))
+        writing = []
+        try:
+            for i, (task, (mod, recorder)) in enumerate(prefetch(prefetchFile, [self.getTask(f) for f in files],
+                                                                 depth)):
+                checkCancelled()
+                count = (i / len(files)) * 100
+                msg = "%s run: count=%d of %d (%d percent)" % (self.processname, i, len(files), count)
+                print(msg)
+                logger.info(msg)
+                stats = {'start': time.time()}
+                mod.writer = writer
+                # writes are recorded with the file as they finish in the writer thread
+                with recording(task[0], recorder):
+                    with stage('run'):
+                        result = mod.run()
+                stats['end'] = time.time()
+                stats['events'] = recorder.events
+                writing.append((task[0], result, stats, getattr(mod, 'writes', [])))
+                writing = self.recordWritten(writing, q)
+        finally:
+            # files already run are recorded when their outputs are written even if the run stops
+            writer.close()
+            self.recordWritten(writing, q)
+
+    def recordWritten(self, writing, q):
+        """
+        Record files with all outputs written
+        :param writing: list of (filename, result, stats, futures of writes)
+        :param q: queue for results
+        :return: list of files still being written
+        :raises: exception of a failed write
+        """
+        waiting = []
+        for (filename, result, stats, writes) in writing:
+            if len([w for w in writes if not w.done()]) > 0:
+                waiting.append((filename, result, stats, writes))
+                continue
+            for w in writes:
+                if w.exception() is not None:
+                    raise w.exception()
+            q[filename] = result
+            self.recordOutput(filename, result, stats)
+        return waiting
+
+    def processData(self, filename, q):
+        """
+        Run module here - can modify according to class if needed
+        :param filename: data file to process
+        :param q: queue for results
+        :return:
+        """
+        (filename, result, stats) = processFile(self.getTask(filename))
+        q[filename] = result
+        self.recordOutput(filename, result, stats)
+
+
+    def processBatch(self, filelist, q, group=None):
+        """
+        Run module here - can modify according to class if needed
+        :param filename: data file to process
+        :param q: queue for results
+        :return:
+        """
+        if (self.processid, group) in self.resumed:
+            q[group] = self.resumed[(self.processid, group)]
+            return
+        (group, result, stats) = processGroup((filelist, self.output, self.factory, self.showplots, group))
+        q[group] = result
+        self.recordFile(self.processid, group, DONE, result, stats)
+
+
+    def notifyCancelled(self):
+        self.callback(((-1, self.row, 0, len(self.filenames), self.processname)))
+
+
+
+########################################################################
+
+class PipelineThread(RunThread):
+    """
+    Runs selected processes together as a pipeline in one worker pool - each file is passed to the next
+    process as soon as it has been processed, and batch processes start when all their inputs are done.
+    """
+
+    def __init__(self, engine, callback, pipeline, outputdir, inputs, groups, rows, showplots, workers=None,
+                 force=False):
+        """
+        :param engine: Engine
+        :param callback: function for progress as (count, row, i, total, processname)
+        :param pipeline: Pipeline of selected processes
+        :param outputdir: output directory for batch processes
+        :param inputs: checked input files for each root process - list for local, dict of groups for batch
+        :param groups: dict of input filename: list of groups
+        :param rows: dict of process: row in progress window
+        :param showplots: display plots
+        :param workers: number of worker processes (default config WORKERS or all cores)
+        :param force: process all files even if outputs are up to date
+        """
+        RunThread.__init__(self, engine)
+        self.callback = callback
+        self.pipeline = pipeline
+        self.output = outputdir
+        self.inputs = inputs
+        self.groups = groups
+        self.rows = rows
+        self.showplots = showplots
+        # Config read once for the whole run
+        self.config = self.engine.db.getSnapshot(self.engine.currentconfig)
+        if workers is None:
+            workers = self.config.getInt('WORKERS', cpu_count())
+        self.workers = max(1, int(workers))
+        self.q = {p: dict() for p in pipeline.stages}
+        self.origin = {}
+        self.statelock = threading.RLock()
+        self.done = threading.Event()
+        self.pending = {p: 0 for p in pipeline.stages}
+        self.total = {p: 0 for p in pipeline.stages}
+        self.finished = {p: 0 for p in pipeline.stages}
+        self.started = set()
+        self.complete = set()
+        self.failed = set()
+        # files from upstream processes for batch processes
+        self.batchfiles = {p: {} for p in pipeline.stages}
+        self.pool = None
+        # Files with up to date outputs are skipped unless forced
+        self.force = force
+        self.manifest = Manifest()
+        # manifest (key, fingerprint) of input files taken before processing
+        self.fingerprints = {}
+        self.skipped = {p: 0 for p in pipeline.stages}
+        # module factories with config for this run
+        self.factories = {}
+        self.moduleconfig = {}
+        for p in pipeline.stages:
+            self.factories[p] = self.engine.factories[p].configure(self.config)
+            if not pipeline.isBatch(p):
+                self.moduleconfig[p] = self.factories[p].getConfig()
+        # stages are not checked for completion until all first processes are submitted
+        self.starting = True
+
+    # ----------------------------------------------------------------------
+    def process(self):
+        try:
+            self.pool = self.getPool(self.workers)
+            with self.statelock:
+                for p in self.pipeline.roots():
+                    self.startStage(p, self.inputs[p])
+                self.starting = False
+                self.checkComplete()
+            self.done.wait()
+            if self.isCancelled():
+                # workers stop at their next file or chunk - files done until then are recorded
+                self.notifyCancelled()
+            self.pool.close()
+        except Exception as e:
+            logging.error(e)
+            if self.pool is not None:
+                self.pool.terminate()
+            for p in self.pipeline.stages:
+                if p not in self.complete:
+                    self.postProgress(p, -1)
+        finally:
+            if self.pool is not None:
+                self.pool.join()
+            self.manifest.save()
+            for p in self.pipeline.stages:
+                msg = "%s: %d processed, %d skipped (up to date)" % (self.pipeline.processes[p]['caption'],
+                                                                    self.finished[p] - self.skipped[p], self.skipped[p])
+                print(msg)
+                logger.info(msg)
+            if self.isCancelled():
+                self.status = CANCELLED
+            elif len(self.failed) > 0 or len(self.complete) < len(self.pipeline.stages):
+                self.status = FAILED
+            logger.info('Finished PipelineThread')
+
+    def cancel(self):
+        RunThread.cancel(self)
+        self.done.set()
+
+    def notifyCancelled(self):
+        with self.statelock:
+            for p in self.pipeline.stages:
+                if p not in self.complete:
+                    self.complete.add(p)
+                    self.postProgress(p, -1)
+
+    # ----------------------------------------------------------------------
+    def postProgress(self, process, count):
+        caption = self.pipeline.processes[process]['caption']
+        self.callback((count, self.rows[process], self.finished[process], self.total[process], caption))
+
+    def startStage(self, process, inputs):
+        """
+        Submit all files for process - list of files for local or dict of groups for batch
+        """
+        self.started.add(process)
+        if isinstance(inputs, dict):
+            for group in inputs.keys():
+                if group == 'all' or len(inputs[group]) <= 0:
+                    continue
+                if (process, group) in self.resumed:
+                    self.skip(process, group, self.resumed[(process, group)])
+                    continue
+                task = (inputs[group], self.output, self.factories[process], self.showplots, group)
+                self.submit(process, processGroup, task, group)
+        else:
+            for f in inputs:
+                self.submitFile(process, f, f)
+
+    def submitFile(self, process, filename, origin):
+        """
+        Submit file for local process
+        :param origin: input file of first process - for groups
+        """
+        name = Manifest.processKey(process, self.factories[process])
+        self.origin[filename] = origin
+        if (process, filename) in self.resumed:
+            # done in earlier attempt of this run
+            self.skip(process, filename, self.resumed[(process, filename)])
+            return
+        key = self.manifest.getKey(name, filename, self.moduleconfig[process])
+        fingerprint = self.manifest.fingerprint(filename, name, self.moduleconfig[process])
+        self.fingerprints[(process, filename)] = (key, fingerprint)
+        if not self.force:
+            output = self.manifest.getOutput(getOutputdir(filename, 'local'), key, fingerprint)
+            if output is not None:
+                self.recordFile(process, filename, DONE, output)
+                self.skip(process, filename, output)
+                return
+        task = (filename, 'local', self.factories[process], self.showplots)
+        self.submit(process, processFile, task, filename)
+
+    def skip(self, process, key, output):
+        """
+        File or group with output up to date - passed on as if processed
+        """
+        with self.statelock:
+            self.pending[process] += 1
+            self.total[process] += 1
+            self.skipped[process] += 1
+            self.taskDone(process, (key, output, None))
+
+    def submit(self, process, func, task, key):
+        """
+        Submit task to pool
+        :param key: filename or group of task
+        """
+        if self.isCancelled():
+            return
+        with self.statelock:
+            self.pending[process] += 1
+            self.total[process] += 1
+            try:
+                self.pool.apply_async(func, (task,), callback=partial(self.taskDone, process),
+                                      error_callback=partial(self.taskError, process, key))
+            except Exception:
+                self.pending[process] -= 1
+                self.total[process] -= 1
+                raise
+
+    # ----------------------------------------------------------------------
+    def taskDone(self, process, result):
+        """
+        Called in pool result thread when a file or group is done - passes output on to downstream processes.
+        The task is counted once - errors after it is done mark the process (or downstream process) failed.
+        """
+        with self.statelock:
+            (key, output, stats) = result
+            self.q[process][key] = output
+            self.pending[process] -= 1
+            self.finished[process] += 1
+            try:
+                if stats is not None:
+                    if not self.pipeline.isBatch(process):
+                        (entry, fingerprint) = self.fingerprints.get((process, key), (None, None))
+                        self.manifest.record(getOutputdir(key, 'local'), entry, fingerprint, output)
+                    self.recordFile(process, key, DONE, output, stats)
+                count = (self.finished[process] / self.total[process]) * 100
+                msg = "%s run: count=%d of %d (%d percent)" % (self.pipeline.processes[process]['caption'],
+                                                              self.finished[process], self.total[process], count)
+                logger.info(msg)
+                if count < 100 and not self.isCancelled():
+                    self.postProgress(process, count)
+            except Exception as e:
+                self.markFailed(process, e)
+            if output is not None and not self.pipeline.isBatch(process):
+                for d in self.pipeline.downstream[process]:
+                    try:
+                        origin = self.origin[key]
+                        if self.pipeline.isBatch(d):
+                            for group in self.groups.get(origin, []):
+                                self.batchfiles[d].setdefault(group, []).append(output)
+                        else:
+                            self.submitFile(d, output, origin)
+                    except Exception as e:
+                        self.markFailed(d, e)
+            self.checkComplete()
+
+    def taskError(self, process, key, error):
+        """
+        Called in pool result thread when a file or group fails
+        """
+        if not isinstance(error, RunCancelled):
+            self.recordFile(process, key, FAILED, error=error)
+        self.taskFailed(process, error)
+
+    def taskFailed(self, process, error):
+        """
+        Task of process failed or was cancelled - counted as no longer pending
+        """
+        with self.statelock:
+            self.markFailed(process, error)
+            self.pending[process] -= 1
+            self.checkComplete()
+
+    def markFailed(self, process, error):
+        """
+        Mark process failed without changing counts
+        """
+        if isinstance(error, RunCancelled):
+            logger.info("%s: cancelled", self.pipeline.processes[process]['caption'])
+        else:
+            logger.error("%s: %s", self.pipeline.processes[process]['caption'], error)
+        with self.statelock:
+            self.failed.add(process)
+
+    def checkComplete(self):
+        """
+        Start batch processes with all inputs ready and mark processes complete - sets done when all complete
+        """
+        with self.statelock:
+            if self.starting:
+                return
+            changed = True
+            while changed:
+                changed = False
+                for p in self.pipeline.stages:
+                    if p in self.complete or self.pending[p] > 0:
+                        continue
+                    if len([u for u in self.pipeline.upstream[p] if u not in self.complete]) > 0:
+                        continue
+                    if p not in self.started:
+                        # all upstream done so batch inputs are ready
+                        try:
+                            self.startStage(p, self.batchfiles[p])
+                        except Exception as e:
+                            self.markFailed(p, e)
+                        if self.pending[p] > 0:
+                            continue
+                    self.complete.add(p)
+                    changed = True
+                    if p in self.failed:
+                        self.postProgress(p, -1)
+                    else:
+                        self.postProgress(p, 100)
+            if len(self.complete) == len(self.pipeline.stages):
+                self.done.set()
+
+
+########################################################################
+
+class Engine():
+    """
+    Runs processes without GUI - progress goes to the callback for each run and to all subscribers
+    """
+    def __init__(self, configfile, configID,processfile):
+        self.logger = self.loadLogger()
+        self.processfile = processfile
+        self.cmodules = self.loadProcesses()
+        self.configfile = configfile
+        self.currentconfig = configID #multiple configs possible
+        # connect to db
+        self.db = DBI(configfile)
+        self.db.getconn()
+        # progress callbacks for all runs
+        self.subscribers = []
+        # runs are admitted within CPU and memory budgets - SCHEDULER_CPUS (default all cores),
+        # SCHEDULER_MEMORY and WORKER_MEMORY in MB (default no limit)
+        config = self.db.getSnapshot(self.currentconfig)
+        self.scheduler = RunScheduler(config.getInt('SCHEDULER_CPUS'), config.getFloat('SCHEDULER_MEMORY'))
+        # runs not finished by runid
+        self.runs = {}
+        self.journal = self.loadJournal()
+
+    def subscribe(self, callback):
+        """
+        Add callback for progress of all runs
+        :param callback: function taking (count, row, i, total, processname)
+        """
+        if callback not in self.subscribers:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def getNotifier(self, callback=None):
+        """
+        Progress function for a run - sends to callback for the run and all subscribers
+        :param callback: function taking (count, row, i, total, processname) or None
+        :return: function
+        """
+        def notify(data):
+            if callback is not None:
+                callback(data)
+            for c in self.subscribers:
+                c(data)
+        return notify
+
+    def loadProcesses(self):
+        pf = None
+        try:
+            pf = open(self.processfile, 'rb')
+            self.processes = yaml.safe_load(pf)
+            cmodules={}
+            # classes resolved and checked once - per file runs only create and run modules
+            self.factories = {}
+            for p in self.processes:
+                msg = "Controller:LoadProcessors: loading %s=%s" % (p, self.processes[p]['caption'])
+                logging.debug(msg)
+                module_name = self.processes[p]['modulename']
+                class_name = self.processes[p]['classname']
+                cmodules[p] =(module_name,class_name)
+                try:
+                    self.factories[p] = ModuleFactory(module_name, class_name)
+                except ValueError as e:
+                    # other processes can still be run
+                    logger.error("Controller:LoadProcessors: skipping %s - %s", p, e)
+            # processes reading outputs of other processes
+            filesout = set([f for p in self.processes for f in self.processes[p]['filesout'].split(", ")])
+            for p in self.factories:
+                filesin = set(self.processes[p]['filesin'].split(", "))
+                self.factories[p].intermediate = len(filesin & filesout) > 0
+            return cmodules
+        except Exception as e:
+            raise e
+        finally:
+            if pf is not None:
+                pf.close()
+
+    def loadLogger(self,outputdir=None, expt=''):
+        #### LoggingConfig
+        logger.setLevel(logging.INFO)
+        homedir = expanduser("~")
+        if outputdir is not None and access(outputdir, R_OK):
+            homedir = outputdir
+        if len(expt) >0:
+            expt = expt + "_"
+        if not access(join(homedir, "logs"), R_OK):
+            mkdir(join(homedir, "logs"))
+        self.logfile = join(homedir, "logs", expt+'analysis.log')
+        handler = RotatingFileHandler(filename=self.logfile, maxBytes=10000000, backupCount=10)
+        formatter = logging.Formatter('[ %(asctime)s %(levelname)-4s ] (%(threadName)-9s) %(message)s')
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+        return logger
+
+    def loadJournal(self):
+        """
+        Run journal next to config database - or in home logs directory if that is not writable
+        :return: RunJournal
+        """
+        journaldir = dirname(abspath(self.configfile))
+        if not access(journaldir, W_OK):
+            journaldir = join(expanduser("~"), "logs")
+        return RunJournal(join(journaldir, JOURNAL_FILENAME))
+
+    # ----------------------------------------------------------------------
+    # def loadConfig(self, config=None):
+    #     """
+    #     Load from config file or config object
+    #     :param config:
+    #     :return:
+    #     """
+    #     try:
+    #         if config is not None and isinstance(config, ConfigObj):
+    #             logger.info("Loading config obj:%s", config.filename)
+    #         elif isinstance(config, str) and access(config, R_OK):
+    #             logger.info("Loading config from file:%s", config)
+    #             config = ConfigObj(config)
+    #         else:
+    #             logger.warning('No config file found')
+    #             config = ConfigObj()
+    #
+    #     except IOError as e:
+    #         logging.error(e)
+    #     except ValueError as e:
+    #         logging.error(e)
+    #
+    #     return config
+
+    # ----------------------------------------------------------------------
+    def RunCompare(self, indirs, outputdir, prefixes, searchtext):
+        """
+        Comparison of groups
+        :param indirs:
+        :param outputdir:
+        :param prefixes:
+        :param searchtext:
+        :return:
+        """
+        pass
+
+
+    # ----------------------------------------------------------------------
+    def RunProcess(self, process,outputdir,filenames, row, showplots=False, workers=None, fileindex=None,
+                   force=False, callback=None, resume=None):
+        """
+        Instantiate Thread with type for Process
+        :param filenames:
+        :param type:
+        :param row:
+        :param workers: number of worker processes for per-file processing (default config WORKERS or all cores)
+        :param fileindex: FileIndex shared between processes in the same run
+        :param force: process all files even if outputs are up to date
+        :param callback: function for progress of this run as (count, row, i, total, processname)
+        :param resume: runid in journal of run to continue
+        :return: ProcessThread
+        """
+        self.checkLoaded([process])
+        options = {'row': row, 'showplots': showplots, 'workers': workers, 'force': force}
+        journalargs = ('process', [process], outputdir, filenames, options, resume)
+        type = self.processes[process]['href']
+        processname = self.processes[process]['caption']
+        config = self.db.getSnapshot(self.currentconfig)
+        filesIn = [config.get(f, f) for f in self.processes[process]['filesin'].split(", ")]
+        filenames = CheckFilenames(filenames,filesIn,fileindex)
+        # filesout = self.processes[process]['filesout'] #TODO link up with module config?
+        # suffix = self.db.getConfigByName(self.currentconfig,filesout)
+        if self.processes[process]['output'] == 'local':
+            outputdir = self.processes[process]['output']
+            filenames = filenames['all']
+
+        if len(filenames) > 0:
+            logger.info("Load Process Threads: %s [row: %d]", type, row)
+            notify = self.getNotifier(callback)
+            notify((0, row, 0, len(filenames), processname))
+            t = ProcessThread(self, notify, self.factories[process],outputdir, filenames, row, processname, showplots, workers,
+                              force, process)
+            self.journalRun(t, *journalargs)
+            self.submitRun(t, processname, [process], runPaths(filenames, outputdir))
+            logger.info("Running Thread: %s", type)
+            return t
+        else:
+            logger.error("No files to process")
+            raise ValueError("No matched files to process")
+
+    # ----------------------------------------------------------------------
+    def RunPipeline(self, selected, outputdir, filenames, showplots=False, workers=None, fileindex=None,
+                    force=False, callback=None, resume=None):
+        """
+        Run selected processes as a pipeline - files are passed between dependent processes as they finish
+        :param selected: list of process ids
+        :param outputdir: output directory for batch processes
+        :param filenames: dict of group: files with 'all' for all files
+        :param showplots: display plots
+        :param workers: number of worker processes (default config WORKERS or all cores)
+        :param fileindex: FileIndex of input directories
+        :param force: process all files even if outputs are up to date
+        :param callback: function for progress of this run as (count, row, i, total, processname)
+        :param resume: runid in journal of run to continue
+        :return: PipelineThread
+        """
+        self.checkLoaded(selected)
+        pipeline = Pipeline(self.processes, selected)
+        config = self.db.getSnapshot(self.currentconfig)
+        inputs = {}
+        groups = {}
+        for p in pipeline.roots():
+            filesIn = [config.get(f, f) for f in self.processes[p]['filesin'].split(", ")]
+            checked = CheckFilenames(filenames, filesIn, fileindex)
+            for group in checked.keys():
+                if group == 'all':
+                    continue
+                for f in checked[group]:
+                    groups.setdefault(f, []).append(group)
+            if pipeline.isBatch(p):
+                inputs[p] = checked
+            else:
+                inputs[p] = checked['all']
+            if len(checked['all']) <= 0:
+                logger.error("No files to process: %s", self.processes[p]['caption'])
+                raise ValueError("No matched files to process for %s" % self.processes[p]['caption'])
+        notify = self.getNotifier(callback)
+        rows = {}
+        for row, p in enumerate(pipeline.stages):
+            rows[p] = row
+            notify((0, row, 0, len(inputs.get(p, [])), self.processes[p]['caption']))
+        logger.info("Load Pipeline Thread: %s", ", ".join(pipeline.stages))
+        t = PipelineThread(self, notify, pipeline, outputdir, inputs, groups, rows, showplots, workers, force)
+        self.journalRun(t, 'pipeline', selected, outputdir, filenames,
+                        {'showplots': showplots, 'workers': workers, 'force': force}, resume)
+        self.submitRun(t, ", ".join([self.processes[p]['caption'] for p in pipeline.stages]), pipeline.stages,
+                       runPaths(filenames, outputdir))
+        return t
+
+    def checkLoaded(self, processes):
+        """
+        Check process modules were loaded
+        :param processes: list of process ids
+        :raises ValueError: if a process module could not be loaded
+        """
+        missing = [p for p in processes if p not in self.factories]
+        if len(missing) > 0:
+            raise ValueError("Process module not loaded for %s - check processes config" %
+                             ", ".join([self.processes[p]['caption'] if p in self.processes else p for p in missing]))
+
+    def journalRun(self, t, kind, processes, outputdir, filenames, options, resume=None):
+        """
+        Record run in journal - or continue run from journal with the files done so far
+        :param t: RunThread
+        :param kind: 'process' or 'pipeline'
+        :param processes: list of process ids
+        :param outputdir: output directory as given to run
+        :param filenames: input files as given to run
+        :param options: other arguments of run
+        :param resume: runid in journal or None for new run
+        """
+        if resume is None:
+            t.journalid = self.journal.startRun(kind, self.currentconfig, processes, outputdir, filenames, options)
+        else:
+            t.journalid = resume
+            t.resumed = self.journal.getCompleted(resume)
+            self.journal.restartRun(resume)
+            logger.info("Resuming run %d: %d files done", resume, len(t.resumed))
+
+    def ResumeRun(self, runid=None, workers=None, callback=None):
+        """
+        Continue unfinished run from journal (crashed, failed or cancelled) - only files not done are processed
+        :param runid: runid in journal or None for the latest unfinished run
+        :param workers: number of worker processes or None as for run
+        :param callback: function for progress of this run as (count, row, i, total, processname)
+        :return: RunThread
+        """
+        if runid is None:
+            unfinished = self.journal.getUnfinished()
+            if len(unfinished) <= 0:
+                raise ValueError("No unfinished runs to resume")
+            runid = unfinished[0]
+        run = self.journal.getRun(runid)
+        if run is None:
+            raise ValueError("Run not found in journal: %s" % runid)
+        if runid in [t.journalid for t in list(self.runs.values())]:
+            raise ValueError("Run is still running: %s" % runid)
+        if run['configid'] != self.currentconfig:
+            logger.warning("Resume: run %d used config %s - running with %s", runid, run['configid'],
+                           self.currentconfig)
+        options = run['options']
+        if workers is not None:
+            options['workers'] = workers
+        if run['kind'] == 'pipeline':
+            return self.RunPipeline(run['processes'], run['outputdir'], run['filenames'], options['showplots'],
+                                    options['workers'], force=options['force'], callback=callback, resume=runid)
+        return self.RunProcess(run['processes'][0], run['outputdir'], run['filenames'], options['row'],
+                               options['showplots'], options['workers'], force=options['force'], callback=callback,
+                               resume=runid)
+
+    def submitRun(self, t, name, processes, paths):
+        """
+        Queue run in scheduler - started when runs it depends on have finished and workers are available
+        :param t: RunThread
+        :param name: name for logs
+        :param processes: process ids run - files read and written are from filesin and filesout
+        :param paths: directories used
+        :return: runid
+        """
+        reads = set()
+        writes = set()
+        for p in processes:
+            reads.update(self.processes[p]['filesin'].split(", "))
+            writes.update(self.processes[p]['filesout'].split(", "))
+        memory = t.workers * t.config.getFloat('WORKER_MEMORY', 0)
+        with self.scheduler.condition:
+            t.runid = self.scheduler.submit(name, t.admit, t.workers, memory, reads, writes, paths)
+            if self.scheduler.getState(t.runid) not in FINISHED:
+                self.runs[t.runid] = t
+        return t.runid
+
+    def cancel(self, runid=None):
+        """
+        Cancel run or all runs - queued runs are removed and running runs stop at the next file or chunk.
+        Outputs of files already processed are kept and recorded so they are skipped when the run is repeated.
+        :param runid: id from RunProcess or RunPipeline thread or None for all runs
+        """
+        runids = [runid] if runid is not None else self.scheduler.active()
+        for r in runids:
+            t = self.runs.get(r)
+            if self.scheduler.cancel(r):
+                self.runs.pop(r, None)
+                if t is not None:
+                    if t.journalid is not None:
+                        self.journal.endRun(t.journalid, CANCELLED)
+                    t.notifyCancelled()
+            elif t is not None:
+                t.cancel()
+
+    # ----------------------------------------------------------------------
+
+
+    def shutdown(self, wait=False, timeout=None):
+        """
+        Cancel all runs
+        :param wait: wait until runs have stopped
+        :param timeout: secs to wait or None
+        :return: True if all runs have stopped
+        """
+        active = self.scheduler.active()
+        if len(active) > 0:
+            logger.info('Shutdown: cancelling %d runs', len(active))
+            self.cancel()
+        if wait:
+            return self.scheduler.wait(timeout=timeout)
+        return len(self.scheduler.active()) == 0
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Timing and memory of run stages for each file
+    1. Stages (load, run, write) are recorded for the file being processed in the thread - worker processes
+       return their events with the result of each file
+    2. Each stage has start, duration, rows in and out, bytes read and written and (if tracemalloc is
+       tracing eg config TRACE_MEMORY) peak memory allocated during the stage
+    3. tracemalloc is process-wide so peak memory is only recorded for stages which do not overlap a stage
+       in another thread of the process (eg reader or writer threads) - otherwise it is left empty.
+       Runs start and stop tracing with startMemory and stopMemory so concurrent runs share it.
+    4. Events of a run are saved as a Chrome trace (open in chrome://tracing or ui.perfetto.dev)
+       and a summary CSV with a row per file and stage
+
+Created on 18 Oct 2026
+
+@author: QBI Software
+"""
+
+import csv
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from os import getpid
+from os.path import basename
+
+COUNTS = ['rows_in', 'rows_out', 'bytes_in', 'bytes_out', 'peak_memory']
+SUMMARY_FIELDS = ['process', 'file', 'stage', 'start', 'duration'] + COUNTS + ['detail', 'pid', 'tid']
+
+# recorder and open stages of this thread
+_local = threading.local()
+# open stages of all threads in this process and number of runs tracing memory
+_lock = threading.Lock()
+_open = {}
+_tracers = 0
+_started = False
+
+
+def startMemory():
+    """
+    Start tracing memory for a run - tracing continues until all runs which started it have stopped
+    """
+    global _tracers, _started
+    with _lock:
+        if _tracers == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started = True
+        _tracers += 1
+
+
+def stopMemory():
+    """
+    Stop tracing memory for a run - tracemalloc is stopped when no runs are tracing (if started here)
+    """
+    global _tracers, _started
+    with _lock:
+        _tracers = max(0, _tracers - 1)
+        if _tracers == 0 and _started:
+            tracemalloc.stop()
+            _started = False
+
+
+class Recorder():
+    def __init__(self, key):
+        """
+        Events for one file or group
+        :param key: filename or group
+        """
+        self.key = key
+        self.events = []
+
+
+@contextmanager
+def recording(key, recorder=None):
+    """
+    Record stages in this thread for file or group
+    :param key: filename or group
+    :param recorder: Recorder to add to or None for new
+    :return: Recorder
+    """
+    previous = getattr(_local, 'recorder', None)
+    if recorder is None:
+        recorder = Recorder(key)
+    _local.recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _local.recorder = previous
+
+
+def bind(func):
+    """
+    Function which records stages for the current file when it is called in another thread eg writer
+    :return: function
+    """
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None:
+        return func
+
+    def bound(*args, **kwargs):
+        with recording(recorder.key, recorder):
+            return func(*args, **kwargs)
+    return bound
+
+
+@contextmanager
+def stage(name, detail=None):
+    """
+    Time stage for current file - nothing is recorded if not recording in this thread
+    :param name: stage eg load, run, write
+    :param detail: eg output filename
+    :return: event dict - counts (COUNTS) can be set in the block
+    """
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None:
+        yield {}
+        return
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    stack = _local.stack
+    tid = threading.get_ident()
+    event = {'stage': name, 'file': recorder.key, 'detail': detail, 'pid': getpid(), 'tid': tid}
+    frame = {'event': event, 'peak': 0, 'base': None, 'tid': tid, 'shared': False}
+    with _lock:
+        # stages in other threads allocate and reset the peak at the same time - no memory for any of them
+        others = [f for f in _open.values() if f['tid'] != tid]
+        for f in others:
+            f['shared'] = True
+        frame['shared'] = len(others) > 0
+        # peak is reset for each stage - outer stages keep the highest peak of their inner stages
+        if not frame['shared'] and tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak'):
+            (current, peak) = tracemalloc.get_traced_memory()
+            if len(stack) > 0:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame['base'] = current
+        _open[id(frame)] = frame
+    stack.append(frame)
+    event['start'] = time.time()
+    t0 = time.perf_counter()
+    try:
+        yield event
+    finally:
+        event['duration'] = time.perf_counter() - t0
+        stack.pop()
+        with _lock:
+            del _open[id(frame)]
+            if not frame['shared'] and frame['base'] is not None and tracemalloc.is_tracing():
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                event['peak_memory'] = peak - frame['base']
+                if len(stack) > 0:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        recorder.events.append(event)
+
+
+def annotate(**counts):
+    """
+    Add counts eg rows_in=100 to the innermost open stage in this thread
+    """
+    stack = getattr(_local, 'stack', [])
+    if len(stack) > 0:
+        stack[-1]['event'].update(counts)
+
+
+def saveTrace(events, outputfile):
+    """
+    Save events as Chrome trace - complete events with counts as args
+    :param events: list of event dicts with process
+    :param outputfile: json filename
+    :return: outputfile
+    """
+    origin = min([e['start'] for e in events]) if len(events) > 0 else 0
+    trace = []
+    for e in events:
+        args = dict([(k, e[k]) for k in COUNTS + ['file', 'detail'] if e.get(k) is not None])
+        trace.append({'name': "%s %s" % (e['stage'], basename(str(e['file']))), 'cat': e.get('process', ''),
+                      'ph': 'X', 'ts': (e['start'] - origin) * 1e6, 'dur': e['duration'] * 1e6,
+                      'pid': e['pid'], 'tid': e['tid'], 'args': args})
+    with open(outputfile, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+    return outputfile
+
+
+def saveSummary(events, outputfile):
+    """
+    Save events as CSV - row per file and stage
+    :param events: list of event dicts with process
+    :param outputfile: csv filename
+    :return: outputfile
+    """
+    with open(outputfile, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for e in sorted(events, key=lambda e: e['start']):
+            writer.writerow(e)
+    return outputfile
@@ -1,30 +1,234 @@
 # -*- coding: utf-8 -*-
 """
 AutoBatch class
-1. Reads in list of files from INPUTDIR
+1. Reads in list of files from INPUTDIR (csv or binary npz/feather)
 2. Matches files in list to searchtext (filenames)
 3. Combines data from columns into single batch file with unique ids generated from files
+    - only BATCH_COLUMN_NAMES are read, files are read concurrently (BATCH_READERS threads)
 4. Outputs to output directory as BATCH_filename_searchtext.csv or excel
+    - BATCH_FORMAT wide: column per file id, one output per column (column name added if more than one)
+    - BATCH_FORMAT long: rows of id and all columns in one output
+    - BATCH_FORMAT npz: binary with values of each column, offsets and ids of files in one output
+5. Plots (showplots) to html for each column with WebGL traces
+    - PLOT_MODE summary: median, quartiles (error bars), min and max for each file
+    - PLOT_MODE raw: all values - decimated to at most PLOT_MAX_POINTS
+6. BATCH_INCREMENTAL: columns of files are kept with the output (.cache.npz) with a manifest (.manifest.json)
+    of id, path, size, mtime and digest of columns for each file - only new or changed files are read again
 
 Created on 19 Feb 2018
 
 @author: Liz Cooper-Williams, QBI
 """
 
+import hashlib
+import json
 import logging
 import re
+from concurrent.futures import ThreadPoolExecutor
 from glob import iglob
-from os import R_OK, access
-from os.path import join, isdir, commonpath, commonprefix,sep, basename, splitext
+from os import R_OK, access, stat
+from os.path import join, isdir, commonpath, commonprefix,sep, basename, splitext, exists, abspath
 
-from configobj import ConfigObj
-from numpy import unique
 import argparse
+import numpy as np
 import pandas as pd
-from plotly import offline
-from plotly.graph_objs import Layout, Scatter
 from collections import OrderedDict
+from autoanalysis.cancel import checkCancelled, getToken, setThreadToken
+from autoanalysis.processmodules.DataParser import BINARY_FORMATS, read_binary, timed_write
 DEBUG = 1
+BATCH_FORMATS = ['wide', 'long', 'npz']
+PLOT_MODES = ['summary', 'raw']
+
+def columnDigest(arrays):
+    """
+    Digest of column values for a file
+    :param arrays: list of numpy arrays
+    :return: hex string
+    """
+    digest = hashlib.sha1()
+    for values in arrays:
+        if values.dtype.kind in 'biuf':
+            digest.update(np.ascontiguousarray(values).tobytes())
+        else:
+            digest.update("\x00".join([str(v) for v in values]).encode('utf-8'))
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+class RaggedBatch():
+    def __init__(self, colnames):
+        """
+        Batch data for files with different numbers of rows - values of all files in one array per column
+        with offsets of each file (rows of file i are offsets[i] to offsets[i+1]) and file ids
+        :param colnames: list of columns
+        """
+        self.colnames = list(colnames)
+        self.ids = []
+        self.offsets = [0]
+        self.parts = {c: [] for c in self.colnames}
+        self._values = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, fid, df):
+        """
+        Add data for file
+        :param fid: file id
+        :param df: dataframe or dict of arrays with batch columns
+        """
+        n = 0
+        for c in self.colnames:
+            values = np.asarray(df[c])
+            self.parts[c].append(values)
+            n = len(values)
+        self.ids.append(fid)
+        self.offsets.append(self.offsets[-1] + n)
+        self._values = {}
+
+    def columns(self, i):
+        """
+        Values of all columns for file at position i
+        :return: list of numpy arrays
+        """
+        return [self.values(c)[self.offsets[i]:self.offsets[i + 1]] for c in self.colnames]
+
+    def values(self, colname):
+        """
+        All values for column
+        :return: numpy array
+        """
+        if colname not in self._values:
+            parts = self.parts[colname]
+            if len(parts) > 0:
+                self._values[colname] = np.concatenate(parts)
+            else:
+                self._values[colname] = np.array([])
+            # keep single array
+            self.parts[colname] = [self._values[colname]]
+        return self._values[colname]
+
+    def lengths(self):
+        return np.diff(np.asarray(self.offsets, dtype=np.int64))
+
+    def get(self, fid, colname):
+        """
+        Values for a file
+        """
+        i = self.ids.index(fid)
+        return self.columns(i)[self.colnames.index(colname)]
+
+    def wideBlock(self, colname, start, end):
+        """
+        Rows start to end of wide table for column - file ids as columns, NaN (or None) where file has fewer rows
+        :return: dataframe
+        """
+        values = self.values(colname)
+        lengths = self.lengths()
+        if values.dtype.kind in 'biuf':
+            block = np.full((end - start, len(self.ids)), np.nan)
+        else:
+            block = np.full((end - start, len(self.ids)), None, dtype=object)
+        for i in range(len(self.ids)):
+            if lengths[i] > start:
+                n = min(lengths[i], end) - start
+                block[0:n, i] = values[self.offsets[i] + start:self.offsets[i] + start + n]
+        return pd.DataFrame(block, columns=self.ids)
+
+    def toWide(self, colname):
+        """
+        Wide table for column (file ids as columns) - NaN padding
+        :return: dataframe
+        """
+        return self.wideBlock(colname, 0, int(self.lengths().max()) if len(self.ids) > 0 else 0)
+
+    def writeWide(self, outputfile, colname, na_rep='', blocksize=10000):
+        """
+        Write wide csv for column in blocks of rows - padding written as na_rep (empty as in earlier batch files)
+        :return: outputfile
+        """
+        maxrows = int(self.lengths().max()) if len(self.ids) > 0 else 0
+        with timed_write(outputfile, maxrows) as tmpfile:
+            if maxrows <= 0:
+                pd.DataFrame(columns=self.ids).to_csv(tmpfile, index=False)
+            for start in range(0, maxrows, blocksize):
+                block = self.wideBlock(colname, start, min(start + blocksize, maxrows))
+                block.to_csv(tmpfile, index=False, na_rep=na_rep, mode='w' if start == 0 else 'a',
+                             header=(start == 0))
+        return outputfile
+
+    def summary(self, colname):
+        """
+        Summary of values for each file (NaN ignored)
+        :return: dataframe with ids as index and count, min, q1, median, q3, max
+        """
+        values = np.asarray(self.values(colname), dtype=np.float64)
+        stats = np.full((len(self.ids), 6), np.nan)
+        for i in range(len(self.ids)):
+            x = values[self.offsets[i]:self.offsets[i + 1]]
+            x = x[~np.isnan(x)]
+            stats[i, 0] = len(x)
+            if len(x) > 0:
+                stats[i, 1:] = np.percentile(x, [0, 25, 50, 75, 100])
+        return pd.DataFrame(stats, index=pd.Index(self.ids, name='id'),
+                            columns=['count', 'min', 'q1', 'median', 'q3', 'max'])
+
+    def decimate(self, colname, maxpoints):
+        """
+        Values with ids - every nth value so there are at most maxpoints (same fraction of each file)
+        :return: (array of ids, array of values)
+        """
+        values = self.values(colname)
+        ids = np.repeat(np.array(self.ids, dtype=object), self.lengths())
+        step = int(np.ceil(len(values) / float(maxpoints))) if maxpoints > 0 else 1
+        if step > 1:
+            return (ids[::step], values[::step])
+        return (ids, values)
+
+    def toLong(self):
+        """
+        Long table with id and all columns
+        :return: dataframe
+        """
+        df = pd.DataFrame(OrderedDict([(c, self.values(c)) for c in self.colnames]))
+        df.insert(0, 'id', np.repeat(np.array(self.ids, dtype=object), self.lengths()))
+        return df
+
+    def writeLong(self, outputfile):
+        data = self.toLong()
+        with timed_write(outputfile, len(data)) as tmpfile:
+            data.to_csv(tmpfile, index=False)
+        return outputfile
+
+    def save(self, outputfile):
+        """
+        Save as npz - columns as for DataParser.save_data with ids and offsets
+        :return: outputfile
+        """
+        arrays = {'c%d' % i: self.values(c) for i, c in enumerate(self.colnames)}
+        arrays['__columns__'] = np.array(self.colnames)
+        arrays['__ids__'] = np.array(self.ids, dtype=str)
+        arrays['__offsets__'] = np.asarray(self.offsets, dtype=np.int64)
+        with timed_write(outputfile, int(self.offsets[-1])) as tmpfile:
+            with open(tmpfile, 'wb') as f:
+                np.savez(f, **arrays)
+        return outputfile
+
+    @classmethod
+    def load(cls, datafile):
+        """
+        Load from npz saved by save
+        :return: RaggedBatch
+        """
+        with np.load(datafile, allow_pickle=True) as bundle:
+            batch = cls([str(c) for c in bundle['__columns__']])
+            batch.ids = [str(i) for i in bundle['__ids__']]
+            batch.offsets = [int(o) for o in bundle['__offsets__']]
+            for i, c in enumerate(batch.colnames):
+                batch._values[c] = bundle['c%d' % i]
+                batch.parts[c] = [batch._values[c]]
+        return batch
+
 
 class AutoBatch:
     def __init__(self, inputfiles, outputdir, showplots=False):
@@ -44,19 +248,29 @@ class AutoBatch:
         self.n = 1  # generating id
         self.prefix =''
 
-    def getConfigurables(self):
+    @classmethod
+    def getConfigurables(cls):
         '''
         List of configurable parameters in order with defaults
         :return:
         '''
         cfg = OrderedDict()
-        cfg['BATCH_COLUMN_NAMES']=[]
+        cfg['BATCH_COLUMN_NAMES']=''
         cfg['BATCH_FILENAME']="BATCH.csv"
+        cfg['BATCH_FORMAT'] = 'wide'
+        cfg['BATCH_READERS'] = 4
+        cfg['BATCH_INCREMENTAL'] = True
+        cfg['PLOT_MODE'] = 'summary'
+        cfg['PLOT_MAX_POINTS'] = 100000
         return cfg
 
     def setConfigurables(self,cfg):
         if 'BATCH_COLUMN_NAMES' in cfg.keys() and cfg['BATCH_COLUMN_NAMES'] is not None:
-            self.colnames = cfg['BATCH_COLUMN_NAMES'].split(',')
+            # comma separated text from config db or list of columns
+            colnames = cfg['BATCH_COLUMN_NAMES']
+            if isinstance(colnames, str):
+                colnames = colnames.split(',')
+            self.colnames = [str(c).strip() for c in colnames if len(str(c).strip()) > 0]
         else:
             self.colnames =[]
         if 'BATCH_FILENAME' in cfg.keys() and cfg['BATCH_FILENAME'] is not None:
@@ -65,6 +279,32 @@ class AutoBatch:
                 self.suffix = self.suffix[1:]
         else:
             self.suffix ="BATCH.csv"
+        if 'BATCH_FORMAT' in cfg.keys() and cfg['BATCH_FORMAT'] is not None and len(cfg['BATCH_FORMAT']) > 0:
+            self.format = cfg['BATCH_FORMAT'].lower()
+            if self.format not in BATCH_FORMATS:
+                raise ValueError("Batch: BATCH_FORMAT must be one of %s" % ", ".join(BATCH_FORMATS))
+        else:
+            self.format = 'wide'
+        if 'BATCH_READERS' in cfg.keys() and cfg['BATCH_READERS'] is not None and len(str(cfg['BATCH_READERS'])) > 0:
+            self.readers = max(1, int(cfg['BATCH_READERS']))
+        else:
+            self.readers = 4
+        if 'BATCH_INCREMENTAL' in cfg.keys() and cfg['BATCH_INCREMENTAL'] is not None:
+            # config db stores as text eg '0' or '1'
+            self.incremental = str(cfg['BATCH_INCREMENTAL']).lower() in ['1', 'true', 'yes']
+        else:
+            self.incremental = True
+        if 'PLOT_MODE' in cfg.keys() and cfg['PLOT_MODE'] is not None and len(cfg['PLOT_MODE']) > 0:
+            self.plotmode = cfg['PLOT_MODE'].lower()
+            if self.plotmode not in PLOT_MODES:
+                raise ValueError("Batch: PLOT_MODE must be one of %s" % ", ".join(PLOT_MODES))
+        else:
+            self.plotmode = 'summary'
+        if 'PLOT_MAX_POINTS' in cfg.keys() and cfg['PLOT_MAX_POINTS'] is not None and \
+                len(str(cfg['PLOT_MAX_POINTS'])) > 0:
+            self.maxpoints = int(cfg['PLOT_MAX_POINTS'])
+        else:
+            self.maxpoints = 100000
 
 
     def generateID(self, f,usefilenames=True):
@@ -105,57 +345,217 @@ class AutoBatch:
             rtn = False
         return rtn
 
-    def generatePlots(self,df, pfilename):
-        if len(df)==1:
-            df.plot()
+    def generatePlots(self, batchout, colname, pfilename):
+        """
+        Plot column for all files to html - WebGL traces so large batches can be viewed
+        :param batchout: RaggedBatch
+        :param colname: column to plot
+        :param pfilename: html filename
+        :return: pfilename or None if column is not numeric
+        """
+        # plotly only loaded when plots are requested
+        from plotly import offline
+        from plotly.graph_objs import Layout, Scattergl
+        if batchout.values(colname).dtype.kind not in 'biuf':
+            logging.warning("Batch: cannot plot non-numeric column %s", colname)
+            return None
+        title = 'Batch plots: %s' % colname
+        if self.plotmode == 'raw':
+            (ids, values) = batchout.decimate(colname, self.maxpoints)
+            if len(ids) < len(batchout.values(colname)):
+                title += ' (%d of %d values)' % (len(ids), len(batchout.values(colname)))
+            data = [Scattergl(x=ids, y=values, name=colname, mode='markers', marker={'size': 3})]
         else:
-            xi = [str(x) for x in range(len(df) + 1)]
-            data = []
-            title = 'Batch plots'
-            for col in df.columns:
-                data.append(Scatter(y=df[col], x=xi,name=col,mode='markers'))
-
-            # Create plotly plot
-            offline.plot({"data": data,
-                          "layout": Layout(title=title,
-                                           xaxis={'title': self.colnames},
-                                           yaxis={'title': ''})},
-                         filename=pfilename)
+            stats = batchout.summary(colname)
+            ids = list(stats.index)
+            data = [Scattergl(x=ids, y=stats['median'].values, name='median', mode='markers',
+                              error_y={'type': 'data', 'symmetric': False,
+                                       'array': (stats['q3'] - stats['median']).values,
+                                       'arrayminus': (stats['median'] - stats['q1']).values}),
+                    Scattergl(x=ids, y=stats['min'].values, name='min', mode='markers', marker={'size': 3}),
+                    Scattergl(x=ids, y=stats['max'].values, name='max', mode='markers', marker={'size': 3})]
+
+        # Create plotly plot
+        offline.plot({"data": data,
+                      "layout": Layout(title=title,
+                                       xaxis={'title': 'id'},
+                                       yaxis={'title': colname})},
+                     filename=pfilename)
 
         return pfilename
 
 
+    def readFile(self, f):
+        """
+        Read batch columns from file - called in reader threads
+        :param f: csv or binary data file
+        :return: dataframe of batch columns or None if not all columns in file
+        """
+        checkCancelled()
+        try:
+            # Only read the batch columns
+            if f.endswith('.csv'):
+                df = pd.read_csv(f, usecols=self.colnames)
+            else:
+                df = read_binary(f, usecols=self.colnames)
+        except ValueError as e:
+            # columns not present in file
+            logging.warning("Batch: skipping %s - %s", f, e)
+            return None
+        if not self.validHeader(self.colnames, df):
+            logging.warning("Batch: skipping %s - missing columns", f)
+            return None
+        return df[self.colnames]
+
+    def getOutputfile(self, colname=None):
+        fparts = [self.base.split(sep)[-1], self.suffix]
+        if colname is not None:
+            fparts = [self.base.split(sep)[-1], colname, self.suffix]
+        if len(self.prefix) > 0:
+            fparts = [self.prefix] + fparts
+        return join(self.outputdir, "_".join(fparts))
+
+    def getOutputfiles(self):
+        """
+        Output files for format
+        :return: list of filenames
+        """
+        if self.format == 'npz':
+            return [splitext(self.getOutputfile())[0] + '.npz']
+        elif self.format == 'wide' and len(self.colnames) > 1:
+            return [self.getOutputfile(col) for col in self.colnames]
+        return [self.getOutputfile()]
+
+    def loadManifest(self):
+        """
+        Manifest and cached columns from last run - only used if columns are the same
+        :return: (manifest, RaggedBatch) where manifest files are by path with index in cache or ({}, None)
+        """
+        base = splitext(self.getOutputfile())[0]
+        manifestfile = base + '.manifest.json'
+        cachefile = base + '.cache.npz'
+        if not (exists(manifestfile) and exists(cachefile)):
+            return ({}, None)
+        try:
+            with open(manifestfile, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('columns') != self.colnames:
+                return ({}, None)
+            cached = RaggedBatch.load(cachefile)
+            # position of files in cache
+            index = dict([(fid, i) for i, fid in enumerate(cached.ids)])
+            manifest['files'] = dict([(e['path'], e) for e in manifest['files']])
+            for e in manifest['files'].values():
+                e['index'] = index.get(e['id'])
+            return (manifest, cached)
+        except Exception as e:
+            logging.warning("Batch: cannot load manifest %s - %s", manifestfile, e)
+            return ({}, None)
+
+    def saveManifest(self, batchout, entries):
+        """
+        Save columns of all files and manifest - to temp files then renamed so files are never partial
+        :param batchout: RaggedBatch
+        :param entries: list of manifest entries in order of batchout
+        """
+        base = splitext(self.getOutputfile())[0]
+        batchout.save(base + '.cache.npz')
+        with timed_write(base + '.manifest.json', len(entries)) as tmpfile:
+            with open(tmpfile, 'w') as f:
+                json.dump({'columns': self.colnames, 'format': self.format, 'files': entries}, f)
+
+    def loadData(self, files, fids, manifest, cached):
+        """
+        Batch columns of files - from cache if file is unchanged (path, id, size, mtime and column digest)
+        otherwise read in reader threads
+        :param files: data files
+        :param fids: ids of files
+        :param manifest: from loadManifest
+        :param cached: RaggedBatch from loadManifest
+        :return: (RaggedBatch, manifest entries for files in batch, number of files read)
+        """
+        previous = manifest.get('files', {})
+        entries = []
+        reuse = {}
+        toread = []
+        for fid, f in zip(fids, files):
+            st = stat(f)
+            entry = {'id': fid, 'path': abspath(f), 'size': st.st_size, 'mtime': st.st_mtime_ns}
+            last = previous.get(entry['path'])
+            if last is not None and last['index'] is not None and \
+                    [last['id'], last['size'], last['mtime']] == [fid, st.st_size, st.st_mtime_ns]:
+                columns = cached.columns(last['index'])
+                if columnDigest(columns) == last['digest']:
+                    entry['digest'] = last['digest']
+                    reuse[fid] = columns
+            if fid not in reuse:
+                toread.append(f)
+            entries.append(entry)
+        data = {}
+        # readers stop if the run is cancelled
+        with ThreadPoolExecutor(max_workers=self.readers, initializer=setThreadToken,
+                                initargs=(getToken(),)) as pool:
+            for f, df in zip(toread, pool.map(self.readFile, toread)):
+                data[abspath(f)] = df
+        batchout = RaggedBatch(self.colnames)
+        included = []
+        for entry in entries:
+            if entry['id'] in reuse:
+                batchout.append(entry['id'], dict(zip(self.colnames, reuse[entry['id']])))
+            elif data.get(entry['path']) is not None:
+                df = data[entry['path']]
+                batchout.append(entry['id'], df)
+                entry['digest'] = columnDigest([np.asarray(df[c]) for c in self.colnames])
+            else:
+                continue
+            included.append(entry)
+        logging.info("Batch: %d files read, %d from cache", len(toread), len(reuse))
+        return (batchout, included, len(toread))
+
     def run(self):
         """
-        Combine data from columns specified into batch output file
+        Combine data from columns specified into batch output file/s
         Include basic plot if showplots is flagged
-        :param colname:
-        :return: outputfilename
+        :return: outputfilename or list of outputfilenames for wide format with more than one column
+                 or None if no data
         """
-        df = None
-        if self.colnames is None:
+        if self.colnames is None or len(self.colnames) <= 0:
             raise ValueError('No columns specified for data extraction')
-        batchout = {}
-        for f in self.inputfiles:
-            bname = basename(f)
-            if bname.endswith('.csv'):
-                fid = self.generateID(bname)
-                df = pd.read_csv(f)
-                if self.validHeader(self.colnames, df):
-                    data = [x[0] for x in df[self.colnames].get_values()]
-                    batchout[fid] = data
-        if len(batchout) > 0:
-            df = pd.DataFrame.from_dict(batchout,orient='index').T.fillna('')
-            #save to file
-            fparts = [self.base.split(sep)[-1], self.suffix]
-            if len(self.prefix) > 0:
-                fparts = [self.prefix] + fparts
-            outputfilename = join(self.outputdir, "_".join(fparts))
-            df.to_csv(outputfilename,index=False)
-            if self.showplots:
-                plotfilename = outputfilename.replace('.csv','.html')
-                self.generatePlots(df,plotfilename)
-        return outputfilename
+        files = [f for f in self.inputfiles if splitext(basename(f))[1] in ['.csv'] + BINARY_FORMATS]
+        # ids in file order
+        fids = [self.generateID(basename(f)) for f in files]
+        (manifest, cached) = ({}, None)
+        if self.incremental:
+            (manifest, cached) = self.loadManifest()
+        (batchout, entries, nread) = self.loadData(files, fids, manifest, cached)
+        if len(batchout) <= 0:
+            logging.warning("Batch: no data for columns %s", ", ".join(self.colnames))
+            return None
+        outputfiles = self.getOutputfiles()
+        unchanged = nread == 0 and len(manifest.get('files', {})) == len(entries) and \
+            manifest.get('format') == self.format and all([exists(f) for f in outputfiles])
+        if unchanged:
+            logging.info("Batch: no changes - outputs are up to date")
+        elif self.format == 'long':
+            batchout.writeLong(outputfiles[0])
+        elif self.format == 'npz':
+            batchout.save(outputfiles[0])
+        else:
+            for col, outputfilename in zip(self.colnames, outputfiles):
+                batchout.writeWide(outputfilename, col)
+        if self.showplots:
+            for col in self.colnames:
+                if len(self.colnames) > 1:
+                    plotfilename = splitext(self.getOutputfile(col))[0] + '.html'
+                else:
+                    plotfilename = splitext(self.getOutputfile())[0] + '.html'
+                self.generatePlots(batchout, col, plotfilename)
+        # saved after outputs so an output is never older than the manifest
+        if self.incremental and not unchanged:
+            self.saveManifest(batchout, entries)
+        if len(outputfiles) == 1:
+            return outputfiles[0]
+        return outputfiles
 
 ################################################################################
 def create_parser():
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Data Cache class
+    1. Stores parsed data files in binary (pickle) format in CACHEDIR
+    2. Entries keyed by file path, size, modified time and load options (sheet, skiprows, headers, columns)
+    3. Total size capped at MAXSIZE (MB) - least recently used entries removed first. The total is counted as
+       entries are added and the directory is only scanned when it is over MAXSIZE, or after RESCAN of MAXSIZE
+       has been added since the last scan (entries added by other processes are found then)
+
+Created on 18 Oct 2026
+
+@author: QBI Software
+"""
+
+import hashlib
+import logging
+from os import listdir, makedirs, remove, replace, stat, utime, getpid
+from os.path import join, abspath, expanduser, getsize, exists
+
+# Default cache location and size (MB)
+CACHEDIR = join(expanduser("~"), ".autoanalysis", "cache")
+MAXSIZE = 1000
+# fraction of maxsize added before the cache directory is scanned again
+RESCAN = 0.1
+
+
+class DataCache():
+    def __init__(self, cachedir=None, maxsize=MAXSIZE):
+        """
+        Cache of parsed data files
+        :param cachedir: directory for cache files (created if needed)
+        :param maxsize: maximum total size of cache in MB
+        """
+        if cachedir is None or len(str(cachedir)) <= 0:
+            cachedir = CACHEDIR
+        if maxsize is None or len(str(maxsize)) <= 0:
+            maxsize = MAXSIZE
+        self.cachedir = cachedir
+        self.maxsize = float(maxsize) * 1e6
+        # total size of entries (None until first put) and bytes added since the directory was scanned
+        self.total = None
+        self.added = 0
+
+    def getKey(self, datafile, options):
+        """
+        Generate key from file path, size, mtime and load options
+        :param datafile: full path filename
+        :param options: dict of load options
+        :return: key as hex string or None if file not accessible
+        """
+        try:
+            st = stat(datafile)
+        except OSError:
+            return None
+        opts = ";".join(["%s=%s" % (k, str(options[k])) for k in sorted(options.keys())])
+        text = "%s|%d|%d|%s" % (abspath(datafile), st.st_size, st.st_mtime_ns, opts)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, datafile, options):
+        """
+        Get cached data for file
+        :param datafile: full path filename
+        :param options: dict of load options
+        :return: dataframe or None if not in cache
+        """
+        key = self.getKey(datafile, options)
+        if key is None:
+            return None
+        cachefile = join(self.cachedir, key + '.pkl')
+        if not exists(cachefile):
+            return None
+        try:
+            # pandas only needed when reading - engine imports this module without loading pandas
+            import pandas as pd
+            data = pd.read_pickle(cachefile)
+            # mark as recently used
+            utime(cachefile, None)
+            logging.debug("DataCache: loaded %s from cache", datafile)
+        except Exception as e:
+            logging.warning("DataCache: cannot read %s - %s", cachefile, e)
+            data = None
+        return data
+
+    def put(self, datafile, options, data):
+        """
+        Save parsed data for file to cache then remove old entries if over size
+        :param datafile: full path filename
+        :param options: dict of load options
+        :param data: dataframe
+        """
+        key = self.getKey(datafile, options)
+        if key is None or self.maxsize <= 0:
+            return
+        makedirs(self.cachedir, exist_ok=True)
+        cachefile = join(self.cachedir, key + '.pkl')
+        # write to temp file then rename so other processes never read partial files
+        tmpfile = "%s.%d.tmp" % (cachefile, getpid())
+        try:
+            previous = stat(cachefile).st_size
+        except OSError:
+            previous = 0
+        try:
+            data.to_pickle(tmpfile)
+            size = getsize(tmpfile)
+            replace(tmpfile, cachefile)
+        except Exception as e:
+            logging.warning("DataCache: cannot save %s - %s", cachefile, e)
+            if exists(tmpfile):
+                remove(tmpfile)
+            return
+        if self.total is None:
+            self.total = self.size()
+        else:
+            self.total += size - previous
+            self.added += size
+        if self.total > self.maxsize or self.added > self.maxsize * RESCAN:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until total size is within maxsize - scans the cache directory
+        """
+        entries = []
+        for f in listdir(self.cachedir):
+            if not f.endswith('.pkl'):
+                continue
+            try:
+                st = stat(join(self.cachedir, f))
+                entries.append((st.st_mtime, st.st_size, f))
+            except OSError:
+                continue
+        total = sum([e[1] for e in entries])
+        for (mtime, size, f) in sorted(entries):
+            if total <= self.maxsize:
+                break
+            try:
+                remove(join(self.cachedir, f))
+                total -= size
+            except OSError:
+                # removed by another process
+                continue
+        self.total = total
+        self.added = 0
+
+    def size(self):
+        """
+        Total size of cache files in bytes
+        """
+        if not exists(self.cachedir):
+            return 0
+        return sum([getsize(join(self.cachedir, f)) for f in listdir(self.cachedir) if f.endswith('.pkl')])
+
+    def clear(self):
+        """
+        Remove all cache files
+        """
+        if exists(self.cachedir):
+            for f in listdir(self.cachedir):
+                if f.endswith('.pkl'):
+                    remove(join(self.cachedir, f))
+        self.total = 0
+        self.added = 0
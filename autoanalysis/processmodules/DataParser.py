@@ -2,6 +2,20 @@
 """
 Auto Data class
     1. Read INPUTFILE as CSV or Excel (sheet, skiprows, headers)
+    2. Data is loaded once, on first access to data
+    3. Only columns required by the module are read (usecols, dtype) - set from module configurables
+    4. Large CSV files can be streamed in fixed-size row chunks. Column types are inferred from the first chunk
+       (and declared dtype) - an integer column with a missing value or text in a later chunk is promoted for
+       that chunk only, so output can differ from the whole-file load (eg 3 instead of 3.0). Setting scantypes
+       (config CHUNK_SCAN_TYPES) finds the types of the whole file first - exact but parses the file twice.
+    5. Intermediate outputs between processes can be saved and read in binary columnar formats
+       (.npz column bundle or .feather if pyarrow is installed) with no text parsing
+    6. Parsed data can be kept in a DataCache so repeat runs skip parsing (text and Excel files only)
+    7. Outputs are written to a temp file which is renamed when complete so a crash never leaves
+       a half written output
+    8. Data can be loaded ahead of the run (prefetch) and outputs queued to a writer thread (writer) so
+       reading, processing and writing of consecutive files overlap
+    9. Loading and writing are timed as load and write stages of the file being run (instrument)
 
 Created on 7 Feb 2018
 
@@ -9,8 +23,124 @@ Created on 7 Feb 2018
 """
 
 import logging
+import threading
+import numpy as np
 import pandas as pd
-from os.path import join, basename, splitext
+from collections import OrderedDict
+from contextlib import contextmanager
+from os import getpid, remove, replace
+from os.path import join, basename, splitext, dirname, exists, getsize
+from autoanalysis.cancel import checkCancelled
+from autoanalysis.instrument import stage, annotate, bind
+
+# Binary columnar formats for intermediate files
+BINARY_FORMATS = ['.npz', '.feather']
+
+
+def read_binary(datafile, usecols=None, dtype=None):
+    """
+    Read binary columnar file into dataframe
+    :param datafile: .npz column bundle (from save_data) or .feather file
+    :param usecols: list of columns to read or None for all
+    :param dtype: dict of column types
+    :return: dataframe
+    """
+    if datafile.endswith('.feather'):
+        data = pd.read_feather(datafile, columns=usecols)
+    else:
+        # Each column is stored as its own array so only requested columns are read
+        with np.load(datafile, allow_pickle=True) as bundle:
+            columns = [str(c) for c in bundle['__columns__']]
+            if usecols is None:
+                usecols = columns
+            missing = [c for c in usecols if c not in columns]
+            if len(missing) > 0:
+                raise ValueError("Columns not in datafile: %s" % ", ".join(missing))
+            data = pd.DataFrame(OrderedDict([(c, bundle['c%d' % columns.index(c)]) for c in usecols]))
+    if dtype is not None:
+        data = data.astype(dtype)
+    return data
+
+
+def common_dtype(a, b):
+    """
+    Type of a column read as a whole when parts were read as a and b - numbers are promoted
+    (integer with float or missing values becomes float) otherwise mixed types become object
+    :param a: numpy dtype
+    :param b: numpy dtype
+    :return: numpy dtype
+    """
+    if a == b:
+        return a
+    if a.kind in 'iuf' and b.kind in 'iuf':
+        return np.promote_types(a, b)
+    return np.dtype(object)
+
+
+@contextmanager
+def atomic_write(outputfile):
+    """
+    Write output to a temp file in the same directory which replaces outputfile when the block completes
+    (if the temp file was written) - the temp file is removed if the block fails or is cancelled
+    :param outputfile: full path filename
+    :return: temp filename to write to
+    """
+    tmpfile = join(dirname(outputfile), ".%s.%d.%d.tmp" % (basename(outputfile), getpid(), threading.get_ident()))
+    try:
+        yield tmpfile
+        if exists(tmpfile):
+            replace(tmpfile, outputfile)
+    finally:
+        if exists(tmpfile):
+            remove(tmpfile)
+
+
+@contextmanager
+def timed_write(outputfile, rows=None):
+    """
+    Write output via temp file (atomic_write) timed as write stage of the file being run
+    :param outputfile: full path filename
+    :param rows: number of rows written or None
+    :return: temp filename to write to
+    """
+    with stage('write', outputfile) as event:
+        with atomic_write(outputfile) as tmpfile:
+            yield tmpfile
+        event.update(rows_in=rows, bytes_out=getsize(outputfile) if exists(outputfile) else 0)
+
+
+def write_csv(data, outputfile, **kwargs):
+    """
+    Write dataframe to csv via temp file
+    :param kwargs: arguments for to_csv
+    :return: outputfile
+    """
+    with timed_write(outputfile, len(data)) as tmpfile:
+        data.to_csv(tmpfile, **kwargs)
+    return outputfile
+
+
+def save_data(data, outputfile, columns=None):
+    """
+    Save dataframe - format from extension of outputfile: .npz or .feather binary otherwise csv
+    :param data: dataframe
+    :param outputfile: full path filename
+    :param columns: list of columns to save or None for all
+    :return: outputfile
+    """
+    if columns is not None:
+        data = data[columns]
+    with timed_write(outputfile, len(data)) as tmpfile:
+        if outputfile.endswith('.npz'):
+            arrays = {'c%d' % i: np.asarray(data[c]) for i, c in enumerate(data.columns)}
+            arrays['__columns__'] = np.array([str(c) for c in data.columns])
+            with open(tmpfile, 'wb') as f:
+                np.savez(f, **arrays)
+        elif outputfile.endswith('.feather'):
+            data.reset_index(drop=True).to_feather(tmpfile)
+        else:
+            data.to_csv(tmpfile, index=False)
+    return outputfile
 
 
 class AutoData():
@@ -20,38 +150,181 @@ class AutoData():
         self.headers = headers
         self.sheet = sheet
         self.skiprows = skiprows
-        # Load data
-        self.data = self.load_data()
+        # Columns to read (None for all) and known column types - set by module from configurables
+        self.usecols = None
+        self.dtype = None
+        # Optional DataCache of parsed files
+        self.cache = None
+        # Data is loaded on first access
+        self._data = None
+        # Rows per chunk if the module streams csv data (0 to load whole file)
+        self.chunksize = 0
+        # Parse whole file for column types before streaming chunks (exact types but twice the parse time)
+        self.scantypes = False
+        # Optional AsyncWriter for outputs and futures of queued writes
+        self.writer = None
+        self.writes = []
 
+    @property
+    def data(self):
+        """
+        Loaded data - read from datafile the first time it is accessed
+        :return: dataframe
+        """
+        if self._data is None:
+            self._data = self.load_data()
+        return self._data
 
+    @data.setter
+    def data(self, data):
+        self._data = data
 
     def load_data(self):
         """
-        Load data into pandas DataFrame
-        :param datafile: Input data as csv or excel
+        Load data into pandas DataFrame - timed as load stage
+        :return: dataframe
+        """
+        with stage('load', self.datafile) as event:
+            data = self.parse_data()
+            event['rows_out'] = len(data)
+        return data
+
+    def parse_data(self):
+        """
+        Read data into pandas DataFrame - only columns in usecols if set
+        :param datafile: Input data as csv, excel or binary (npz, feather)
         :return: dataframe
         """
         data = pd.DataFrame()
+        # binary files load as fast as the cache
+        cache = self.cache if self.extension not in BINARY_FORMATS else None
+        if cache is not None:
+            options = self.getLoadOptions()
+            cached = cache.get(self.datafile, options)
+            if cached is not None:
+                annotate(detail="%s (cache)" % self.datafile)
+                return cached
         try:
             if '.xls' in self.extension:
                 if self.headers is None:
                     data = pd.read_excel(self.datafile, skiprows=self.skiprows, sheet_name=self.sheet,skip_blank_lines=True)
                 else:
                     data = pd.read_excel(self.datafile, skiprows=self.skiprows, sheet_name=self.sheet,skip_blank_lines=True, header=self.headers)
+                # Excel reader only projects by column position so select by name after load
+                if self.usecols is not None:
+                    data = data[self.usecols]
+                if self.dtype is not None:
+                    data = data.astype(self.dtype)
             elif self.extension == '.csv':
-                data = pd.read_csv(self.datafile, skip_blank_lines=True)
+                data = pd.read_csv(self.datafile, skip_blank_lines=True, usecols=self.usecols, dtype=self.dtype)
+            elif self.extension in BINARY_FORMATS:
+                data = read_binary(self.datafile, usecols=self.usecols, dtype=self.dtype)
+            annotate(bytes_in=getsize(self.datafile))
             # Check loaded
             if data.empty:
                 raise ValueError("Data not loaded - check datafile")
             else:
                 msg = "... load complete"
                 self.logandprint(msg)
+                if cache is not None:
+                    cache.put(self.datafile, options, data)
         except Exception as e:
             print(e)
             logging.error(e)
         return data
 
 
+    def prefetch(self):
+        """
+        Load data before run - streamed files (CHUNKSIZE) are not loaded as they may not fit in memory
+        """
+        if self.chunksize > 0 and self.extension == '.csv':
+            return
+        self.data
+
+    def write(self, func, *args, **kwargs):
+        """
+        Write output with func eg save_data - queued to writer if set otherwise written now
+        :return: Future if queued otherwise result of func
+        """
+        if self.writer is None:
+            return func(*args, **kwargs)
+        # timed with the file being run
+        future = self.writer.submit(bind(func), *args, **kwargs)
+        self.writes.append(future)
+        return future
+
+    def getLoadOptions(self):
+        """
+        Options which change parsed data - used with file path, size and mtime for cache key
+        :return: dict
+        """
+        return {'sheet': self.sheet, 'skiprows': self.skiprows, 'headers': self.headers,
+                'usecols': self.usecols, 'dtype': self.dtype}
+
+    def chunk_dtypes(self, chunksize):
+        """
+        Column types of the whole CSV file - inferred for each chunk and combined (common_dtype) so eg an
+        integer column with a missing value in any chunk is float in all chunks
+        :param chunksize: number of rows per chunk
+        :return: dict of column: dtype
+        """
+        dtypes = OrderedDict()
+        for chunk in pd.read_csv(self.datafile, skip_blank_lines=True, usecols=self.usecols, dtype=self.dtype,
+                                 chunksize=int(chunksize)):
+            checkCancelled()
+            for (c, t) in chunk.dtypes.items():
+                dtypes[c] = t if c not in dtypes else common_dtype(dtypes[c], t)
+        return dtypes
+
+    def sample_dtypes(self, chunksize):
+        """
+        Column types from the first chunk - float and text columns are fixed for all chunks, integer columns are
+        left to be inferred for each chunk as a later chunk may have missing values or text
+        :param chunksize: number of rows per chunk
+        :return: dict of column: dtype
+        """
+        sample = pd.read_csv(self.datafile, skip_blank_lines=True, usecols=self.usecols, dtype=self.dtype,
+                             nrows=int(chunksize))
+        dtypes = OrderedDict()
+        for (c, t) in sample.dtypes.items():
+            if t.kind in 'fO':
+                dtypes[c] = t
+        if self.dtype is not None:
+            dtypes.update(self.dtype)
+        return dtypes
+
+    def load_chunks(self, chunksize):
+        """
+        Stream data in chunks of rows without loading whole file - CSV only, other formats are yielded as one chunk.
+        Column types are found from the first chunk (sample_dtypes) or, if scantypes is set, from the whole
+        file (chunk_dtypes) so output matches the whole-file load.
+        :param chunksize: number of rows per chunk
+        :return: generator of dataframes
+        """
+        if self.extension != '.csv':
+            yield self.data
+            return
+        if self.scantypes:
+            dtype = self.chunk_dtypes(chunksize)
+        else:
+            dtype = self.sample_dtypes(chunksize)
+        first = None
+        promoted = set()
+        for chunk in pd.read_csv(self.datafile, skip_blank_lines=True, usecols=self.usecols, dtype=dtype,
+                                 chunksize=int(chunksize)):
+            checkCancelled()
+            if first is None:
+                first = chunk.dtypes
+            else:
+                changed = [c for (c, t) in chunk.dtypes.items() if t != first[c] and c not in promoted]
+                if len(changed) > 0:
+                    promoted.update(changed)
+                    logging.warning("Columns %s of %s change type in a later chunk - set CHUNK_SCAN_TYPES for "
+                                    "the same types as whole file", ', '.join([str(c) for c in changed]),
+                                    basename(self.datafile))
+            yield chunk
+
     def logandprint(self, msg, info=True):
         """
         Utility method to enable both logging and printing - can update for Python2 or 3
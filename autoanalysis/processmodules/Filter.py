@@ -5,6 +5,10 @@ Auto Filter class
     2. Select COLUMN
     3. Filter on MIN, MAX limits
     4. Output to OUTPUTDIR
+    Large CSV files can be filtered in row chunks (CHUNKSIZE) so memory is bounded by chunk not file size
+    - CHUNK_SCAN_TYPES reads the file twice to keep column types (eg 3.0 not 3) identical to the whole-file output
+    Output can be binary (FILTERED_FILENAME ending .npz or .feather) for fast reading by later processes
+    with an optional CSV copy (EXPORT_CSV)
 
 
 Created on 7 Feb 2018
@@ -14,11 +18,11 @@ Created on 7 Feb 2018
 
 import argparse
 import logging
-from os.path import join, basename, splitext
+from os.path import join, basename, splitext, getsize, exists
 from collections import OrderedDict
 import pandas as pd
-from autoanalysis.db.dbquery import DBI
-from autoanalysis.processmodules.DataParser import AutoData
+from autoanalysis.processmodules.DataParser import AutoData, BINARY_FORMATS, save_data, atomic_write, write_csv
+from autoanalysis.instrument import annotate
 
 
 
@@ -29,14 +33,14 @@ class AutoFilter(AutoData):
 
     def __init__(self, datafile,outputdir, sheet=0, skiprows=0, headers=None, showplots=False):
         super().__init__(datafile, sheet, skiprows, headers)
-        # Load data
         self.outputdir = outputdir
-        msg = "Filter: Loading data from %s" % self.datafile
-        self.data = self.load_data()
-        self.logandprint(msg)
         self.suffix = 'FILTERED.csv'
+        # whole file unless CHUNKSIZE is configured
+        self.chunksize = 0
+        self.exportcsv = False
 
-    def getConfigurables(self):
+    @classmethod
+    def getConfigurables(cls):
         '''
         List of configurable parameters in order with defaults
         :return:
@@ -47,6 +51,9 @@ class AutoFilter(AutoData):
         cfg['MINRANGE']=0.0
         cfg['MAXRANGE']=100.0
         cfg['FILTERED_FILENAME'] = 'FILTERED.csv'
+        cfg['CHUNKSIZE'] = 0
+        cfg['CHUNK_SCAN_TYPES'] = False
+        cfg['EXPORT_CSV'] = False
         return cfg
 
     def setConfigurables(self,cfg):
@@ -55,7 +62,8 @@ class AutoFilter(AutoData):
         else:
             self.column =''
         if 'OUTPUTALLCOLUMNS' in cfg.keys() and cfg['OUTPUTALLCOLUMNS'] is not None:
-            self.outputallcolumns = cfg['OUTPUTALLCOLUMNS']
+            # config db stores as text eg '0' or '1'
+            self.outputallcolumns = str(cfg['OUTPUTALLCOLUMNS']).lower() in ['1', 'true', 'yes']
         else:
             self.outputallcolumns = True
         if 'MINRANGE' in cfg.keys() and cfg['MINRANGE'] is not None:
@@ -70,35 +78,133 @@ class AutoFilter(AutoData):
             self.suffix = cfg['FILTERED_FILENAME']
             if self.suffix.startswith('*'):
                 self.suffix = self.suffix[1:]
+        if 'CHUNKSIZE' in cfg.keys() and cfg['CHUNKSIZE'] is not None and len(str(cfg['CHUNKSIZE'])) > 0:
+            self.chunksize = int(cfg['CHUNKSIZE'])
+        else:
+            self.chunksize = 0
+        if 'CHUNK_SCAN_TYPES' in cfg.keys() and cfg['CHUNK_SCAN_TYPES'] is not None:
+            self.scantypes = str(cfg['CHUNK_SCAN_TYPES']).lower() in ['1', 'true', 'yes']
+        else:
+            self.scantypes = False
+        if 'EXPORT_CSV' in cfg.keys() and cfg['EXPORT_CSV'] is not None:
+            self.exportcsv = str(cfg['EXPORT_CSV']).lower() in ['1', 'true', 'yes']
+        else:
+            self.exportcsv = False
+        # Only read the filtered column unless all columns are output (types inferred to keep output unchanged)
+        if self.outputallcolumns:
+            self.usecols = None
+        else:
+            self.usecols = [self.column]
 
 
+    def filter(self, data):
+        """
+        Select rows with column values between min and max limits (exclusive)
+        :param data: dataframe
+        :return: filtered dataframe
+        """
+        minfilter = data[self.column] > self.minlimit
+        maxfilter = data[self.column] < self.maxlimit
+        mmfilter = minfilter & maxfilter
+        return data[mmfilter]
+
+    def save(self, filtered, fdata, mode='w', header=True):
+        """
+        Write filtered data to csv or binary format (from extension of fdata)
+        :param filtered: filtered dataframe
+        :param fdata: output filename
+        :param mode: 'w' for new file (queued to writer if set) or 'a' to append chunk (csv only)
+        :param header: include column names (csv only)
+        """
+        if self.outputallcolumns:
+            columns = None
+        else:
+            columns = [self.column]
+        if splitext(fdata)[1] in BINARY_FORMATS:
+            self.write(save_data, filtered, fdata, columns=columns)
+        elif mode == 'w':
+            self.write(write_csv, filtered, fdata, columns=columns, index=False, header=header)  # with or without original index numbers
+        else:
+            filtered.to_csv(fdata, columns=columns, index=False, mode=mode, header=header)
+
+    def export(self, filtered, fdata):
+        """
+        Optional CSV copy of binary output
+        :param filtered: filtered dataframe
+        :param fdata: binary output filename
+        """
+        if self.exportcsv and splitext(fdata)[1] in BINARY_FORMATS:
+            fcsv = splitext(fdata)[0] + '.csv'
+            self.save(filtered, fcsv)
+            msg = "Filtered Data exported: %s" % fcsv
+            self.logandprint(msg)
+
     def run(self):
         """
         Run filter over datasets and save to file
-        :return:
+        :return: output filename
         """
+        msg = "Filter: Loading data from %s" % self.datafile
+        self.logandprint(msg)
+        # Save files
+        fdata = join(self.outputdir, self.bname + "_"+self.suffix)
+        if self.chunksize > 0 and self.extension == '.csv':
+            return self.run_chunks(fdata)
         if not self.data.empty:
             pre_data = len(self.data)
-            minfilter = self.data[self.column] > self.minlimit
-            maxfilter = self.data[self.column] < self.maxlimit
-            mmfilter = minfilter & maxfilter
-            filtered = self.data[mmfilter]
+            filtered = self.filter(self.data)
+            annotate(rows_in=pre_data, rows_out=len(filtered))
             msg = "Rows after filtering %s values between %d and %d: \t%d of %d\n" % (
             self.column, self.minlimit, self.maxlimit, len(filtered), pre_data)
             self.logandprint(msg)
 
-            # Save files
-            fdata = join(self.outputdir, self.bname + "_"+self.suffix)
-
             try:
-                if self.outputallcolumns:
-                    filtered.to_csv(fdata, index=False)
-                else:
-                    filtered.to_csv(fdata, columns=[self.column], index=False)  # with or without original index numbers
+                self.save(filtered, fdata)
                 msg = "Filtered Data saved: %s" % fdata
                 self.logandprint(msg)
+                self.export(filtered, fdata)
             except IOError as e:
                 raise e
+            return fdata
+
+    def run_chunks(self, fdata):
+        """
+        Streaming filter - read CHUNKSIZE rows at a time and append filtered rows to output
+        CSV chunks are appended to a temp file which replaces the output when all chunks are done so there is
+        no partial output if the run is cancelled or fails
+        :param fdata: output filename
+        :return: output filename
+        """
+        pre_data = 0
+        post_data = 0
+        # binary formats cannot be appended so filtered chunks are kept to save at end
+        binary = splitext(fdata)[1] in BINARY_FORMATS
+        chunks = []
+        with atomic_write(fdata) as tmpfile:
+            for chunk in self.load_chunks(self.chunksize):
+                filtered = self.filter(chunk)
+                if binary:
+                    chunks.append(filtered)
+                else:
+                    self.save(filtered, tmpfile, mode='a', header=(pre_data == 0))
+                pre_data += len(chunk)
+                post_data += len(filtered)
+        # chunks are read and csv chunks written in the run stage
+        annotate(rows_in=pre_data, rows_out=post_data, bytes_in=getsize(self.datafile))
+        if not binary and exists(fdata):
+            annotate(bytes_out=getsize(fdata))
+        if binary and len(chunks) > 0:
+            filtered = pd.concat(chunks)
+            self.save(filtered, fdata)
+            self.export(filtered, fdata)
+        if pre_data == 0:
+            return None
+        msg = "Rows after filtering %s values between %d and %d: \t%d of %d\n" % (
+            self.column, self.minlimit, self.maxlimit, post_data, pre_data)
+        self.logandprint(msg)
+        msg = "Filtered Data saved: %s" % fdata
+        self.logandprint(msg)
+        return fdata
 
 
 ####################################################################################################################
@@ -4,7 +4,15 @@ Auto Histogram class
     1. Read INPUTFILE as CSV or Excel (sheet, skiprows, headers)
     2. Select COLUMN
     3. Generate Relative Frequency Histogram data and plot/s
+        - bins of BINWIDTH from HISTOGRAM_MIN to HISTOGRAM_MAX (data range if not set)
+        - HISTOGRAM_FREQ_TYPE: 0=relative freq, 1=density, 2=cumulative
     4. Output to OUTPUTDIR
+Auto Group Histogram class
+    1. Read list of files for a group (eg all Filtered files in Control) in chunks of CHUNKSIZE rows
+    2. Add counts from each file to histogram with bins for all files (HISTOGRAM_MIN/MAX or range of all files)
+    3. Output pooled histogram to OUTPUTDIR as prefix_base_GROUP_HISTOGRAM_FILENAME
+    4. Output histograms of all files as a files x bins matrix with file ids as rows
+        to prefix_base_ALLSTATS_FILENAME (csv) and same name as .npz (counts, edges, ids)
 
 Created on 7 Feb 2018
 
@@ -12,7 +20,8 @@ Created on 7 Feb 2018
 """
 
 import argparse
-from os.path import join
+import logging
+from os.path import join, commonpath, sep, basename, splitext
 
 # #maintain this order of matplotlib
 # import matplotlib
@@ -22,7 +31,152 @@ import numpy as np
 import pandas as pd
 from collections import OrderedDict
 
-from autoanalysis.processmodules.DataParser import AutoData
+from autoanalysis.cancel import checkCancelled
+from autoanalysis.processmodules.DataParser import AutoData, timed_write, write_csv
+from autoanalysis.instrument import annotate
+
+# Histogram types (HISTOGRAM_FREQ_TYPE) and output filename labels
+FREQ_TYPES = {0: '', 1: 'DENSITY_', 2: 'CUMULATIVE_'}
+
+
+def binEdges(minv, maxv, binwidth):
+    """
+    Bin edges of binwidth covering minv to maxv - first edge is a multiple of binwidth so bins are the same
+    for all files. Edges are calculated from the first edge (not summed) so there is no float drift.
+    :param minv: minimum value
+    :param maxv: maximum value
+    :param binwidth: width of bins (float)
+    :return: numpy array of edges
+    """
+    binwidth = float(binwidth)
+    if binwidth <= 0:
+        raise ValueError("Histogram: BINWIDTH must be greater than 0")
+    if maxv < minv:
+        raise ValueError("Histogram: range %s to %s is not valid" % (str(minv), str(maxv)))
+    start = np.floor(minv / binwidth) * binwidth
+    n_bins = max(1, int(np.ceil((maxv - start) / binwidth)))
+    # rounded so labels are not eg -2.2000000000000002
+    edges = np.round(start + np.arange(n_bins + 1) * binwidth, 12)
+    if edges[-1] < maxv:
+        edges = np.append(edges, np.round(start + (n_bins + 1) * binwidth, 12))
+    return edges
+
+
+def binCounts(xdata, edges):
+    """
+    Counts of values in each bin - same as numpy histogram (last bin includes right edge) but for equal width
+    bins the bin is calculated directly. Values outside edges and NaN are not counted.
+    :param xdata: array of values
+    :param edges: equal width bin edges from binEdges
+    :return: numpy array of counts (int64)
+    """
+    n_bins = len(edges) - 1
+    x = np.asarray(xdata, dtype=np.float64)
+    x = x[(x >= edges[0]) & (x <= edges[-1])]
+    binwidth = (edges[-1] - edges[0]) / n_bins
+    idx = np.floor((x - edges[0]) / binwidth).astype(np.int64)
+    np.clip(idx, 0, n_bins - 1, out=idx)
+    # correct rounding for values on edges
+    idx -= (x < edges[idx])
+    idx += (x >= edges[idx + 1]) & (idx < n_bins - 1)
+    return np.bincount(idx, minlength=n_bins).astype(np.int64)
+
+
+def frequencies(counts, binwidth, freq=0):
+    """
+    Histogram values from counts
+    :param counts: array of counts per bin or matrix of counts with a row per histogram
+    :param binwidth: width of bins
+    :param freq: 0=relative freq, 1=density, 2=cumulative
+    :return: numpy array (zeros for histograms with no counts)
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum(axis=-1, keepdims=True)
+    total[total <= 0] = np.inf
+    if freq == 1:
+        return counts / (total * float(binwidth))
+    elif freq == 2:
+        return np.cumsum(counts, axis=-1) / total
+    return counts / total
+
+
+def histogramConfig(cfg):
+    """
+    Histogram settings shared by file and group histograms
+    :param cfg: configurables
+    :return: (column, binwidth, freq, range) - range is [min, max] with None for data range
+    """
+    if 'COLUMN' in cfg.keys() and cfg['COLUMN'] is not None:
+        column = cfg['COLUMN']
+    else:
+        column = ''
+    if 'BINWIDTH' in cfg.keys() and cfg['BINWIDTH'] is not None:
+        binwidth = cfg['BINWIDTH']
+    else:
+        binwidth = 1
+    if 'HISTOGRAM_FREQ_TYPE' in cfg.keys() and cfg['HISTOGRAM_FREQ_TYPE'] is not None:
+        freq = int(cfg['HISTOGRAM_FREQ_TYPE'])
+    else:
+        freq = 0
+    # Fixed range if set otherwise range of data
+    hrange = []
+    for c in ['HISTOGRAM_MIN', 'HISTOGRAM_MAX']:
+        if c in cfg.keys() and cfg[c] is not None and len(str(cfg[c])) > 0:
+            hrange.append(float(cfg[c]))
+        else:
+            hrange.append(None)
+    return (column, binwidth, freq, hrange)
+
+
+class HistogramAccumulator():
+    def __init__(self, edges):
+        """
+        Histogram counts for fixed bin edges - updated with data in chunks and merged with other accumulators
+        (files, worker processes, groups) by adding counts. Memory is for bins only.
+        :param edges: equal width bin edges from binEdges
+        """
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+
+    @property
+    def binwidth(self):
+        return (self.edges[-1] - self.edges[0]) / len(self.counts)
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def update(self, xdata):
+        """
+        Add counts for values
+        :param xdata: array of values
+        :return: self
+        """
+        self.counts += binCounts(xdata, self.edges)
+        return self
+
+    def merge(self, other):
+        """
+        Add counts from another accumulator with the same bins
+        :param other: HistogramAccumulator
+        :return: self
+        """
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Histogram: cannot merge histograms with different bins")
+        self.counts += other.counts
+        return self
+
+    def __add__(self, other):
+        acc = HistogramAccumulator(self.edges)
+        acc.counts = self.counts.copy()
+        return acc.merge(other)
+
+    def frequencies(self, freq=0):
+        """
+        :param freq: 0=relative freq, 1=density, 2=cumulative
+        :return: numpy array
+        """
+        return frequencies(self.counts, self.binwidth, freq)
 
 
 class AutoHistogram(AutoData):
@@ -30,12 +184,11 @@ class AutoHistogram(AutoData):
         super().__init__(datafile, sheet, skiprows, headers)
         self.showplots = showplots
         self.outputdir = outputdir
-        # Load data
-        self.data = self.load_data()
         self.fig = None
 
 
-    def getConfigurables(self):
+    @classmethod
+    def getConfigurables(cls):
         '''
         List of configurable parameters in order with defaults
         :return:
@@ -45,29 +198,39 @@ class AutoHistogram(AutoData):
         cfg['BINWIDTH']=1
         cfg['HISTOGRAM_FILENAME'] = 'HISTOGRAM.csv'
         cfg['HISTOGRAM_FREQ_TYPE'] = 0
+        cfg['HISTOGRAM_MIN'] = ''
+        cfg['HISTOGRAM_MAX'] = ''
         return cfg
 
     def setConfigurables(self,cfg):
-        if 'COLUMN' in cfg.keys() and cfg['COLUMN'] is not None:
-            self.column = cfg['COLUMN']
-        else:
-            self.column =''
-        if 'BINWIDTH' in cfg.keys() and cfg['BINWIDTH'] is not None:
-            self.binwidth = cfg['BINWIDTH']
-        else:
-            self.binwidth = 1
+        (self.column, self.binwidth, self.freq, self.range) = histogramConfig(cfg)
         if 'HISTOGRAM_FILENAME' in cfg.keys() and cfg['HISTOGRAM_FILENAME'] is not None:
             self.suffix = cfg['HISTOGRAM_FILENAME']
             if self.suffix.startswith("*"):
                 self.suffix=self.suffix[1:]
         else:
             self.suffix = 'HISTOGRAM.csv'
+        # Only the histogram column is read
+        self.usecols = [self.column]
+        self.dtype = {self.column: np.float64}
 
-        if 'HISTOGRAM_FREQ_TYPE' in cfg.keys() and cfg['HISTOGRAM_FREQ_TYPE'] is not None:
-            self.freq = int(cfg['HISTOGRAM_FREQ_TYPE'])
-        else:
-            self.freq = 0
 
+    def getEdges(self, xdata):
+        """
+        Bin edges for data from fixed range or range of data
+        :param xdata: array of values
+        :return: numpy array of edges or None if no values
+        """
+        (minv, maxv) = self.range
+        if minv is None or maxv is None:
+            finite = xdata[np.isfinite(xdata)]
+            if len(finite) <= 0:
+                return None
+            if minv is None:
+                minv = finite.min()
+            if maxv is None:
+                maxv = finite.max()
+        return binEdges(minv, maxv, self.binwidth)
 
     def run(self):
         """
@@ -76,37 +239,201 @@ class AutoHistogram(AutoData):
         :param freq: 0=relative freq, 1=density, 2=cumulative
         :return:
         """
-
-        n_bins = 10
+        if self.freq not in FREQ_TYPES:
+            raise ValueError("Histogram: HISTOGRAM_FREQ_TYPE must be one of %s" % str(sorted(FREQ_TYPES.keys())))
         # Data column
-        xdata = self.data[self.column]  # Series
-        minv = int(min(xdata)/100) * n_bins
-        maxv = int(np.ceil(max(xdata) / n_bins)) * n_bins
-
-        bins = [x for x in range(minv,maxv,n_bins)]
-        if self.freq == 1:
-            hist_title = self.bname + "_DENSITY_" + self.suffix
-            n, bin_edges = np.histogram(xdata, bins=bins,density=True)
-            if self.showplots:
-                xdata.plot.density()
-        else:
-            n, bin_edges = np.histogram(xdata, bins=bins,density=False)
-            hist_title = self.bname + "_" + self.suffix
-            if self.showplots:
-                xdata.plot.hist()
-        # histogram data
+        xdata = self.data[self.column].values.astype(np.float64)
+        edges = self.getEdges(xdata)
         histdata = pd.DataFrame()
-        histdata['bins']=bin_edges[0:-1]
-        histdata[self.column]= n
+        if edges is None:
+            histdata['bins'] = []
+            histdata[self.column] = []
+        else:
+            counts = binCounts(xdata, edges)
+            histdata['bins'] = edges[0:-1]
+            histdata[self.column] = frequencies(counts, self.binwidth, self.freq)
+        annotate(rows_in=len(xdata), rows_out=len(histdata))
+        hist_title = self.bname + "_" + FREQ_TYPES[self.freq] + self.suffix
+        if self.showplots:
+            if self.freq == 1:
+                self.data[self.column].plot.density()
+            else:
+                self.data[self.column].plot.hist(bins=edges, cumulative=(self.freq == 2))
 
         # filenames
         outputfile = join(self.outputdir, hist_title)
         # outputplot = outputfile.replace(".csv",".html")
-        histdata.to_csv(outputfile, index=False)
+        self.write(write_csv, histdata, outputfile, index=False)
         print("Saved histogram data to ", outputfile)
         return outputfile
 
 
+class AutoGroupHistogram():
+    def __init__(self, inputfiles, outputdir, showplots=False):
+        """
+        Pooled histogram for a list of files
+        :param inputfiles: data files - already filtered
+        :param outputdir: output directory
+        :param showplots: not used
+        """
+        self.inputfiles = inputfiles
+        self.base = commonpath(inputfiles)
+        if len(outputdir) <= 0:
+            self.outputdir = self.base
+        else:
+            self.outputdir = outputdir
+        self.showplots = showplots
+        self.prefix = ''
+
+    @classmethod
+    def getConfigurables(cls):
+        '''
+        List of configurable parameters in order with defaults
+        :return:
+        '''
+        cfg = AutoHistogram.getConfigurables()
+        del cfg['HISTOGRAM_FILENAME']
+        cfg['GROUP_HISTOGRAM_FILENAME'] = 'GROUP_HISTOGRAM.csv'
+        cfg['ALLSTATS_FILENAME'] = 'ALLHISTOGRAM.csv'
+        cfg['CHUNKSIZE'] = 0
+        return cfg
+
+    def setConfigurables(self, cfg):
+        (self.column, self.binwidth, self.freq, self.range) = histogramConfig(cfg)
+        if 'GROUP_HISTOGRAM_FILENAME' in cfg.keys() and cfg['GROUP_HISTOGRAM_FILENAME'] is not None:
+            self.suffix = cfg['GROUP_HISTOGRAM_FILENAME']
+            if self.suffix.startswith("*"):
+                self.suffix = self.suffix[1:]
+        else:
+            self.suffix = 'GROUP_HISTOGRAM.csv'
+        if 'ALLSTATS_FILENAME' in cfg.keys() and cfg['ALLSTATS_FILENAME'] is not None:
+            self.allsuffix = cfg['ALLSTATS_FILENAME']
+            if self.allsuffix.startswith("*"):
+                self.allsuffix = self.allsuffix[1:]
+        else:
+            self.allsuffix = 'ALLHISTOGRAM.csv'
+        if 'CHUNKSIZE' in cfg.keys() and cfg['CHUNKSIZE'] is not None and len(str(cfg['CHUNKSIZE'])) > 0:
+            self.chunksize = int(cfg['CHUNKSIZE'])
+        else:
+            self.chunksize = 0
+
+    def loadChunks(self, datafile):
+        """
+        Histogram column from file - in chunks of rows if CHUNKSIZE is set
+        :param datafile: csv or binary file
+        :return: generator of numpy arrays
+        """
+        checkCancelled()
+        mod = AutoData(datafile)
+        mod.usecols = [self.column]
+        mod.dtype = {self.column: np.float64}
+        if self.chunksize > 0:
+            for chunk in mod.load_chunks(self.chunksize):
+                yield chunk[self.column].values.astype(np.float64)
+        else:
+            yield mod.data[self.column].values.astype(np.float64)
+
+    def getEdges(self):
+        """
+        Bin edges for all files from fixed range or a min/max pass over the files
+        :return: numpy array of edges or None if no values
+        """
+        (minv, maxv) = self.range
+        if minv is None or maxv is None:
+            fmin = np.inf
+            fmax = -np.inf
+            for f in self.inputfiles:
+                try:
+                    for xdata in self.loadChunks(f):
+                        finite = xdata[np.isfinite(xdata)]
+                        if len(finite) > 0:
+                            fmin = min(fmin, finite.min())
+                            fmax = max(fmax, finite.max())
+                except (ValueError, KeyError):
+                    # column not in file - skipped in run
+                    continue
+            if fmin > fmax:
+                return None
+            if minv is None:
+                minv = fmin
+            if maxv is None:
+                maxv = fmax
+        return binEdges(minv, maxv, self.binwidth)
+
+    def getOutputfile(self, suffix):
+        fparts = [self.base.split(sep)[-1], FREQ_TYPES[self.freq] + suffix]
+        if len(self.prefix) > 0:
+            fparts = [self.prefix] + fparts
+        return join(self.outputdir, "_".join(fparts))
+
+    def generateID(self, f):
+        """
+        Row label for file - as for batch ids
+        :param f: full path filename
+        :return: id
+        """
+        (filename, ext) = splitext(basename(f))
+        if len(self.prefix) > 0:
+            return self.prefix + "_" + filename
+        return filename
+
+    def saveMatrix(self, ids, counts, edges):
+        """
+        Save files x bins matrix as csv (histogram values for HISTOGRAM_FREQ_TYPE) and npz (counts)
+        :param ids: list of file ids
+        :param counts: matrix of counts with row per file
+        :param edges: bin edges
+        :return: csv filename
+        """
+        outputfile = self.getOutputfile(self.allsuffix)
+        values = frequencies(counts, self.binwidth, self.freq)
+        allstats = pd.DataFrame(values, index=pd.Index(ids, name='id'), columns=[str(b) for b in edges[0:-1]])
+        with timed_write(outputfile, len(allstats)) as tmpfile:
+            allstats.to_csv(tmpfile)
+        with timed_write(splitext(outputfile)[0] + '.npz', len(ids)) as tmpfile:
+            with open(tmpfile, 'wb') as f:
+                np.savez(f, counts=counts, edges=edges, ids=np.array(ids, dtype=str))
+        print("Saved histograms of all files to ", outputfile)
+        return outputfile
+
+    def run(self):
+        """
+        Generate pooled histogram for all files and save to outputdir
+        :return: outputfilename
+        """
+        edges = self.getEdges()
+        if edges is None:
+            raise ValueError("Group Histogram: no data for %s" % self.column)
+        # row of counts per file - pooled histogram is the sum of rows
+        counts = np.zeros((len(self.inputfiles), len(edges) - 1), dtype=np.int64)
+        ids = []
+        for f in self.inputfiles:
+            row = HistogramAccumulator(edges)
+            try:
+                for xdata in self.loadChunks(f):
+                    row.update(xdata)
+            except (ValueError, KeyError) as e:
+                # column not in file
+                logging.warning("Group Histogram: skipping %s - %s", f, e)
+                continue
+            counts[len(ids)] = row.counts
+            ids.append(self.generateID(f))
+        counts = counts[0:len(ids)]
+        self.saveMatrix(ids, counts, edges)
+        acc = HistogramAccumulator(edges)
+        acc.counts = counts.sum(axis=0)
+        histdata = pd.DataFrame()
+        histdata['bins'] = edges[0:-1]
+        histdata['count'] = acc.counts
+        histdata[self.column] = acc.frequencies(self.freq)
+        annotate(rows_in=int(counts.sum()), rows_out=len(histdata))
+        outputfile = self.getOutputfile(self.suffix)
+        with timed_write(outputfile, len(histdata)) as tmpfile:
+            histdata.to_csv(tmpfile, index=False)
+        print("Saved group histogram data to ", outputfile)
+        return outputfile
+
+
 def create_parser():
     import sys
 
@@ -144,7 +471,7 @@ if __name__ == "__main__":
 
         # Run through different types of histo
         #freq: 0=relative freq, 1=density, 2=cumulative
-        for t in [0,1]:
+        for t in [0,1,2]:
             fd.freq = t
             fd.run()
 
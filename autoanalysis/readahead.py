@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Read-ahead of input files and write-behind of outputs for runs in the run thread
+    1. prefetch loads the next files in reader threads while the current file is processed -
+       at most PREFETCH_DEPTH files are loaded ahead so memory is bounded
+    2. AsyncWriter writes outputs in a writer thread - at most WRITE_QUEUE_DEPTH outputs are queued
+       (submit blocks when full) and each write returns a future so a file is only recorded as done
+       when its outputs have been written
+
+Created on 18 Oct 2026
+
+@author: QBI Software
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from autoanalysis.cancel import getToken, setThreadToken
+
+
+def prefetch(load, items, depth):
+    """
+    Load items ahead in reader threads
+    :param load: function called with item - exceptions are raised when the item is reached
+    :param items: list of items eg filenames
+    :param depth: number of items loaded ahead (0 to load each item when it is reached)
+    :return: generator of (item, load(item)) in order of items
+    """
+    if depth <= 0:
+        for item in items:
+            yield (item, load(item))
+        return
+    # readers stop if the run is cancelled
+    pool = ThreadPoolExecutor(max_workers=depth, initializer=setThreadToken, initargs=(getToken(),))
+    pending = deque()
+    try:
+        for item in items:
+            pending.append((item, pool.submit(load, item)))
+            if len(pending) > depth:
+                (first, future) = pending.popleft()
+                yield (first, future.result())
+        while len(pending) > 0:
+            (first, future) = pending.popleft()
+            yield (first, future.result())
+    finally:
+        for (item, future) in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+
+class AsyncWriter():
+    def __init__(self, depth):
+        """
+        Writer thread with bounded queue of outputs
+        :param depth: maximum number of outputs queued or being written
+        """
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.slots = threading.BoundedSemaphore(max(1, depth))
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue write - blocks until there is space in the queue
+        :param func: function which writes output eg save_data
+        :return: Future of func result
+        """
+        self.slots.acquire()
+        try:
+            future = self.pool.submit(func, *args, **kwargs)
+        except Exception as e:
+            self.slots.release()
+            raise e
+        future.add_done_callback(lambda f: self.slots.release())
+        return future
+
+    def close(self):
+        """
+        Wait for queued writes and stop writer thread
+        """
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Run scheduler for the engine - replaces a single lock for all runs
+    1. Runs are queued with the CPUs (workers) and memory they need, the files they read and write
+       (config names from processes.yaml eg FILTERED_FILENAME) and the directories they use
+    2. A run waits for earlier runs only if they depend on each other - same directories and one writes
+       files the other reads or writes
+    3. Runs are started in order while CPUs and memory are within budget - a run may be given fewer workers
+       than requested so the machine is kept busy, and a run is always started if nothing else is running
+    4. State of each run is kept: queued, running, done, failed or cancelled
+
+Created on 18 Oct 2026
+
+@author: QBI Software
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+from multiprocessing import cpu_count
+from os.path import normpath, sep
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = [DONE, FAILED, CANCELLED]
+logger = logging.getLogger()
+
+
+class RunState():
+    def __init__(self, runid, name, start, cpus, memory, reads, writes, paths):
+        """
+        State of a run in the scheduler
+        :param runid: id from scheduler
+        :param name: name for logs
+        :param start: function called with (runid, cpus) when run is admitted
+        :param cpus: workers requested
+        :param memory: memory needed for all workers (MB) or 0 if not known
+        :param reads: set of file types read
+        :param writes: set of file types written
+        :param paths: set of directories used
+        """
+        self.runid = runid
+        self.name = name
+        self.start = start
+        self.cpus = max(1, int(cpus))
+        self.memory = float(memory)
+        self.reads = set(reads)
+        self.writes = set(writes)
+        self.paths = set([normpath(p) for p in paths])
+        self.state = QUEUED
+        self.granted = 0
+        self.submitted = time.time()
+        self.started = None
+        self.ended = None
+
+    def memoryFor(self, cpus):
+        return self.memory * cpus / self.cpus
+
+    def overlaps(self, other):
+        """
+        Directories in common - same directory or one inside the other
+        """
+        for p in self.paths:
+            for o in other.paths:
+                if p == o or p.startswith(o.rstrip(sep) + sep) or o.startswith(p.rstrip(sep) + sep):
+                    return True
+        return False
+
+    def dependsOn(self, other):
+        """
+        Run must wait for other run - files written by one are read or written by the other in the same directories
+        """
+        conflict = (self.reads & other.writes) or (self.writes & other.writes) or (self.writes & other.reads)
+        return bool(conflict) and self.overlaps(other)
+
+
+class RunScheduler():
+    def __init__(self, cpus=None, memory=None):
+        """
+        :param cpus: total workers for all runs (default all cores)
+        :param memory: total memory for all runs in MB (None for no limit)
+        """
+        if cpus is None or cpus <= 0:
+            cpus = cpu_count()
+        self.cpus = int(cpus)
+        self.memory = memory if memory is not None and memory > 0 else None
+        self.runs = OrderedDict()
+        self.ids = count(1)
+        self.condition = threading.Condition(threading.RLock())
+
+    def submit(self, name, start, cpus=1, memory=0, reads=(), writes=(), paths=()):
+        """
+        Queue a run - started now if possible
+        :return: runid
+        """
+        with self.condition:
+            runid = next(self.ids)
+            self.runs[runid] = RunState(runid, name, start, cpus, memory, reads, writes, paths)
+            logger.info("Scheduler: queued run %d %s (%d workers)", runid, name, self.runs[runid].cpus)
+        self.schedule()
+        return runid
+
+    def used(self):
+        """
+        :return: (cpus, memory) of running runs
+        """
+        running = [r for r in self.runs.values() if r.state == RUNNING]
+        return (sum([r.granted for r in running]), sum([r.memoryFor(r.granted) for r in running]))
+
+    def admit(self, run):
+        """
+        Workers to start run with or 0 if it must wait for resources
+        """
+        (cpus, memory) = self.used()
+        if cpus == 0:
+            # always run something
+            return run.cpus
+        granted = min(run.cpus, self.cpus - cpus)
+        if self.memory is not None and run.memory > 0:
+            while granted > 0 and memory + run.memoryFor(granted) > self.memory:
+                granted -= 1
+        return max(0, granted)
+
+    def schedule(self):
+        """
+        Start queued runs in order if they do not depend on earlier runs and resources are available
+        """
+        started = []
+        with self.condition:
+            earlier = []
+            for run in self.runs.values():
+                if run.state in FINISHED:
+                    continue
+                if run.state == QUEUED and not any([run.dependsOn(e) for e in earlier]):
+                    granted = self.admit(run)
+                    if granted > 0:
+                        run.state = RUNNING
+                        run.granted = granted
+                        run.started = time.time()
+                        started.append(run)
+                earlier.append(run)
+        for run in started:
+            logger.info("Scheduler: starting run %d %s with %d workers", run.runid, run.name, run.granted)
+            try:
+                run.start(run.runid, run.granted)
+            except Exception as e:
+                logger.error("Scheduler: cannot start run %d - %s", run.runid, e)
+                self.finish(run.runid, FAILED)
+
+    def finish(self, runid, state=DONE):
+        """
+        Run has finished - resources released and waiting runs started
+        """
+        with self.condition:
+            run = self.runs[runid]
+            run.state = state
+            run.ended = time.time()
+            self.condition.notify_all()
+        logger.info("Scheduler: run %d %s %s", runid, run.name, state)
+        self.schedule()
+
+    def cancel(self, runid):
+        """
+        Remove queued run - running runs are cancelled by the engine
+        :return: True if run was queued
+        """
+        with self.condition:
+            run = self.runs[runid]
+            if run.state != QUEUED:
+                return False
+        self.finish(runid, CANCELLED)
+        return True
+
+    def getState(self, runid):
+        with self.condition:
+            return self.runs[runid].state
+
+    def active(self):
+        """
+        :return: list of runids queued or running
+        """
+        with self.condition:
+            return [r.runid for r in self.runs.values() if r.state not in FINISHED]
+
+    def wait(self, runid=None, timeout=None):
+        """
+        Wait until run (or all runs) finished
+        :return: True if finished
+        """
+        with self.condition:
+            if runid is None:
+                return self.condition.wait_for(lambda: len(self.active()) == 0, timeout)
+            return self.condition.wait_for(lambda: self.runs[runid].state in FINISHED, timeout)
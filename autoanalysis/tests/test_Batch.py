@@ -1,10 +1,13 @@
 import unittest2 as unittest
 import argparse
+import shutil
+import tempfile
 from os.path import join
-from os import access,R_OK
-from autoanalysis.processmodules.Batch import AutoBatch, create_parser
+from os import access,R_OK,remove
+from autoanalysis.processmodules.Batch import AutoBatch, RaggedBatch, create_parser
 from glob import iglob
 import re
+import pandas as pd
 
 class TestBatch(unittest.TestCase):
     def setUp(self):
@@ -39,3 +42,146 @@ class TestBatch(unittest.TestCase):
         outputfile = self.batch.run()
         expected = 'BATCH'
         self.assertTrue(expected in outputfile)
+
+
+class TestBatchColumns(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.inputfiles = []
+        for i in range(3):
+            f = join(self.tmpdir, 'Brain%d_Filtered.csv' % i)
+            pd.DataFrame({'a': range(i + 2), 'b': [x * 0.5 for x in range(i + 2)], 'c': 'x'}).to_csv(f, index=False)
+            self.inputfiles.append(f)
+        self.batch = AutoBatch(self.inputfiles, self.tmpdir)
+        self.batch.prefix = 'control'
+        self.cfg = self.batch.getConfigurables()
+        self.cfg['BATCH_COLUMN_NAMES'] = 'a, b'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_wide(self):
+        self.batch.setConfigurables(self.cfg)
+        outputfiles = self.batch.run()
+        self.assertEqual(2, len(outputfiles))
+        self.assertTrue(outputfiles[1].endswith('_b_BATCH.csv'))
+        df = pd.read_csv(outputfiles[1])
+        self.assertEqual(['control_Brain0_Filtered', 'control_Brain1_Filtered', 'control_Brain2_Filtered'],
+                         list(df.columns))
+        self.assertEqual([0, 0.5, 1, 1.5], list(df['control_Brain2_Filtered']))
+
+    def test_long(self):
+        self.cfg['BATCH_FORMAT'] = 'long'
+        self.batch.setConfigurables(self.cfg)
+        df = pd.read_csv(self.batch.run())
+        self.assertEqual(['id', 'a', 'b'], list(df.columns))
+        self.assertEqual(9, len(df))
+        self.assertEqual(4, len(df[df['id'] == 'control_Brain2_Filtered']))
+
+    def test_column_names(self):
+        # defaults - no columns
+        self.batch.setConfigurables(self.batch.getConfigurables())
+        self.assertEqual([], self.batch.colnames)
+        self.assertRaises(ValueError, self.batch.run)
+        self.cfg['BATCH_COLUMN_NAMES'] = ['a', 'b']
+        self.batch.setConfigurables(self.cfg)
+        self.assertEqual(['a', 'b'], self.batch.colnames)
+
+    def test_missing_column(self):
+        self.cfg['BATCH_COLUMN_NAMES'] = 'd'
+        self.batch.setConfigurables(self.cfg)
+        self.assertIsNone(self.batch.run())
+
+    def test_npz(self):
+        self.cfg['BATCH_FORMAT'] = 'npz'
+        self.batch.setConfigurables(self.cfg)
+        outputfile = self.batch.run()
+        self.assertTrue(outputfile.endswith('BATCH.npz'))
+        ragged = RaggedBatch.load(outputfile)
+        self.assertEqual(['a', 'b'], ragged.colnames)
+        self.assertEqual([0, 2, 5, 9], ragged.offsets)
+        self.assertEqual([0, 0.5, 1], list(ragged.get('control_Brain1_Filtered', 'b')))
+
+
+class TestRaggedBatch(unittest.TestCase):
+    def setUp(self):
+        self.ragged = RaggedBatch(['v'])
+        for i, n in enumerate([3, 1, 2]):
+            self.ragged.append('f%d' % i, pd.DataFrame({'v': range(n)}))
+
+    def test_values(self):
+        self.assertEqual([0, 1, 2, 0, 0, 1], list(self.ragged.values('v')))
+        self.assertEqual([3, 1, 2], list(self.ragged.lengths()))
+
+    def test_wide(self):
+        df = self.ragged.toWide('v')
+        self.assertEqual((3, 3), df.shape)
+        self.assertEqual(1, df['f1'].count())
+        tmpfile = tempfile.mktemp(suffix='.csv')
+        try:
+            self.ragged.writeWide(tmpfile, 'v', blocksize=2)
+            with open(tmpfile) as f:
+                self.assertEqual(['f0,f1,f2', '0.0,0.0,0.0', '1.0,,1.0', '2.0,,'], f.read().splitlines())
+        finally:
+            remove(tmpfile)
+
+    def test_long(self):
+        df = self.ragged.toLong()
+        self.assertEqual(['f0', 'f0', 'f0', 'f1', 'f2', 'f2'], list(df['id']))
+
+    def test_summary(self):
+        stats = self.ragged.summary('v')
+        self.assertEqual(['f0', 'f1', 'f2'], list(stats.index))
+        self.assertEqual([3, 1, 2], list(stats['count']))
+        self.assertEqual([1, 0, 0.5], list(stats['median']))
+        self.assertEqual([2, 0, 1], list(stats['max']))
+
+    def test_decimate(self):
+        (ids, values) = self.ragged.decimate('v', 3)
+        self.assertEqual(['f0', 'f0', 'f2'], list(ids))
+        self.assertEqual([0, 2, 0], list(values))
+        (ids, values) = self.ragged.decimate('v', 100)
+        self.assertEqual(6, len(values))
+
+
+class TestBatchIncremental(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.inputfiles = []
+        for i in range(4):
+            f = join(self.tmpdir, 'Brain%d_Filtered.csv' % i)
+            pd.DataFrame({'a': range(i + 2)}).to_csv(f, index=False)
+            self.inputfiles.append(f)
+        self.read = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def runBatch(self, inputfiles):
+        batch = AutoBatch(inputfiles, self.tmpdir)
+        cfg = batch.getConfigurables()
+        cfg['BATCH_COLUMN_NAMES'] = 'a'
+        batch.setConfigurables(cfg)
+        readFile = batch.readFile
+        def countRead(f):
+            self.read.append(f)
+            return readFile(f)
+        batch.readFile = countRead
+        return batch.run()
+
+    def test_unchanged(self):
+        outputfile = self.runBatch(self.inputfiles)
+        self.assertEqual(4, len(self.read))
+        self.assertEqual(outputfile, self.runBatch(self.inputfiles))
+        self.assertEqual(4, len(self.read))
+
+    def test_changed(self):
+        outputfile = self.runBatch(self.inputfiles)
+        pd.DataFrame({'a': [7]}).to_csv(self.inputfiles[1], index=False)
+        self.read = []
+        self.runBatch(self.inputfiles[0:3])
+        self.assertEqual([self.inputfiles[1]], self.read)
+        df = pd.read_csv(outputfile)
+        self.assertEqual(['Brain0_Filtered', 'Brain1_Filtered', 'Brain2_Filtered'], list(df.columns))
+        self.assertEqual(7, df['Brain1_Filtered'][0])
+        self.assertEqual(4, df['Brain2_Filtered'].count())
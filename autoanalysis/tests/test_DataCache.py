@@ -0,0 +1,81 @@
+import shutil
+import tempfile
+from os import listdir
+from os.path import join
+
+import pandas as pd
+import unittest2 as unittest
+
+from autoanalysis.processmodules.DataCache import DataCache
+from autoanalysis.processmodules.DataParser import AutoData, save_data
+
+
+class TestDataCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datafile = join(self.tmpdir, 'Brain10_Image.csv')
+        pd.DataFrame({'TestData': range(100), 'Other': range(100)}).to_csv(self.datafile, index=False)
+        self.cache = DataCache(join(self.tmpdir, 'cache'), 10)
+        self.options = {'sheet': 0, 'skiprows': 0, 'headers': None}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_empty(self):
+        self.assertIsNone(self.cache.get(self.datafile, self.options))
+
+    def test_put_get(self):
+        data = pd.read_csv(self.datafile)
+        self.cache.put(self.datafile, self.options, data)
+        cached = self.cache.get(self.datafile, self.options)
+        self.assertTrue(data.equals(cached))
+
+    def test_options_key(self):
+        data = pd.read_csv(self.datafile)
+        self.cache.put(self.datafile, self.options, data)
+        options = dict(self.options)
+        options['skiprows'] = 1
+        self.assertIsNone(self.cache.get(self.datafile, options))
+
+    def test_changed_file(self):
+        data = pd.read_csv(self.datafile)
+        self.cache.put(self.datafile, self.options, data)
+        pd.DataFrame({'TestData': range(10)}).to_csv(self.datafile, index=False)
+        self.assertIsNone(self.cache.get(self.datafile, self.options))
+
+    def test_evict(self):
+        cache = DataCache(self.cache.cachedir, 0.000001)
+        cache.put(self.datafile, self.options, pd.read_csv(self.datafile))
+        self.assertEqual(0, cache.size())
+
+    def test_total(self):
+        data = pd.read_csv(self.datafile)
+        self.cache.put(self.datafile, self.options, data)
+        self.assertEqual(self.cache.size(), self.cache.total)
+        # replaced entry is not counted twice
+        self.cache.put(self.datafile, self.options, data)
+        self.assertEqual(self.cache.size(), self.cache.total)
+        # entry added by another process is found when the cache is over size
+        shutil.copy(join(self.cache.cachedir, listdir(self.cache.cachedir)[0]), join(self.cache.cachedir, 'a.pkl'))
+        self.cache.maxsize = self.cache.size() - 1
+        self.cache.put(self.datafile, {'sheet': 1}, data)
+        self.assertEqual(self.cache.size(), self.cache.total)
+        self.assertLessEqual(self.cache.total, self.cache.maxsize)
+
+    def test_autodata_cache(self):
+        mod = AutoData(self.datafile)
+        mod.usecols = ['TestData']
+        mod.cache = self.cache
+        self.assertEqual(['TestData'], list(mod.data.columns))
+        mod2 = AutoData(self.datafile)
+        mod2.usecols = ['TestData']
+        mod2.cache = self.cache
+        self.assertIsNotNone(self.cache.get(self.datafile, mod2.getLoadOptions()))
+        self.assertTrue(mod.data.equals(mod2.data))
+
+    def test_binary_not_cached(self):
+        datafile = save_data(pd.read_csv(self.datafile), join(self.tmpdir, 'Brain10_Image_Filtered.npz'))
+        mod = AutoData(datafile)
+        mod.cache = self.cache
+        self.assertEqual(100, len(mod.data))
+        self.assertEqual(0, self.cache.size())
@@ -0,0 +1,84 @@
+import shutil
+import tempfile
+from os import mkdir
+from os.path import join
+
+import numpy as np
+import pandas as pd
+import unittest2 as unittest
+
+from autoanalysis.processmodules.Filter import AutoFilter
+
+
+class TestFilterChunks(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rs = np.random.RandomState(0)
+        data = pd.DataFrame()
+        data['a'] = rs.randint(0, 120, 250)
+        # integer column with missing value only in a later chunk - float in whole file
+        data['b'] = rs.randint(0, 500, 250).astype(object)
+        data.loc[200, 'b'] = None
+        data['c'] = rs.normal(50, 10, 250)
+        # text only in a later chunk
+        data['d'] = rs.randint(0, 10, 250).astype(object)
+        data.loc[180, 'd'] = 'x'
+        self.datafile = join(self.tmpdir, 'Brain0_Image.csv')
+        data.to_csv(self.datafile, index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def runFilter(self, chunksize, scantypes=True):
+        outputdir = join(self.tmpdir, 'chunks%d_%s' % (chunksize, scantypes))
+        mkdir(outputdir)
+        mod = AutoFilter(self.datafile, outputdir)
+        cfg = mod.getConfigurables()
+        cfg['COLUMN'] = 'a'
+        cfg['MINRANGE'] = 10
+        cfg['MAXRANGE'] = 100
+        cfg['CHUNKSIZE'] = chunksize
+        cfg['CHUNK_SCAN_TYPES'] = scantypes
+        cfg['OUTPUTALLCOLUMNS'] = True
+        mod.setConfigurables(cfg)
+        with open(mod.run(), 'rb') as f:
+            return f.read()
+
+    def test_chunks_match_whole_file(self):
+        whole = self.runFilter(0)
+        self.assertIn(b'.0,', whole)
+        for chunksize in [7, 50, 1000]:
+            self.assertEqual(whole, self.runFilter(chunksize))
+
+    def test_chunks_first_chunk_types(self):
+        whole = self.runFilter(0)
+        # types of whole file are in first chunk
+        self.assertEqual(whole, self.runFilter(1000, False))
+        # b has missing value in a later chunk - integers of earlier chunks are not written as float
+        with self.assertLogs(level='WARNING') as logs:
+            chunked = self.runFilter(50, False)
+        self.assertEqual(2, len(logs.output))
+        self.assertIn('Columns d ', logs.output[0])
+        self.assertIn('Columns b ', logs.output[1])
+        self.assertNotEqual(whole, chunked)
+        self.assertEqual(pd.read_csv(join(self.tmpdir, 'chunks0_True', 'Brain0_Image_FILTERED.csv')).shape,
+                         pd.read_csv(join(self.tmpdir, 'chunks50_False', 'Brain0_Image_FILTERED.csv')).shape)
+
+    def test_run_without_config(self):
+        # attributes set directly as in test_Controller
+        mod = AutoFilter(self.datafile, self.tmpdir)
+        mod.column = 'a'
+        mod.outputallcolumns = True
+        mod.minlimit = 10
+        mod.maxlimit = 100
+        self.assertIsNotNone(mod.run())
+
+    def test_prefetch(self):
+        mod = AutoFilter(self.datafile, self.tmpdir)
+        mod.chunksize = 50
+        # streamed files are read when run
+        mod.prefetch()
+        self.assertIsNone(mod._data)
+        mod.chunksize = 0
+        mod.prefetch()
+        self.assertEqual(250, len(mod._data))
@@ -1,8 +1,13 @@
 import unittest2 as unittest
 import argparse
-from os.path import join
+import shutil
+import tempfile
+from os.path import join, basename
 from os import access,R_OK
-from autoanalysis.processmodules.Histogram import AutoHistogram, create_parser
+import numpy as np
+import pandas as pd
+from autoanalysis.processmodules.Histogram import AutoHistogram, AutoGroupHistogram, HistogramAccumulator, \
+    create_parser, binEdges, binCounts, frequencies
 
 class TestHistogram(unittest.TestCase):
     def setUp(self):
@@ -27,3 +32,95 @@ class TestHistogram(unittest.TestCase):
         self.fd.freq = 1 #'Density'
         outputfile = self.fd.run()
         self.assertTrue(outputfile.endswith('DENSITY_HISTOGRAM.csv'))
+
+
+class TestHistogramBins(unittest.TestCase):
+    def setUp(self):
+        self.xdata = np.random.RandomState(0).normal(-1, 0.5, 10000)
+
+    def test_binEdges(self):
+        edges = binEdges(-2.13, 0.51, 0.2)
+        self.assertAlmostEqual(-2.2, edges[0])
+        self.assertAlmostEqual(0.6, edges[-1])
+        self.assertEqual(15, len(edges))
+        self.assertRaises(ValueError, binEdges, 0, 1, 0)
+
+    def test_binCounts(self):
+        edges = binEdges(self.xdata.min(), self.xdata.max(), 0.2)
+        n, bin_edges = np.histogram(self.xdata, bins=edges)
+        self.assertTrue(np.array_equal(n, binCounts(self.xdata, edges)))
+
+    def test_binCounts_range(self):
+        edges = binEdges(-1, 0, 0.25)
+        x = np.array([-2, -1, -0.75, -0.5, -0.3, 0, 1, np.nan])
+        self.assertEqual([1, 1, 2, 1], list(binCounts(x, edges)))
+
+    def test_frequencies(self):
+        counts = np.array([1, 3, 0, 4])
+        self.assertEqual(1, frequencies(counts, 0.5, 0).sum())
+        self.assertEqual(1, (frequencies(counts, 0.5, 1) * 0.5).sum())
+        self.assertEqual(1, frequencies(counts, 0.5, 2)[-1])
+
+
+class TestHistogramAccumulator(unittest.TestCase):
+    def setUp(self):
+        self.xdata = np.random.RandomState(0).normal(-1, 0.5, 10000)
+        self.edges = binEdges(self.xdata.min(), self.xdata.max(), 0.2)
+
+    def test_update(self):
+        acc = HistogramAccumulator(self.edges)
+        for chunk in np.array_split(self.xdata, 7):
+            acc.update(chunk)
+        self.assertTrue(np.array_equal(binCounts(self.xdata, self.edges), acc.counts))
+        self.assertEqual(len(self.xdata), acc.total)
+
+    def test_merge(self):
+        acc1 = HistogramAccumulator(self.edges).update(self.xdata[:4000])
+        acc2 = HistogramAccumulator(self.edges).update(self.xdata[4000:])
+        acc = acc1 + acc2
+        self.assertEqual(4000, acc1.total)
+        self.assertTrue(np.array_equal(binCounts(self.xdata, self.edges), acc.counts))
+        self.assertRaises(ValueError, acc.merge, HistogramAccumulator(binEdges(0, 1, 0.2)))
+
+
+class TestGroupHistogram(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.inputfiles = []
+        for i in range(3):
+            f = join(self.tmpdir, 'Brain%d_Filtered.csv' % i)
+            pd.DataFrame({'log10D': rng.normal(-1, 0.5, 1000)}).to_csv(f, index=False)
+            self.inputfiles.append(f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_run(self):
+        batch = AutoGroupHistogram(self.inputfiles, self.tmpdir)
+        batch.prefix = 'Control'
+        cfg = batch.getConfigurables()
+        cfg.update({'COLUMN': 'log10D', 'BINWIDTH': '0.2', 'CHUNKSIZE': '300'})
+        batch.setConfigurables(cfg)
+        outputfile = batch.run()
+        self.assertTrue(outputfile.endswith('Control_%s_GROUP_HISTOGRAM.csv' % basename(self.tmpdir)))
+        hist = pd.read_csv(outputfile)
+        xdata = pd.concat([pd.read_csv(f)['log10D'] for f in self.inputfiles]).values
+        n, bin_edges = np.histogram(xdata, bins=binEdges(xdata.min(), xdata.max(), 0.2))
+        self.assertTrue(np.array_equal(n, hist['count'].values))
+        self.assertAlmostEqual(1, hist['log10D'].sum())
+
+    def test_matrix(self):
+        batch = AutoGroupHistogram(self.inputfiles, self.tmpdir)
+        cfg = batch.getConfigurables()
+        cfg.update({'COLUMN': 'log10D', 'BINWIDTH': '0.2', 'HISTOGRAM_MIN': '-3', 'HISTOGRAM_MAX': '1'})
+        batch.setConfigurables(cfg)
+        batch.run()
+        outputfile = batch.getOutputfile(batch.allsuffix)
+        allstats = pd.read_csv(outputfile, index_col=0)
+        self.assertEqual(['Brain0_Filtered', 'Brain1_Filtered', 'Brain2_Filtered'], list(allstats.index))
+        self.assertEqual(20, len(allstats.columns))
+        self.assertTrue(np.allclose(1, allstats.sum(axis=1)))
+        stored = np.load(outputfile.replace('.csv', '.npz'))
+        xdata = pd.read_csv(self.inputfiles[1])['log10D'].values
+        self.assertTrue(np.array_equal(binCounts(xdata, stored['edges']), stored['counts'][1]))
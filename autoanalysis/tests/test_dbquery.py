@@ -58,4 +58,14 @@ class TestDBquery(unittest.TestCase):
         configlist = [('BINWIDTH',20,'general'),('COLUMN','TestData2','general'),('MINRANGE',0,'general'),('MAXRANGE',100,'general')]
         cnt = self.dbi.addConfig(configid,configlist)
         expected = len(configlist)
-        self.assertEqual(expected,cnt)
\ No newline at end of file
+        self.assertEqual(expected,cnt)
+
+    def test_getSnapshot(self):
+        group = 'general'
+        snapshot = self.dbi.getSnapshot(group)
+        self.assertEqual(snapshot['BINWIDTH'], self.dbi.getConfigByName(group, 'BINWIDTH'))
+        self.assertIsInstance(snapshot.getInt('BINWIDTH'), int)
+        self.assertEqual(snapshot.getInt('BINW', 5), 5)
+        self.assertIsNone(snapshot.forModule({'BINW': 1})['BINW'])
+        with self.assertRaises(TypeError):
+            snapshot['BINWIDTH'] = 1
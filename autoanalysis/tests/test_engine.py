@@ -0,0 +1,482 @@
+import shutil
+import sqlite3
+import tempfile
+import threading
+from os import makedirs, listdir, remove, stat, sep, walk
+from os.path import join, basename
+
+import numpy as np
+import pandas as pd
+import unittest2 as unittest
+
+from autoanalysis.cancel import RunCancelled, setThreadToken
+from autoanalysis.cli import selectProcesses, getGroups, RESOURCESDIR
+from autoanalysis.db.dbquery import ConfigSnapshot, DBI
+from autoanalysis.engine import FindFilenames, CheckFilenames, FileIndex, ModuleFactory, Manifest, Pipeline, \
+    processFile, Engine
+from autoanalysis.scheduler import DONE, FAILED, CANCELLED
+
+
+class TestEngine(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for g in ['control', 'stim']:
+            makedirs(join(self.tmpdir, g))
+            for i in range(2):
+                open(join(self.tmpdir, g, 'Brain%d_Image.csv' % i), 'w').close()
+        open(join(self.tmpdir, 'control', 'notes.txt'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_FindFilenames(self):
+        filenames = FindFilenames(self.tmpdir, 'Image.csv', ['Control', 'Stim'])
+        self.assertEqual(4, len(filenames['all']))
+        self.assertEqual(2, len(filenames['Control']))
+        self.assertEqual(2, len(filenames['Stim']))
+
+    def test_FindFilenames_all(self):
+        filenames = FindFilenames(self.tmpdir)
+        self.assertEqual(5, len(filenames['all']))
+
+    def test_CheckFilenames(self):
+        filenames = FindFilenames(self.tmpdir, '.csv', ['Control'])
+        # files in the same directory match the same files - each listed once in order
+        checked = CheckFilenames(filenames, ['Image.csv'])
+        self.assertEqual(sorted(filenames['all']), checked['all'])
+        self.assertEqual(2, len(checked['Control']))
+        self.assertEqual(0, len(CheckFilenames(filenames, ['Filtered.csv'])['all']))
+
+    def test_CheckFilenames_directories(self):
+        for g in ['control', 'stim']:
+            makedirs(join(self.tmpdir, g, 'processed'))
+            open(join(self.tmpdir, g, 'processed', 'Brain0_Image_Filtered.csv'), 'w').close()
+        filenames = FindFilenames(self.tmpdir, 'Image.csv', ['Control', 'Stim'])
+        # matched in each directory of a group
+        checked = CheckFilenames(filenames, ['Filtered.csv'])
+        self.assertEqual(2, len(checked['all']))
+        self.assertEqual(1, len(checked['Stim']))
+
+    def test_selectProcesses(self):
+        processes = {'process1': {'caption': '1. Filter Data'}, 'process2': {'caption': '2. Generate Histograms'}}
+        self.assertEqual(['process1', 'process2'], selectProcesses(processes, ''))
+        self.assertEqual(['process2', 'process1'], selectProcesses(processes, '2. generate histograms, process1'))
+        self.assertRaises(ValueError, selectProcesses, processes, 'process9')
+
+    def test_getGroups(self):
+        config = {'GROUP10': 'Treatment9', 'GROUP2': 'Treatment1', 'GROUP1': 'Control', 'GROUPING': 'x', 'COLUMN': 'a'}
+        self.assertEqual(['Control', 'Treatment1', 'Treatment9'], getGroups(config))
+
+    def test_ModuleFactory(self):
+        factory = ModuleFactory('autoanalysis.processmodules.Filter', 'AutoFilter')
+        self.assertIn('COLUMN', factory.configurables)
+        config = ConfigSnapshot('test', {'COLUMN': 'TestData', 'OUTPUTALLCOLUMNS': '0', 'MINRANGE': '0', 'MAXRANGE': '10', 'CACHE_SIZE': '0'})
+        configured = factory.configure(config)
+        self.assertIsNone(factory.cfg)
+        self.assertEqual('TestData', configured.getConfig()['COLUMN'])
+        datafile = join(self.tmpdir, 'control', 'Brain0_Image.csv')
+        mod = configured.create(datafile, self.tmpdir)
+        self.assertEqual('TestData', mod.column)
+        self.assertEqual(['TestData'], mod.usecols)
+
+    def test_ModuleFactory_cache(self):
+        factory = ModuleFactory('autoanalysis.processmodules.Filter', 'AutoFilter')
+        # cache only if CACHE_SIZE is set
+        self.assertIsNone(factory.configure(ConfigSnapshot('test', {})).cache)
+        config = ConfigSnapshot('test', {'CACHE_SIZE': '10', 'CACHE_DIR': join(self.tmpdir, 'cache')})
+        self.assertIsNotNone(factory.configure(config).cache)
+        # not for outputs of other processes
+        factory.intermediate = True
+        self.assertIsNone(factory.configure(config).cache)
+
+    def test_ModuleFactory_invalid(self):
+        self.assertRaises(ValueError, ModuleFactory, 'autoanalysis.processmodules.Filter', 'NoClass')
+        self.assertRaises(ValueError, ModuleFactory, 'autoanalysis.engine', 'Pipeline')
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        # as processes.yaml
+        self.processes = {}
+        for (p, filesin, filesout, output) in [('process1', 'DATA_FILENAME', 'FILTERED_FILENAME', 'local'),
+                                               ('process2', 'FILTERED_FILENAME', 'HISTOGRAM_FILENAME', 'local'),
+                                               ('process3', 'FILTERED_FILENAME', 'BATCH_FILENAME', 'batch'),
+                                               ('process4', 'HISTOGRAM_FILENAME', 'GROUP_FILENAME', 'batch')]:
+            self.processes[p] = {'caption': p, 'filesin': filesin, 'filesout': filesout, 'output': output}
+
+    def test_order(self):
+        pipeline = Pipeline(self.processes, ['process4', 'process3', 'process2', 'process1'])
+        # after upstream processes - otherwise in selected order
+        self.assertEqual(['process1', 'process3', 'process2', 'process4'], pipeline.stages)
+        self.assertEqual(['process1'], pipeline.roots())
+        self.assertEqual(['process1'], pipeline.upstream['process3'])
+        self.assertEqual(['process2', 'process3'], sorted(pipeline.downstream['process1']))
+        self.assertEqual(['process4'], pipeline.downstream['process2'])
+        self.assertTrue(pipeline.isBatch('process3'))
+        self.assertFalse(pipeline.isBatch('process2'))
+
+    def test_unselected_upstream(self):
+        # inputs of process2 are files from an earlier run
+        pipeline = Pipeline(self.processes, ['process4', 'process2'])
+        self.assertEqual(['process2', 'process4'], pipeline.stages)
+        self.assertEqual(['process2'], pipeline.roots())
+
+    def test_independent(self):
+        pipeline = Pipeline(self.processes, ['process3', 'process2'])
+        self.assertEqual(['process3', 'process2'], pipeline.stages)
+        self.assertEqual(['process3', 'process2'], pipeline.roots())
+
+    def test_cycle(self):
+        self.processes['process1']['filesin'] = 'DATA_FILENAME, GROUP_FILENAME'
+        with self.assertRaises(ValueError) as e:
+            Pipeline(self.processes, ['process1', 'process2', 'process4'])
+        self.assertIn('circular', str(e.exception))
+        for p in ['process1', 'process2', 'process4']:
+            self.assertIn(p, str(e.exception))
+        # cycle not selected
+        self.assertEqual(['process1', 'process2'], Pipeline(self.processes, ['process2', 'process1']).stages)
+
+
+class TestFileIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for g in ['control', 'stim']:
+            makedirs(join(self.tmpdir, g, 'processed'))
+            for i in range(2):
+                open(join(self.tmpdir, g, 'Brain%d_Image.csv' % i), 'w').close()
+                # output of filter process for the data file
+                open(join(self.tmpdir, g, 'processed', 'Brain%d_Image_Filtered.csv' % i), 'w').close()
+        open(join(self.tmpdir, 'control', '.hidden_Filtered.csv'), 'w').close()
+        self.filenames = FindFilenames(self.tmpdir, 'Image.csv', ['Control', 'Stim'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_find(self):
+        index = FileIndex()
+        found = index.find(join(self.tmpdir, 'control'), '*Filtered.csv')
+        self.assertEqual([join(self.tmpdir, 'control', 'processed', 'Brain%d_Image_Filtered.csv' % i)
+                          for i in range(2)], found)
+        # subdirectory of a scanned directory is not scanned again
+        index.find(join(self.tmpdir, 'control', 'processed'), '*.csv')
+        self.assertEqual([join(self.tmpdir, 'control')], index.roots)
+        self.assertEqual((0,), index.stat(found[0])[0:1])
+        self.assertIsNone(index.stat(join(self.tmpdir, 'control', '.hidden_Filtered.csv')))
+
+    def test_next_stage_inputs(self):
+        # data files selected for a process reading outputs of the filter process
+        index = FileIndex()
+        checked = CheckFilenames(self.filenames, ['*Filtered.csv'], index)
+        self.assertEqual(4, len(checked['all']))
+        self.assertTrue(all([f.endswith('_Filtered.csv') for f in checked['all']]))
+        self.assertEqual([join(self.tmpdir, 'stim', 'processed', 'Brain%d_Image_Filtered.csv' % i)
+                          for i in range(2)], checked['Stim'])
+        # data files match themselves
+        self.assertEqual(sorted(self.filenames['all']), CheckFilenames(self.filenames, ['Image.csv'], index)['all'])
+
+    def test_no_outputs(self):
+        shutil.rmtree(join(self.tmpdir, 'stim', 'processed'))
+        checked = CheckFilenames(self.filenames, ['Filtered.csv'], FileIndex())
+        self.assertEqual(2, len(checked['Control']))
+        self.assertEqual([], checked['Stim'])
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datafile = join(self.tmpdir, 'Brain0_Image.csv')
+        with open(self.datafile, 'w') as f:
+            f.write('a\n1\n')
+        self.output = join(self.tmpdir, 'Brain0_Image_Filtered.csv')
+        open(self.output, 'w').close()
+        factory = ModuleFactory('autoanalysis.processmodules.Filter', 'AutoFilter')
+        self.process = Manifest.processKey('process1', factory)
+        self.cfg = {'COLUMN': 'a', 'MINRANGE': '0'}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def recordOutput(self, manifest, process, cfg):
+        key = manifest.getKey(process, self.datafile, cfg)
+        manifest.record(self.tmpdir, key, manifest.fingerprint(self.datafile, process, cfg), self.output)
+
+    def getOutput(self, manifest, process, cfg):
+        key = manifest.getKey(process, self.datafile, cfg)
+        return manifest.getOutput(self.tmpdir, key, manifest.fingerprint(self.datafile, process, cfg))
+
+    def test_up_to_date(self):
+        manifest = Manifest()
+        self.recordOutput(manifest, self.process, self.cfg)
+        manifest.save()
+        # loaded from saved manifest
+        self.assertEqual(self.output, self.getOutput(Manifest(), self.process, self.cfg))
+
+    def test_changed_input(self):
+        manifest = Manifest()
+        self.recordOutput(manifest, self.process, self.cfg)
+        with open(self.datafile, 'a') as f:
+            f.write('2\n')
+        self.assertIsNone(self.getOutput(manifest, self.process, self.cfg))
+
+    def test_changed_config(self):
+        manifest = Manifest()
+        self.recordOutput(manifest, self.process, self.cfg)
+        cfg = dict(self.cfg)
+        cfg['MINRANGE'] = '10'
+        self.assertIsNone(self.getOutput(manifest, self.process, cfg))
+        # output replaced by run with new config - earlier entry removed
+        self.recordOutput(manifest, self.process, cfg)
+        self.assertIsNone(self.getOutput(manifest, self.process, self.cfg))
+        self.assertEqual(1, len(manifest.load(self.tmpdir)))
+
+    def test_removed_output(self):
+        manifest = Manifest()
+        self.recordOutput(manifest, self.process, self.cfg)
+        remove(self.output)
+        self.assertIsNone(self.getOutput(manifest, self.process, self.cfg))
+
+    def test_same_module(self):
+        manifest = Manifest()
+        factory = ModuleFactory('autoanalysis.processmodules.Filter', 'AutoFilter')
+        other = Manifest.processKey('process5', factory)
+        self.recordOutput(manifest, self.process, self.cfg)
+        self.assertIsNone(self.getOutput(manifest, other, self.cfg))
+        self.recordOutput(manifest, other, self.cfg)
+        self.assertEqual(self.output, self.getOutput(manifest, self.process, self.cfg))
+
+    def test_missing_manifest(self):
+        self.assertIsNone(self.getOutput(Manifest(), self.process, self.cfg))
+
+    def test_corrupt_manifest(self):
+        with open(join(self.tmpdir, Manifest.FILENAME), 'w') as f:
+            f.write('{"process1')
+        manifest = Manifest()
+        self.assertIsNone(self.getOutput(manifest, self.process, self.cfg))
+        # replaced when saved
+        self.recordOutput(manifest, self.process, self.cfg)
+        manifest.save()
+        self.assertEqual(self.output, self.getOutput(Manifest(), self.process, self.cfg))
+
+
+class CountdownToken():
+    """Token which is set after it has been checked n times"""
+
+    def __init__(self, n):
+        self.n = n
+
+    def is_set(self):
+        self.n -= 1
+        return self.n < 0
+
+
+class TestCancel(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datafile = join(self.tmpdir, 'Brain0_Image.csv')
+        with open(self.datafile, 'w') as f:
+            f.write("TestData\n" + "\n".join([str(i % 20) for i in range(100)]) + "\n")
+        config = ConfigSnapshot('test', {'COLUMN': 'TestData', 'OUTPUTALLCOLUMNS': '0', 'MINRANGE': '0',
+                                         'MAXRANGE': '10', 'CACHE_SIZE': '0', 'CHUNKSIZE': '10',
+                                         'FILTERED_FILENAME': 'Filtered.csv'})
+        self.factory = ModuleFactory('autoanalysis.processmodules.Filter', 'AutoFilter').configure(config)
+
+    def tearDown(self):
+        setThreadToken(None)
+        shutil.rmtree(self.tmpdir)
+
+    def test_not_cancelled(self):
+        setThreadToken(threading.Event())
+        (filename, result, stats) = processFile((self.datafile, self.tmpdir, self.factory, False))
+        self.assertEqual(join(self.tmpdir, 'Brain0_Image_Filtered.csv'), result)
+        self.assertLessEqual(stats['start'], stats['end'])
+
+    def test_cancelled_before_file(self):
+        token = threading.Event()
+        token.set()
+        setThreadToken(token)
+        self.assertRaises(RunCancelled, processFile, (self.datafile, self.tmpdir, self.factory, False))
+        self.assertEqual(['Brain0_Image.csv'], listdir(self.tmpdir))
+
+    def test_cancelled_between_chunks(self):
+        # file check then cancelled after 3 chunks - partial output removed
+        setThreadToken(CountdownToken(4))
+        self.assertRaises(RunCancelled, processFile, (self.datafile, self.tmpdir, self.factory, False))
+        self.assertEqual(['Brain0_Image.csv'], listdir(self.tmpdir))
+
+
+class TestRuns(unittest.TestCase):
+    """Processes run by Engine over data files in a temp directory"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.inputdir = join(self.tmpdir, 'data')
+        self.outputdir = join(self.tmpdir, 'output')
+        makedirs(self.outputdir)
+        rs = np.random.RandomState(0)
+        for g in ['control', 'stim']:
+            makedirs(join(self.inputdir, g))
+            for i in range(3):
+                data = pd.DataFrame({'a': rs.randint(0, 120, 200), 'b': rs.normal(50, 10, 200)})
+                data.to_csv(join(self.inputdir, g, 'Brain%d_Image.csv' % i), index=False)
+        configdb = join(self.tmpdir, 'autoconfig.db')
+        conn = sqlite3.connect(configdb)
+        conn.execute("CREATE TABLE config (name TEXT, value TEXT, configid TEXT DEFAULT general NOT NULL)")
+        conn.commit()
+        conn.close()
+        config = {'COLUMN': 'a', 'MINRANGE': '20', 'MAXRANGE': '80', 'BINWIDTH': '10', 'OUTPUTALLCOLUMNS': '1',
+                  'GROUP1': 'Control', 'GROUP2': 'Stim', 'BATCH_COLUMN_NAMES': 'a', 'HISTOGRAM_FREQ_TYPE': '0',
+                  'DATA_FILENAME': '*Image.csv', 'FILTERED_FILENAME': '*Filtered.csv',
+                  'HISTOGRAM_FILENAME': '*Histogram.csv', 'BATCH_FILENAME': '*Batch.csv',
+                  'GROUP_HISTOGRAM_FILENAME': '*GroupHistogram.csv', 'ALLSTATS_FILENAME': '*AllHistogram.csv'}
+        dbi = DBI(configdb)
+        dbi.addConfig('general', [(k, v, 'general') for (k, v) in config.items()])
+        dbi.closeconn()
+        self.engine = Engine(configdb, 'general', join(RESOURCESDIR, 'processes.yaml'))
+        self.filenames = FindFilenames(self.inputdir, 'Image.csv', ['Control', 'Stim'])
+        self.progress = []
+
+    def tearDown(self):
+        self.engine.shutdown(wait=True, timeout=60)
+        self.engine.journal.close()
+        self.engine.db.closeconn()
+        shutil.rmtree(self.tmpdir)
+
+    def getOutputs(self, suffix):
+        """
+        Output files ending suffix in processed directories (of inputs and of processed files) with modified time
+        :return: dict of filename: mtime
+        """
+        outputs = {}
+        for (root, dirs, files) in walk(self.inputdir):
+            if basename(root) != 'processed':
+                continue
+            for f in files:
+                if f.endswith(suffix):
+                    outputs[join(root, f)] = stat(join(root, f)).st_mtime_ns
+        return outputs
+
+    def runProcess(self, workers, force=False):
+        t = self.engine.RunProcess('process1', self.outputdir, self.filenames, 0, workers=workers, force=force,
+                                   callback=self.progress.append)
+        self.assertTrue(t.wait(60))
+        self.assertEqual(DONE, t.status)
+        return t
+
+    def runPipeline(self, workers=2, force=False, callback=None):
+        t = self.engine.RunPipeline(['process1', 'process2', 'process3', 'process4'], self.outputdir,
+                                    self.filenames, workers=workers, force=force,
+                                    callback=callback if callback is not None else self.progress.append)
+        self.assertTrue(t.wait(60))
+        # every task counted once
+        for p in t.pipeline.stages:
+            self.assertEqual(0, t.pending[p])
+            self.assertLessEqual(t.finished[p], t.total[p])
+        return t
+
+    def checkFiltered(self, outputs):
+        self.assertEqual(6, len(outputs))
+        for f in outputs:
+            data = pd.read_csv(f)
+            self.assertGreater(len(data), 0)
+            self.assertTrue(data['a'].between(20, 80).all())
+
+    def test_RunProcess_parallel(self):
+        self.runProcess(2)
+        self.checkFiltered(self.getOutputs('Filtered.csv'))
+        self.assertEqual(100, self.progress[-1][0])
+
+    def test_RunProcess_serial(self):
+        self.runProcess(1)
+        outputs = self.getOutputs('Filtered.csv')
+        self.checkFiltered(outputs)
+        serial = dict([(f, open(f, 'rb').read()) for f in outputs])
+        # same outputs from worker processes
+        self.runProcess(2, force=True)
+        self.assertNotEqual(outputs, self.getOutputs('Filtered.csv'))
+        for f in outputs:
+            self.assertEqual(serial[f], open(f, 'rb').read())
+
+    def test_RunProcess_skip(self):
+        self.runProcess(2)
+        outputs = self.getOutputs('Filtered.csv')
+        t = self.runProcess(2)
+        self.assertEqual(outputs, self.getOutputs('Filtered.csv'))
+        self.assertEqual(6, len(self.engine.journal.getCompleted(t.journalid)))
+        # outputs are out of date when config changes
+        self.engine.db.addConfig('general', [(k, v if k != 'MAXRANGE' else '70', 'general')
+                                             for (k, v) in self.engine.db.getConfig('general').items()])
+        self.runProcess(2)
+        changed = self.getOutputs('Filtered.csv')
+        self.assertEqual([], [f for f in outputs if outputs[f] == changed[f]])
+
+    def test_RunPipeline(self):
+        t = self.runPipeline()
+        self.assertEqual(DONE, t.status)
+        self.checkFiltered(self.getOutputs('Filtered.csv'))
+        self.assertEqual(6, len(self.getOutputs('Histogram.csv')))
+        for p in t.pipeline.stages:
+            self.assertEqual(t.total[p], t.finished[p])
+            self.assertEqual(0, t.skipped[p])
+        self.assertEqual({'process1': 6, 'process2': 6, 'process3': 2, 'process4': 2}, t.total)
+        batch = [f for f in listdir(self.outputdir) if f.endswith('_Batch.csv')]
+        self.assertEqual(2, len(batch))
+        self.assertEqual(['Control', 'Stim'], sorted([f.split('_')[0] for f in batch]))
+        self.assertEqual(2, len([f for f in listdir(self.outputdir) if f.endswith('_GroupHistogram.csv')]))
+        # column for each filtered file of group in batch
+        filtered = [len(pd.read_csv(f)) for f in self.getOutputs('Filtered.csv') if sep + 'control' + sep in f]
+        data = pd.read_csv(join(self.outputdir, [f for f in batch if f.startswith('Control')][0]))
+        self.assertEqual(3, len(data.columns))
+        self.assertEqual(sorted(filtered), sorted(data.count().tolist()))
+        # repeated run skips files with up to date outputs
+        outputs = self.getOutputs('.csv')
+        t = self.runPipeline()
+        self.assertEqual(DONE, t.status)
+        self.assertEqual(6, t.skipped['process1'])
+        self.assertEqual(6, t.skipped['process2'])
+        self.assertEqual(outputs, self.getOutputs('.csv'))
+
+    def test_RunPipeline_progress_error(self):
+        # error after a file is done fails the process - file is counted once
+        def callback(data):
+            (count, row, i, total, process) = data
+            if process == '1. Filter Data' and 0 < count < 100:
+                raise ValueError('progress')
+        t = self.runPipeline(callback=callback)
+        self.assertEqual(FAILED, t.status)
+        self.assertIn('process1', t.failed)
+        self.assertEqual(6, t.finished['process1'])
+
+    def test_ResumeRun(self):
+        runs = []
+
+        def callback(data):
+            # cancel when the first file is done
+            (count, row, i, total, process) = data
+            if process == '1. Filter Data' and 0 < count < 100:
+                runs[0].cancel()
+        self.engine.subscribe(callback)
+        t = self.engine.RunPipeline(['process1', 'process2'], self.outputdir, self.filenames, workers=1,
+                                    callback=self.progress.append)
+        runs.append(t)
+        self.assertTrue(t.wait(60))
+        self.engine.unsubscribe(callback)
+        self.assertEqual(CANCELLED, t.status)
+        self.assertEqual(0, t.pending['process1'])
+        done = self.engine.journal.getCompleted(t.journalid)
+        self.assertGreater(len(done), 0)
+        self.assertLess(len(done), 12)
+        outputs = self.getOutputs('.csv')
+        self.assertEqual(len(done), len(outputs))
+        # only files not done are processed
+        r = self.engine.ResumeRun(callback=self.progress.append)
+        self.assertEqual(t.journalid, r.journalid)
+        self.assertTrue(r.wait(60))
+        self.assertEqual(DONE, r.status)
+        self.assertEqual(done, r.resumed)
+        self.assertEqual(len(done), sum(r.skipped.values()))
+        self.assertEqual(12, len(self.engine.journal.getCompleted(r.journalid)))
+        resumed = self.getOutputs('.csv')
+        self.assertEqual(12, len(resumed))
+        for f in outputs:
+            self.assertEqual(outputs[f], resumed[f])
+        self.assertEqual([], self.engine.journal.getUnfinished())
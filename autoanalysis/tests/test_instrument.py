@@ -0,0 +1,148 @@
+import csv
+import json
+import shutil
+import tempfile
+import threading
+import tracemalloc
+from os.path import join
+
+import unittest2 as unittest
+
+from autoanalysis.instrument import recording, stage, annotate, bind, saveTrace, saveSummary, startMemory, \
+    stopMemory
+from autoanalysis.processmodules.DataParser import timed_write
+
+
+class TestStages(unittest.TestCase):
+    def test_not_recording(self):
+        with stage('run') as event:
+            annotate(rows_in=1)
+        self.assertEqual({}, event)
+
+    def test_nested(self):
+        with recording('a.csv') as recorder:
+            with stage('run'):
+                with stage('load', 'a.csv') as event:
+                    event['rows_out'] = 10
+                annotate(rows_in=10, rows_out=5)
+        self.assertEqual(['load', 'run'], [e['stage'] for e in recorder.events])
+        (load, run) = recorder.events
+        self.assertEqual(10, load['rows_out'])
+        self.assertEqual((10, 5), (run['rows_in'], run['rows_out']))
+        self.assertEqual('a.csv', run['file'])
+        self.assertGreaterEqual(run['duration'], load['duration'])
+
+    def test_bind(self):
+        with recording('a.csv') as recorder:
+            def write():
+                with stage('write', 'a_out.csv'):
+                    pass
+            t = threading.Thread(target=bind(write))
+        t.start()
+        t.join()
+        self.assertEqual(['write'], [e['stage'] for e in recorder.events])
+        self.assertEqual(t.ident, recorder.events[0]['tid'])
+
+    @unittest.skipIf(not hasattr(tracemalloc, 'reset_peak'), 'tracemalloc.reset_peak not available')
+    def test_peak_memory(self):
+        tracemalloc.start()
+        try:
+            with recording('a.csv') as recorder:
+                with stage('run'):
+                    with stage('load'):
+                        data = bytearray(10000000)
+                        del data
+        finally:
+            tracemalloc.stop()
+        (load, run) = recorder.events
+        self.assertGreaterEqual(load['peak_memory'], 10000000)
+        # outer stage keeps peak of inner stage
+        self.assertGreaterEqual(run['peak_memory'], 10000000)
+
+    @unittest.skipIf(not hasattr(tracemalloc, 'reset_peak'), 'tracemalloc.reset_peak not available')
+    def test_overlapping_threads(self):
+        opened = threading.Event()
+        release = threading.Event()
+
+        def reader():
+            with recording('b.csv') as recorder:
+                with stage('load'):
+                    opened.set()
+                    release.wait(5)
+            events.extend(recorder.events)
+
+        events = []
+        startMemory()
+        try:
+            with recording('a.csv') as recorder:
+                with stage('alone'):
+                    pass
+                t = threading.Thread(target=reader)
+                t.start()
+                opened.wait(5)
+                with stage('run'):
+                    release.set()
+                    t.join()
+        finally:
+            stopMemory()
+        (alone, run) = recorder.events
+        self.assertIn('peak_memory', alone)
+        # memory of other thread is counted in the same peak - not recorded for either stage
+        self.assertNotIn('peak_memory', run)
+        self.assertNotIn('peak_memory', events[0])
+
+    def test_memory_shared_by_runs(self):
+        if tracemalloc.is_tracing():
+            self.skipTest('tracemalloc already tracing')
+        startMemory()
+        startMemory()
+        stopMemory()
+        # still tracing for the other run
+        self.assertTrue(tracemalloc.is_tracing())
+        stopMemory()
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_timed_write(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with recording('Control') as recorder:
+                with timed_write(join(tmpdir, 'Control_Batch.csv'), 2) as tmpfile:
+                    with open(tmpfile, 'w') as f:
+                        f.write('a\n1\n2\n')
+        finally:
+            shutil.rmtree(tmpdir)
+        (write,) = recorder.events
+        self.assertEqual(('write', 2, 6), (write['stage'], write['rows_in'], write['bytes_out']))
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        with recording('a.csv') as recorder:
+            with stage('run'):
+                with stage('load') as event:
+                    event['bytes_in'] = 100
+        self.events = recorder.events
+        for e in self.events:
+            e['process'] = 'process1'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_trace(self):
+        tracefile = saveTrace(self.events, join(self.tmpdir, 'trace.json'))
+        with open(tracefile) as f:
+            trace = json.load(f)['traceEvents']
+        self.assertEqual(['load a.csv', 'run a.csv'], [e['name'] for e in trace])
+        self.assertEqual(['X', 'X'], [e['ph'] for e in trace])
+        self.assertEqual(100, trace[0]['args']['bytes_in'])
+        self.assertEqual(0, min([e['ts'] for e in trace]))
+
+    def test_summary(self):
+        summaryfile = saveSummary(self.events, join(self.tmpdir, 'summary.csv'))
+        with open(summaryfile) as f:
+            rows = list(csv.DictReader(f))
+        # in order of start
+        self.assertEqual(['run', 'load'], [r['stage'] for r in rows])
+        self.assertEqual('100', rows[1]['bytes_in'])
+        self.assertEqual('process1', rows[0]['process'])
@@ -0,0 +1,50 @@
+import shutil
+import tempfile
+from os.path import join
+
+import unittest2 as unittest
+
+from autoanalysis.db.journal import RunJournal
+
+
+class TestRunJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.journal = RunJournal(join(self.tmpdir, 'runjournal.db'))
+        self.filenames = {'all': ['a.csv', 'b.csv'], 'Control': ['a.csv', 'b.csv']}
+        self.output = join(self.tmpdir, 'a_Filtered.csv')
+        open(self.output, 'w').close()
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_run(self):
+        runid = self.journal.startRun('pipeline', 'general', ['process1'], self.tmpdir, self.filenames,
+                                      {'workers': 2})
+        run = self.journal.getRun(runid)
+        self.assertEqual(self.filenames, run['filenames'])
+        self.assertEqual(['process1'], run['processes'])
+        self.assertEqual({'workers': 2}, run['options'])
+        self.assertEqual([runid], self.journal.getUnfinished())
+        self.journal.endRun(runid, 'done')
+        self.assertEqual([], self.journal.getUnfinished())
+        self.assertIsNone(self.journal.getRun(runid + 1))
+
+    def test_completed(self):
+        runid = self.journal.startRun('process', 'general', ['process1'], 'local', self.filenames, {})
+        self.journal.recordFile(runid, 'process1', 'a.csv', 'done', self.output, 1.0, 2.0)
+        self.journal.recordFile(runid, 'process1', 'b.csv', 'failed', error=ValueError('bad'))
+        self.journal.recordFile(runid, 'process1', 'c.csv', 'done', join(self.tmpdir, 'missing.csv'))
+        self.journal.recordFile(runid, 'process3', 'Control', 'done', [self.output])
+        completed = self.journal.getCompleted(runid)
+        self.assertEqual({('process1', 'a.csv'): self.output, ('process3', 'Control'): [self.output]}, completed)
+        failed = self.journal.getFiles(runid, 'failed')
+        self.assertEqual('bad', failed[0][6])
+
+    def test_reopen(self):
+        runid = self.journal.startRun('process', 'general', ['process1'], 'local', self.filenames, {})
+        self.journal.recordFile(runid, 'process1', 'a.csv', 'done', self.output)
+        journal = RunJournal(self.journal.dbfile)
+        self.assertEqual(1, len(journal.getCompleted(runid)))
+        journal.close()
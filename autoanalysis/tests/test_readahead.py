@@ -0,0 +1,81 @@
+import threading
+import time
+
+import unittest2 as unittest
+
+from autoanalysis.readahead import prefetch, AsyncWriter
+
+
+class Loader():
+    """Records number of items loaded but not yet used"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ahead = 0
+        self.maxahead = 0
+
+    def __call__(self, item):
+        if item == 'bad':
+            raise ValueError(item)
+        with self.lock:
+            self.ahead += 1
+            self.maxahead = max(self.maxahead, self.ahead)
+        return item * 2
+
+    def used(self):
+        with self.lock:
+            self.ahead -= 1
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_order(self):
+        loader = Loader()
+        items = list(range(20))
+        results = []
+        for (item, value) in prefetch(loader, items, 3):
+            results.append((item, value))
+            time.sleep(0.001)
+            loader.used()
+        self.assertEqual([(i, i * 2) for i in items], results)
+        # current item and at most depth loaded ahead
+        self.assertLessEqual(loader.maxahead, 4)
+
+    def test_no_prefetch(self):
+        loader = Loader()
+        self.assertEqual([(1, 2), (2, 4)], list(prefetch(loader, [1, 2], 0)))
+
+    def test_error(self):
+        results = prefetch(Loader(), [1, 'bad', 3], 2)
+        self.assertEqual((1, 2), next(results))
+        self.assertRaises(ValueError, next, results)
+
+
+class TestAsyncWriter(unittest.TestCase):
+    def test_write(self):
+        writer = AsyncWriter(2)
+        written = []
+        futures = [writer.submit(written.append, i) for i in range(10)]
+        writer.close()
+        self.assertEqual(list(range(10)), written)
+        self.assertTrue(all([f.done() for f in futures]))
+
+    def test_bounded(self):
+        writer = AsyncWriter(1)
+        release = threading.Event()
+        writer.submit(release.wait)
+        queued = []
+        t = threading.Thread(target=lambda: queued.append(writer.submit(time.sleep, 0)))
+        t.start()
+        t.join(0.1)
+        # second write waits until first is done
+        self.assertEqual([], queued)
+        release.set()
+        t.join(5)
+        self.assertEqual(1, len(queued))
+        writer.close()
+
+    def test_error(self):
+        writer = AsyncWriter(2)
+        future = writer.submit(int, 'x')
+        writer.close()
+        self.assertIsInstance(future.exception(), ValueError)
@@ -0,0 +1,78 @@
+import threading
+
+import unittest2 as unittest
+
+from autoanalysis.scheduler import RunScheduler, QUEUED, RUNNING, DONE, CANCELLED
+
+
+class Starter():
+    """Records runs started by the scheduler"""
+
+    def __init__(self):
+        self.started = {}
+
+    def __call__(self, runid, cpus):
+        self.started[runid] = cpus
+
+
+class TestRunScheduler(unittest.TestCase):
+    def setUp(self):
+        self.starter = Starter()
+        self.scheduler = RunScheduler(cpus=4, memory=1000)
+
+    def submit(self, cpus=1, memory=0, reads=(), writes=(), paths=('/data',)):
+        return self.scheduler.submit('test', self.starter, cpus, memory, reads, writes, paths)
+
+    def test_independent_runs(self):
+        r1 = self.submit(2, reads=['DATA_FILENAME'], writes=['FILTERED_FILENAME'], paths=['/data/a'])
+        r2 = self.submit(2, reads=['DATA_FILENAME'], writes=['FILTERED_FILENAME'], paths=['/data/b'])
+        self.assertEqual({r1: 2, r2: 2}, self.starter.started)
+
+    def test_dependent_runs(self):
+        r1 = self.submit(1, reads=['DATA_FILENAME'], writes=['FILTERED_FILENAME'])
+        r2 = self.submit(1, reads=['FILTERED_FILENAME'], writes=['HISTOGRAM_FILENAME'], paths=['/data/processed'])
+        r3 = self.submit(1, reads=['DATA_FILENAME'], writes=['OTHER_FILENAME'])
+        self.assertEqual(RUNNING, self.scheduler.getState(r1))
+        self.assertEqual(QUEUED, self.scheduler.getState(r2))
+        # later independent run is not held up by waiting run
+        self.assertEqual(RUNNING, self.scheduler.getState(r3))
+        self.scheduler.finish(r1)
+        self.assertEqual(RUNNING, self.scheduler.getState(r2))
+
+    def test_cpu_budget(self):
+        r1 = self.submit(3)
+        r2 = self.submit(3)
+        self.assertEqual(3, self.starter.started[r1])
+        # given remaining workers
+        self.assertEqual(1, self.starter.started[r2])
+        r3 = self.submit(1)
+        self.assertEqual(QUEUED, self.scheduler.getState(r3))
+        self.scheduler.finish(r2)
+        self.assertEqual(RUNNING, self.scheduler.getState(r3))
+
+    def test_memory_budget(self):
+        r1 = self.submit(2, memory=800)
+        r2 = self.submit(2, memory=800)
+        self.assertEqual(QUEUED, self.scheduler.getState(r2))
+        self.scheduler.finish(r1)
+        self.assertEqual(2, self.starter.started[r2])
+
+    def test_always_run(self):
+        r1 = self.submit(8, memory=5000)
+        self.assertEqual(8, self.starter.started[r1])
+
+    def test_cancel_queued(self):
+        r1 = self.submit(4)
+        r2 = self.submit(1)
+        self.assertTrue(self.scheduler.cancel(r2))
+        self.assertFalse(self.scheduler.cancel(r1))
+        self.scheduler.finish(r1)
+        self.assertEqual(CANCELLED, self.scheduler.getState(r2))
+        self.assertNotIn(r2, self.starter.started)
+
+    def test_wait(self):
+        r1 = self.submit(1)
+        self.assertFalse(self.scheduler.wait(r1, 0.01))
+        threading.Timer(0.05, self.scheduler.finish, (r1,)).start()
+        self.assertTrue(self.scheduler.wait(timeout=5))
+        self.assertEqual(DONE, self.scheduler.getState(r1))
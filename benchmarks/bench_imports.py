@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark import times for startup of the app, command line and worker processes
+    1. Imports each module in a new interpreter and prints median time (ms) over repeats
+    2. Starts a worker pool (spawn, as on Windows) and prints time until first task completes
+       - with the engine only and with the engine and a process module loaded by the worker
+
+Run from the top level directory: python benchmarks/bench_imports.py --repeats 5
+"""
+
+import argparse
+import importlib
+import subprocess
+import sys
+import time
+from multiprocessing import get_context
+from statistics import median
+
+MODULES = ['autoanalysis.engine',
+           'autoanalysis.controller',
+           'autoanalysis.processmodules.Filter',
+           'autoanalysis.processmodules.Histogram',
+           'autoanalysis.processmodules.Batch']
+
+
+def importTime(module):
+    """
+    Time import of module in a new interpreter
+    :param module: module name
+    :return: time in ms or None if import fails
+    """
+    code = "import time;t=time.perf_counter();import %s;print((time.perf_counter()-t)*1000)" % module
+    p = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if p.returncode != 0:
+        return None
+    return float(p.stdout.decode().strip().splitlines()[-1])
+
+
+def loadModule(module=None):
+    """Task for worker - import module as processFile does"""
+    import autoanalysis.engine
+    if module is not None:
+        importlib.import_module(module)
+    return module
+
+
+def spawnTime(module=None):
+    """
+    Time from starting a spawned worker to first task completed
+    :param module: module imported by task or None for engine only
+    :return: time in ms
+    """
+    t = time.perf_counter()
+    pool = get_context('spawn').Pool(1)
+    try:
+        pool.apply(loadModule, (module,))
+        return (time.perf_counter() - t) * 1000
+    finally:
+        pool.terminate()
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog=sys.argv[0],
+                                     description='''\
+                Import times for autoanalysis modules and worker startup
+                 ''')
+    parser.add_argument('--repeats', action='store', type=int, help='Number of repeats', default=5)
+    return parser
+
+
+############### MAIN ############################
+if __name__ == "__main__":
+    parser = create_parser()
+    args = parser.parse_args()
+    print("%-40s %12s" % ('import', 'median(ms)'))
+    for m in MODULES:
+        times = [importTime(m) for i in range(args.repeats)]
+        if None in times:
+            print("%-40s %12s" % (m, 'failed'))
+        else:
+            print("%-40s %12.0f" % (m, median(times)))
+    print("\n%-40s %12s" % ('worker spawn', 'median(ms)'))
+    for m in [None, 'autoanalysis.processmodules.Filter']:
+        times = [spawnTime(m) for i in range(args.repeats)]
+        print("%-40s %12.0f" % ('engine' if m is None else 'engine + ' + m.split('.')[-1], median(times)))
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark intermediate file formats for Filter -> Histogram -> Batch
+    1. Generates wide CSV files (like CellProfiler exports) in a temp directory
+    2. Runs the processes with filtered output as CSV then as binary (npz, feather if installed)
+    3. Prints time per stage and size of intermediate files for each format
+
+Run from the top level directory: python benchmarks/bench_intermediate.py --files 50 --rows 20000
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+from glob import iglob
+from os import mkdir
+from os.path import join, getsize
+
+import numpy as np
+import pandas as pd
+
+from autoanalysis.processmodules.Batch import AutoBatch
+from autoanalysis.processmodules.Filter import AutoFilter
+from autoanalysis.processmodules.Histogram import AutoHistogram
+
+
+def generateData(inputdir, files, rows, cols):
+    """
+    Write test CSV files with one data column and many extra columns
+    :return: list of filenames
+    """
+    rng = np.random.RandomState(0)
+    filenames = []
+    for i in range(files):
+        df = pd.DataFrame(rng.rand(rows, cols) * 100, columns=['Extra_%d' % c for c in range(cols)])
+        df['log10D'] = rng.normal(-1, 0.5, rows)
+        fname = join(inputdir, 'Cell%03d_Image.csv' % i)
+        df.to_csv(fname, index=False)
+        filenames.append(fname)
+    return filenames
+
+
+def runStages(filenames, outputdir, suffix, allcolumns):
+    """
+    Run Filter, Histogram and Batch with filtered files saved as suffix
+    :return: dict of stage times (secs) and intermediate size (bytes)
+    """
+    times = {}
+    t0 = time.time()
+    filtered = []
+    for f in filenames:
+        mod = AutoFilter(f, outputdir)
+        cfg = mod.getConfigurables()
+        cfg.update({'COLUMN': 'log10D', 'MINRANGE': -5, 'MAXRANGE': 1, 'OUTPUTALLCOLUMNS': allcolumns,
+                    'FILTERED_FILENAME': 'Filtered' + suffix})
+        mod.setConfigurables(cfg)
+        filtered.append(mod.run())
+    times['filter'] = time.time() - t0
+
+    t0 = time.time()
+    for f in filtered:
+        mod = AutoHistogram(f, outputdir)
+        cfg = mod.getConfigurables()
+        cfg.update({'COLUMN': 'log10D', 'BINWIDTH': 0.2, 'HISTOGRAM_FILENAME': 'Histogram.csv'})
+        mod.setConfigurables(cfg)
+        mod.run()
+    times['histogram'] = time.time() - t0
+
+    t0 = time.time()
+    batch = AutoBatch(filtered, outputdir)
+    cfg = batch.getConfigurables()
+    cfg['BATCH_COLUMN_NAMES'] = 'log10D'
+    batch.setConfigurables(cfg)
+    batch.run()
+    times['batch'] = time.time() - t0
+    times['size'] = sum([getsize(f) for f in filtered])
+    return times
+
+
+def create_parser():
+    import sys
+    parser = argparse.ArgumentParser(prog=sys.argv[0],
+                                     description='''\
+                Compare CSV and binary intermediate files between processes
+                 ''')
+    parser.add_argument('--files', action='store', type=int, help='Number of data files', default=20)
+    parser.add_argument('--rows', action='store', type=int, help='Rows per file', default=20000)
+    parser.add_argument('--cols', action='store', type=int, help='Extra columns per file', default=50)
+    parser.add_argument('--allcolumns', action='store', help='OUTPUTALLCOLUMNS for filter', default='1')
+    return parser
+
+
+############### MAIN ############################
+if __name__ == "__main__":
+    parser = create_parser()
+    args = parser.parse_args()
+    formats = ['.csv', '.npz']
+    try:
+        import pyarrow
+        formats.append('.feather')
+    except ImportError:
+        print("pyarrow not installed - skipping feather")
+    tmpdir = tempfile.mkdtemp()
+    try:
+        inputdir = join(tmpdir, 'input')
+        mkdir(inputdir)
+        filenames = generateData(inputdir, args.files, args.rows, args.cols)
+        results = {}
+        for suffix in formats:
+            outputdir = join(tmpdir, 'output' + suffix.replace('.', '_'))
+            mkdir(outputdir)
+            results[suffix] = runStages(filenames, outputdir, suffix, args.allcolumns)
+        print("\n%d files x %d rows x %d columns (OUTPUTALLCOLUMNS=%s)" % (args.files, args.rows, args.cols + 1,
+                                                                        args.allcolumns))
+        print("%-10s %10s %10s %10s %10s %12s" % ('format', 'filter(s)', 'hist(s)', 'batch(s)', 'total(s)', 'size(MB)'))
+        for suffix in formats:
+            r = results[suffix]
+            total = r['filter'] + r['histogram'] + r['batch']
+            print("%-10s %10.2f %10.2f %10.2f %10.2f %12.1f" % (suffix, r['filter'], r['histogram'], r['batch'],
+                                                             total, r['size'] / 1e6))
+    finally:
+        shutil.rmtree(tmpdir)